@@ -24,53 +24,68 @@ pd.set_option('display.max_columns', None)
 
 folderpath = None
 
-script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
-
 PROGRAM_VERSION = "0.20"
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER_ROOT = os.path.join(script_dir, "uploads")
 
-# Clean the upload folder
-cleanup_directory(UPLOAD_FOLDER_ROOT)
-
-# %%
-app = Dash(suppress_callback_exceptions=True, external_stylesheets=[dbc.themes.FLATLY], external_scripts=[
-      'https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.4/MathJax.js?config=TeX-MML-AM_CHTML'])
-
-dash_uploader.configure_upload(app, UPLOAD_FOLDER_ROOT)
-
-hdf5_tab = make_hdf5_tab(UPLOAD_FOLDER_ROOT)
-edx_tab = make_edx_tab(UPLOAD_FOLDER_ROOT)
-profil_tab = make_profil_tab(UPLOAD_FOLDER_ROOT)
-moke_tab = make_moke_tab(UPLOAD_FOLDER_ROOT)
-xrd_tab = make_xrd_tab(UPLOAD_FOLDER_ROOT)
-
-# Defining the main window layout
-app.layout = dbc.Container(
-    children=[
-        dbc.Tabs(
-            id="tabs",
-            active_tab="hdf5",
-            children=[hdf5_tab, edx_tab, profil_tab, moke_tab, xrd_tab],
-
-        ),
-        widget_browser_modal(),
-        widget_layer_modal(),
-        widget_new_hdf5_modal(),
-        dcc.Store(id="hdf5_path_store", storage_type="local"),
-        dcc.Store(id="data_path_store", storage_type="local"),
-        dcc.Store(id="browser_source_id"),
-    ],
-    fluid=True,
-)
 
-callbacks_browser.callbacks_browser(app)
-callbacks_hdf5.callbacks_hdf5(app)
-callbacks_profil.callbacks_profil(app)
-callbacks_edx.callbacks_edx(app)
-callbacks_moke.callbacks_moke(app)
-callbacks_xrd.callbacks_xrd(app)
-# callbacks_freeplot.callbacks_freeplot(app)
+def create_app():
+    """
+    Build the Dash app. Only the process serving the app calls it: the worker processes of the compilers are spawned
+    and import this module, they must neither clean the upload folder nor build an app of their own.
+
+    @return: Dash app
+    """
+    os.chdir(script_dir)
+
+    # Clean the upload folder
+    cleanup_directory(UPLOAD_FOLDER_ROOT)
+
+    # Results dataframes evicted from memory are spilled next to the uploads, cleaned at every start
+    configure_results_store(spill_dir=os.path.join(UPLOAD_FOLDER_ROOT, "results_store"))
+
+    app = Dash(suppress_callback_exceptions=True, external_stylesheets=[dbc.themes.FLATLY], external_scripts=[
+          'https://cdnjs.cloudflare.com/ajax/libs/mathjax/2.7.4/MathJax.js?config=TeX-MML-AM_CHTML'])
+
+    dash_uploader.configure_upload(app, UPLOAD_FOLDER_ROOT)
+
+    hdf5_tab = make_hdf5_tab(UPLOAD_FOLDER_ROOT)
+    edx_tab = make_edx_tab(UPLOAD_FOLDER_ROOT)
+    profil_tab = make_profil_tab(UPLOAD_FOLDER_ROOT)
+    moke_tab = make_moke_tab(UPLOAD_FOLDER_ROOT)
+    xrd_tab = make_xrd_tab(UPLOAD_FOLDER_ROOT)
+
+    # Defining the main window layout
+    app.layout = dbc.Container(
+        children=[
+            dbc.Tabs(
+                id="tabs",
+                active_tab="hdf5",
+                children=[hdf5_tab, edx_tab, profil_tab, moke_tab, xrd_tab],
+
+            ),
+            widget_browser_modal(),
+            widget_layer_modal(),
+            widget_new_hdf5_modal(),
+            dcc.Store(id="hdf5_path_store", storage_type="local"),
+            dcc.Store(id="data_path_store", storage_type="local"),
+            dcc.Store(id="browser_source_id"),
+        ],
+        fluid=True,
+    )
+
+    callbacks_browser.callbacks_browser(app)
+    callbacks_hdf5.callbacks_hdf5(app)
+    callbacks_profil.callbacks_profil(app)
+    callbacks_edx.callbacks_edx(app)
+    callbacks_moke.callbacks_moke(app)
+    callbacks_xrd.callbacks_xrd(app)
+    # callbacks_freeplot.callbacks_freeplot(app)
+
+    return app
+
 
 if __name__ == "__main__":
+    app = create_app()
     app.run(debug=True, port=8050)
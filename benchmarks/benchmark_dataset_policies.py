@@ -0,0 +1,102 @@
+"""
+Size and read throughput of the dataset creation policies on synthetic data shaped like our libraries.
+Run from the repository root with: python -m benchmarks.benchmark_dataset_policies
+"""
+
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from modules.hdf5_compilers.hdf5compile_policy import DATASET_POLICIES, create_policy_dataset
+
+
+def make_policy_benchmark_samples():
+    """
+    Synthetic data shaped like our libraries: XRD detector frames, MOKE shots and EDX spectra.
+
+    @return: dict {(instrument, role, name): array}
+    """
+    rng = np.random.default_rng(0)
+
+    # Mostly dark detector with a few diffraction rings
+    yy, xx = np.mgrid[0:775, 0:385]
+    radius = np.hypot(yy - 387, xx + 200)
+    rings = sum(400 * np.exp(-((radius - r) ** 2) / 8) for r in [260, 330, 410, 470])
+    detector_image = rng.poisson(rings + 2).astype("int32")
+
+    # 10 shots of an oscilloscope trace, 8 bit vertical resolution
+    samples = np.linspace(0, 4 * np.pi, 10000)
+    shots = np.stack([np.tanh(5 * np.sin(samples + 0.01 * i)) for i in range(10)], axis=1)
+    shots = np.round((shots + rng.normal(0, 0.02, shots.shape)) * 127) / 127 * 0.05
+
+    energy = np.linspace(0, 20, 2048)
+    spectrum = rng.poisson(1000 * np.exp(-((energy - 6.4) ** 2) / 0.01) + 20).astype("int64")
+
+    return {
+        ("xrd", "detector_image", "2Dimage"): detector_image,
+        ("moke", "trace", "magnetization"): shots,
+        ("moke", "trace", "integrated_pulse"): np.cumsum(shots, axis=0),
+        ("edx", "spectrum", "counts"): spectrum,
+        ("edx", "axis", "energy"): energy,
+    }
+
+
+def benchmark_dataset_policies(samples=None, policy_list=None, copies=20, repeat=3):
+    """
+    Write every sample with every policy to a temporary file, then report file size and read throughput.
+
+    @param samples: dict {(instrument, role, name): array}, make_policy_benchmark_samples() if None
+    @param policy_list: names of the policies to compare, all DATASET_POLICIES if None
+    @param copies: number of copies of each sample written, mimicking the positions of a wafer
+    @param repeat: number of full reads, the best one is kept
+    @return: DataFrame with one row per policy and role
+    """
+    if samples is None:
+        samples = make_policy_benchmark_samples()
+    if policy_list is None:
+        policy_list = list(DATASET_POLICIES)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for policy_name in policy_list:
+            for (instrument, role, name), data in samples.items():
+                file_path = os.path.join(temp_dir, f"{policy_name}_{instrument}_{name}.h5")
+
+                start = time.perf_counter()
+                with h5py.File(file_path, "w") as hdf5_file:
+                    for i in range(copies):
+                        group = hdf5_file.create_group(f"position_{i}")
+                        create_policy_dataset(group, name, data, role, instrument=instrument, policy=policy_name)
+                write_time = time.perf_counter() - start
+
+                read_time = np.inf
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    with h5py.File(file_path, "r") as hdf5_file:
+                        for i in range(copies):
+                            hdf5_file[f"position_{i}/{name}"][()]
+                    read_time = min(read_time, time.perf_counter() - start)
+
+                raw_bytes = np.asarray(data).nbytes * copies
+                rows.append(
+                    {
+                        "policy": policy_name,
+                        "instrument": instrument,
+                        "role": role,
+                        "name": name,
+                        "file_size (MB)": os.path.getsize(file_path) / 1e6,
+                        "ratio": raw_bytes / os.path.getsize(file_path),
+                        "write (s)": write_time,
+                        "read (MB/s)": raw_bytes / 1e6 / read_time,
+                    }
+                )
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    print(benchmark_dataset_policies().to_string(index=False))
@@ -0,0 +1,120 @@
+"""
+Speed of the MOKE text readers on a synthetic measurement folder, or on a real one given as argument.
+Run from the repository root with: python -m benchmarks.benchmark_moke_parsers [source_folder]
+"""
+
+import sys
+import tempfile
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from modules.functions.functions_moke import moke_make_path_dictionary
+from modules.hdf5_compilers.hdf5compile_moke import (
+    MOKE_PARSE_WORKERS,
+    moke_iterate_position_data,
+    moke_scan_source_folder,
+    moke_start_parse_pool,
+    read_data_from_moke,
+)
+
+
+def make_moke_benchmark_folder(folder_path, nb_positions=50, nb_samples=10000, nb_shots=10):
+    """
+    Write a synthetic MOKE measurement folder: info.txt and the magnetization, pulse and sum files of every
+    p-number, tab separated with a header line and a trailing tab like the acquisition software.
+
+    @param folder_path: folder to be filled
+    @param nb_positions: number of p-numbers
+    @param nb_samples: number of samples per shot
+    @param nb_shots: number of shots per position
+    @return: None
+    """
+    folder_path = Path(folder_path)
+    rng = np.random.default_rng(0)
+    with open(folder_path / "info.txt", "w") as file:
+        file.write("#Benchmark\n#18/10/2026\nNumber of shots=10\n")
+
+    header = "".join(f"Shot {i + 1}\t" for i in range(nb_shots)) + "\n"
+    phase = np.linspace(0, 4 * np.pi, nb_samples)[:, None]
+    for p_number in range(1, nb_positions + 1):
+        x_pos, y_pos = (p_number % 10) * 5 - 25, (p_number // 10) * 5 - 25
+        signal_dict = {
+            "magnetization": np.tanh(5 * np.sin(phase)) * 0.05 + rng.normal(0, 1e-3, (nb_samples, nb_shots)),
+            "pulse": np.cos(phase) * 0.4 + rng.normal(0, 1e-3, (nb_samples, nb_shots)),
+            "sum": 1.2 + rng.normal(0, 1e-3, (nb_samples, nb_shots)),
+        }
+        for kind, signal in signal_dict.items():
+            with open(folder_path / f"p{p_number}_x{x_pos}.0_y{y_pos}.0_{kind}.txt", "w") as file:
+                file.write(header)
+                np.savetxt(file, signal, fmt="%.6e", delimiter="\t", newline="\t\n")
+
+
+def benchmark_moke_parsers(source_path=None, workers=MOKE_PARSE_WORKERS, repeat=3):
+    """
+    Compare the pandas reader with the fast reader, in the main process and in parallel.
+    A synthetic folder is written if no source is given.
+
+    @param source_path: folder containing a MOKE measurement, synthetic data if None
+    @param workers: number of processes of the parallel reader, every core if None
+    @param repeat: number of full reads, the best one is kept
+    @return: DataFrame with one row per reader
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if source_path is None:
+            source_path = temp_dir
+            make_moke_benchmark_folder(source_path)
+        source_path = Path(source_path)
+
+        def pandas_reader():
+            path_dict = moke_make_path_dictionary(source_path)
+            return {scan_number: read_data_from_moke(path_dict[scan_number]) for scan_number in path_dict}
+
+        def fast_reader(reader_workers):
+            _, path_dict = moke_scan_source_folder(source_path)
+            with moke_start_parse_pool(path_dict, workers=reader_workers) or nullcontext() as executor:
+                return {
+                    scan_number: data
+                    for scan_number, _, data in moke_iterate_position_data(path_dict, executor)
+                }
+
+        reader_dict = {
+            "pandas": pandas_reader,
+            "fast": lambda: fast_reader(1),
+            "fast parallel": lambda: fast_reader(workers),
+        }
+
+        reference = None
+        rows = []
+        for reader_name, reader in reader_dict.items():
+            best_time = np.inf
+            for _ in range(repeat):
+                start = time.perf_counter()
+                data_dict = reader()
+                best_time = min(best_time, time.perf_counter() - start)
+            if reference is None:
+                reference = data_dict
+
+            max_difference = max(
+                np.max(np.abs(np.asarray(array, dtype="float") - np.asarray(reference_array, dtype="float")))
+                for scan_number in reference
+                for array, reference_array in zip(data_dict[scan_number], reference[scan_number])
+            )
+            rows.append(
+                {
+                    "reader": reader_name,
+                    "positions": len(data_dict),
+                    "time (s)": best_time,
+                    "speedup": rows[0]["time (s)"] / best_time if rows else 1.0,
+                    "max difference": max_difference,
+                }
+            )
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    print(benchmark_moke_parsers(sys.argv[1] if len(sys.argv) > 1 else None).to_string(index=False))
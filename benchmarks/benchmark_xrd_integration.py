@@ -0,0 +1,104 @@
+"""
+Per frame latency of the XRD integration methods on synthetic images.
+Run from the repository root with: python -m benchmarks.benchmark_xrd_integration [poni_path]
+"""
+
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyFAI
+
+from modules.functions.functions_xrd import (
+    XRD_BATCHED_METHOD,
+    XRD_PYFAI_METHODS,
+    xrd_clear_engine_memory,
+    xrd_integrate_stack,
+    xrd_integrate_with_persisted_engine,
+)
+
+
+def nan_reduce_max(array):
+    """Largest finite value, NaN if there is none"""
+    array = array[np.isfinite(array)]
+    return float(np.max(array)) if array.size else np.nan
+
+
+def benchmark_xrd_integration_methods(poni_path, shape=None, points=1000, frames=5, method_list=None):
+    """
+    Per frame latency of every integration method on synthetic images, with a fresh integrator per method so that
+    the first frame includes the engine setup. The persisted engines are timed when built and when read back from
+    a temporary cache folder, as in a new session. The batched method integrates the frames after the first one as
+    a single stack.
+
+    @param poni_path: path of the PONI file
+    @param shape: shape of the images, the detector shape if None
+    @param points: number of points of the integrated patterns
+    @param frames: number of frames integrated per method
+    @param method_list: keys of XRD_PYFAI_METHODS, every method if None
+    @return: DataFrame with one row per method
+    """
+    if method_list is None:
+        method_list = list(XRD_PYFAI_METHODS)
+    if shape is None:
+        shape = pyFAI.load(str(poni_path)).detector.shape
+
+    rng = np.random.default_rng(0)
+    image_list = [rng.poisson(5, shape).astype("int32") for _ in range(frames)]
+    reference = pyFAI.load(str(poni_path)).integrate1d(
+        image_list[0], points, method=XRD_PYFAI_METHODS["no_csr_cython"], unit="q_nm^-1"
+    )[1]
+
+    def time_method(method, cache_folder):
+        poni = pyFAI.load(str(poni_path))
+        latency_list = []
+        if method == XRD_BATCHED_METHOD:
+            # First frame alone, then the other frames as one stack, reported per frame
+            start = time.perf_counter()
+            first_intensity = xrd_integrate_stack(poni, image_list[:1], points, cache_folder=cache_folder)[1][0]
+            latency_list.append(time.perf_counter() - start)
+            if frames > 1:
+                start = time.perf_counter()
+                xrd_integrate_stack(poni, np.stack(image_list[1:]), points, cache_folder=cache_folder)
+                latency_list += [(time.perf_counter() - start) / (frames - 1)] * (frames - 1)
+        else:
+            for image in image_list:
+                start = time.perf_counter()
+                if XRD_PYFAI_METHODS[method] is None:
+                    intensity = xrd_integrate_with_persisted_engine(poni, image, points, cache_folder=cache_folder)[1]
+                else:
+                    intensity = poni.integrate1d(image, points, method=XRD_PYFAI_METHODS[method], unit="q_nm^-1")[1]
+                latency_list.append(time.perf_counter() - start)
+                if len(latency_list) == 1:
+                    first_intensity = intensity
+        with np.errstate(divide="ignore", invalid="ignore"):
+            difference = nan_reduce_max(np.abs(first_intensity - reference) / np.abs(reference))
+        return latency_list, difference
+
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for method in method_list:
+            runs = [(method, temp_dir)]
+            if XRD_PYFAI_METHODS[method] is None:
+                runs = [(f"{method} (build)", temp_dir), (f"{method} (from disk)", temp_dir)]
+            for run_name, cache_folder in runs:
+                xrd_clear_engine_memory()
+                latency_list, difference = time_method(method, cache_folder)
+                rows.append(
+                    {
+                        "method": run_name,
+                        "first frame (ms)": 1000 * latency_list[0],
+                        "next frames (ms)": 1000 * np.median(latency_list[1:]) if frames > 1 else np.nan,
+                        "max relative difference": difference,
+                    }
+                )
+
+    xrd_clear_engine_memory()
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    poni_path = sys.argv[1] if len(sys.argv) > 1 else "calibrations/esrf_poni/esrf1.poni"
+    print(benchmark_xrd_integration_methods(poni_path).to_string(index=False))
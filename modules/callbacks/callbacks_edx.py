@@ -29,13 +29,12 @@ def callbacks_edx(app):
     )
     @check_conditions(edx_conditions, hdf5_path_index=0)
     def edx_scan_hdf5_for_datasets(hdf5_path):
-        with h5py.File(hdf5_path, "r") as hdf5_file:
-            dataset_list = get_hdf5_datasets(hdf5_file, dataset_type='edx')
+        dataset_list = get_catalog_datasets(hdf5_path, dataset_type='edx')
 
         return dataset_list, dataset_list[0]
     
-    # Reads the given dataset into a DataFrame, then serialize it to json.
-    # Returns the json and the columns of the df as options for the plot selection
+    # Reads the given dataset into a DataFrame, then keeps it in the server-side results store.
+    # Returns the store token and the columns of the df as options for the plot selection
     @app.callback(
         [Output("edx_results_store", "data"),
          Output("edx_heatmap_select", "options"),
@@ -45,18 +44,20 @@ def callbacks_edx(app):
     )
     @check_conditions(edx_conditions, hdf5_path_index=1)
     def edx_read_dataset_into_store(selected_dataset, hdf5_path):
-        with h5py.File(hdf5_path, "r") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
             edx_group = hdf5_file.get(selected_dataset)
             edx_df = edx_make_results_dataframe_from_hdf5(edx_group)
 
             if edx_df is None:
                 raise PreventUpdate
 
-            edx_df_json = edx_df.to_json(orient="split")
+            edx_df_token = put_results_dataframe(
+                edx_df, builder="edx_results", hdf5_path=hdf5_path, dataset_name=selected_dataset
+            )
             # First three columns are x_pos, y_pos and the ignored tag
             options = list(edx_df.columns[3:])
 
-        return edx_df_json, options, None
+        return edx_df_token, options, None
 
     # Callback for heatmap selection
     @app.callback(
@@ -75,8 +76,10 @@ def callbacks_edx(app):
         prevent_initial_call=True,
     )
     @check_conditions(edx_conditions, hdf5_path_index=5)
-    def edx_update_heatmap(heatmap_select,z_min,z_max,precision,edit_toggle,hdf5_path,edx_df_json):
-        edx_df = pd.read_json(StringIO(edx_df_json), orient="split")
+    def edx_update_heatmap(heatmap_select,z_min,z_max,precision,edit_toggle,hdf5_path,edx_df_token):
+        edx_df = get_results_dataframe(edx_df_token)
+        if edx_df is None:
+            raise PreventUpdate
         # Reset colorbar bounds when needed
         if ctx.triggered_id in [
             "edx_heatmap_select",
@@ -100,7 +103,8 @@ def callbacks_edx(app):
 
         fig = make_heatmap_from_dataframe(edx_df, values=heatmap_select, z_min=z_min, z_max=z_max,
                                           plot_title=plot_title, colorbar_title=colorbar_title,
-                                          precision=precision, masking=masking)
+                                          precision=precision, masking=masking,
+                                          grid=get_results_heatmap_grid(edx_df_token))
 
 
         z_min = np.round(fig.data[0].zmin, precision)
@@ -124,7 +128,7 @@ def callbacks_edx(app):
         target_x = position[0]
         target_y = position[1]
 
-        with h5py.File(hdf5_path, 'r') as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, 'r') as hdf5_file:
             edx_group = hdf5_file[selected_dataset]
             measurement_df = edx_get_measurement_from_hdf5(edx_group, target_x, target_y)
 
@@ -161,12 +165,9 @@ def callbacks_edx(app):
         target_x = heatmap_click['points'][0]['x']
         target_y = heatmap_click['points'][0]['y']
 
-        with h5py.File(hdf5_path, 'a') as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, 'a') as hdf5_file:
             edx_group = hdf5_file[selected_dataset]
             position_group = get_target_position_group(edx_group, target_x, target_y)
-            if not position_group.attrs["ignored"]:
-                position_group.attrs["ignored"] = True
-                return f"{target_x}, {target_y} ignore set to True"
-            else:
-                position_group.attrs["ignored"] = False
-                return f"{target_x}, {target_y} ignore set to False"
+            # Keeps the ignored column of the position table in sync with the position attribute
+            ignored = toggle_position_ignored(edx_group, position_group)
+            return f"{target_x}, {target_y} ignore set to {ignored}"
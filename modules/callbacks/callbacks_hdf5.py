@@ -209,7 +209,7 @@ def callbacks_hdf5(app):
         if n_clicks > 0:
             hdf5_path = Path(hdf5_path)
             general_df = None
-            with h5py.File(hdf5_path, "r") as hdf5_file:
+            with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
                 for dataset_name, dataset_group in hdf5_file.items():
                     if dataset_name == "sample":
                         continue
@@ -246,18 +246,25 @@ def callbacks_hdf5(app):
         if n_clicks > 0:
             hdf5_path = Path(hdf5_path)
             checklist = []
-            with h5py.File(hdf5_path, "a") as hdf5_file:
+            with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
                 if "HT_type" not in hdf5_file.attrs or hdf5_file.attrs["HT_type"] == "library":
                     if update_library_hdf5(hdf5_file):
                         checklist.append("[ROOT]")
                 for dataset_name, dataset_group in hdf5_file.items():
                     if dataset_name == "sample":
                         continue
+                    # Datasets compiled before position tables existed get one written
+                    if "positions" in dataset_group and read_position_table(dataset_group) is None:
+                        write_position_table(dataset_group)
+                        checklist.append(f"[POSITIONS] {dataset_name}")
                     if dataset_group.attrs["HT_type"] == "edx":
                         continue
                     if dataset_group.attrs["HT_type"] == "moke":
-                        continue
-                    if dataset_group.attrs["HT_type"] in ["esrf", "xrd"]:
+                        if update_moke_hdf5(dataset_group):
+                            checklist.append(f"[MOKE] {dataset_name}")
+                    if dataset_group.attrs["HT_type"] in ["esrf", "xrd", "xrd_wafer", "xrd_furnace"]:
+                        if update_xrd_hdf5(dataset_group):
+                            checklist.append(f"[XRD] {dataset_name}")
                         continue
                     if dataset_group.attrs["HT_type"] == "profil":
                         if update_dektak_hdf5(dataset_group):
@@ -278,17 +285,16 @@ def callbacks_hdf5(app):
 
         widget_title = widget_title_card("Deposition")
 
-        with h5py.File(hdf5_path, "r") as hdf5_file:
-            if "deposition" not in hdf5_file.keys():
-                return [
-                    widget_title,
-                    widget_measurement_missing()
-                ]
-            else:
-                return [
-                    widget_title,
-                    widget_measurement_found(number = 1)
-                ]
+        if "deposition" not in get_hdf5_catalog(hdf5_path):
+            return [
+                widget_title,
+                widget_measurement_missing()
+            ]
+        else:
+            return [
+                widget_title,
+                widget_measurement_found(number = 1)
+            ]
 
 
     @app.callback(
@@ -301,26 +307,26 @@ def callbacks_hdf5(app):
 
         widget_title = widget_title_card("Annealing")
 
-        with h5py.File(hdf5_path, "r") as hdf5_file:
-            annealing_groups = get_hdf5_datasets(hdf5_file, "annealing")
-            number = len(annealing_groups)
-            if number == 0:
+        catalog = get_hdf5_catalog(hdf5_path)
+        annealing_groups = get_catalog_datasets(hdf5_path, "annealing")
+        number = len(annealing_groups)
+        if number == 0:
+            return [
+                widget_title,
+                widget_measurement_missing()
+            ]
+
+        else:
+            if catalog[annealing_groups[0]]["attrs"]["data_source"] == "manual":
                 return [
                     widget_title,
-                    widget_measurement_missing()
+                    widget_manual_data(number)
                 ]
-
             else:
-                if hdf5_file[annealing_groups[0]].attrs["data_source"] == "manual":
-                    return [
-                        widget_title,
-                        widget_manual_data(number)
-                    ]
-                else:
-                    return [
-                        widget_title,
-                        widget_measurement_found(number)
-                    ]
+                return [
+                    widget_title,
+                    widget_measurement_found(number)
+                ]
 
     @app.callback(
         Output("hdf5_edx_info", "children"),
@@ -332,20 +338,19 @@ def callbacks_hdf5(app):
 
         widget_title = widget_title_card("EDX")
 
-        with h5py.File(hdf5_path, "r") as hdf5_file:
-            edx_groups = get_hdf5_datasets(hdf5_file, "edx")
-            number = len(edx_groups)
-            if number == 0:
-                return [
-                    widget_title,
-                    widget_measurement_missing()
-                ]
+        edx_groups = get_catalog_datasets(hdf5_path, "edx")
+        number = len(edx_groups)
+        if number == 0:
+            return [
+                widget_title,
+                widget_measurement_missing()
+            ]
 
-            else:
-                return [
-                    widget_title,
-                    widget_measurement_found(number)
-                ]
+        else:
+            return [
+                widget_title,
+                widget_measurement_found(number)
+            ]
 
     @app.callback(
         Output("hdf5_profil_info", "children"),
@@ -357,20 +362,19 @@ def callbacks_hdf5(app):
 
         widget_title = widget_title_card("Profilometry")
 
-        with h5py.File(hdf5_path, "r") as hdf5_file:
-            profil_groups = get_hdf5_datasets(hdf5_file, "profil")
-            number = len(profil_groups)
-            if number == 0:
-                return [
-                    widget_title,
-                    widget_measurement_missing()
-                ]
+        profil_groups = get_catalog_datasets(hdf5_path, "profil")
+        number = len(profil_groups)
+        if number == 0:
+            return [
+                widget_title,
+                widget_measurement_missing()
+            ]
 
-            else:
-                return [
-                    widget_title,
-                    widget_measurement_found(number)
-                ]
+        else:
+            return [
+                widget_title,
+                widget_measurement_found(number)
+            ]
 
     @app.callback(
         Output("hdf5_moke_info", "children"),
@@ -382,20 +386,19 @@ def callbacks_hdf5(app):
 
         widget_title = widget_title_card("Moke")
 
-        with h5py.File(hdf5_path, "r") as hdf5_file:
-            moke_groups = get_hdf5_datasets(hdf5_file, "moke")
-            number = len(moke_groups)
-            if number == 0:
-                return [
-                    widget_title,
-                    widget_measurement_missing()
-                ]
+        moke_groups = get_catalog_datasets(hdf5_path, "moke")
+        number = len(moke_groups)
+        if number == 0:
+            return [
+                widget_title,
+                widget_measurement_missing()
+            ]
 
-            else:
-                return [
-                    widget_title,
-                    widget_measurement_found(number)
-                ]
+        else:
+            return [
+                widget_title,
+                widget_measurement_found(number)
+            ]
 
     @app.callback(
         Output("hdf5_xrd_info", "children"),
@@ -407,20 +410,19 @@ def callbacks_hdf5(app):
 
         widget_title = widget_title_card("XRD")
 
-        with h5py.File(hdf5_path, "r") as hdf5_file:
-            xrd_groups = get_hdf5_datasets(hdf5_file, "xrd")
-            number = len(xrd_groups)
-            if number == 0:
-                return [
-                    widget_title,
-                    widget_measurement_missing()
-                ]
+        xrd_groups = get_catalog_datasets(hdf5_path, "xrd")
+        number = len(xrd_groups)
+        if number == 0:
+            return [
+                widget_title,
+                widget_measurement_missing()
+            ]
 
-            else:
-                return [
-                    widget_title,
-                    widget_measurement_found(number)
-                ]
+        else:
+            return [
+                widget_title,
+                widget_measurement_found(number)
+            ]
 
 
     @app.callback(
@@ -460,8 +462,7 @@ def callbacks_hdf5(app):
         ]
 
         if measurement_type == "XRD results":
-            with h5py.File(hdf5_path, "r") as hdf5_file:
-                datasets = get_hdf5_datasets(hdf5_file, "xrd")
+            datasets = get_catalog_datasets(hdf5_path, "xrd")
             if not datasets:
                 return new_children, "No ESRF or XRD datasets found in HDF5 file"
             else:
@@ -584,10 +585,11 @@ def callbacks_hdf5(app):
             ]
 
         if measurement_type == "HT hdf5":
-            with h5py.File(upload_path, "r") as hdf5_file:
-                datasets = get_hdf5_datasets(hdf5_file, dataset_type="all")
-                if "sample" in datasets:
-                    datasets.remove("sample")
+            datasets = get_catalog_datasets(upload_path, dataset_type="all")
+            # The uploaded file is only scanned once, its handle must not stay in the pool
+            release_pooled_hdf5_file(upload_path)
+            if "sample" in datasets:
+                datasets.remove("sample")
             if not datasets:
                 return new_children, "No datasets found in HDF5 file"
             new_children = [
@@ -720,7 +722,7 @@ def callbacks_hdf5(app):
     def layer_editor_load_values(index, hdf5_path, is_open):
         if not is_open:
             raise PreventUpdate
-        with h5py.File(hdf5_path, "r") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
             layer_group = hdf5_file.get(f"sample/layer_{index}")
             if layer_group is None:
                 return None, None, None, None, None, None, None, None, None
@@ -765,7 +767,7 @@ def callbacks_hdf5(app):
                 comment = ""
             if None in [type, element, time, thickness, temperature, power, distance, angle, comment]:
                 raise ValueError("All fields must be filled to create a new layer")
-            with h5py.File(hdf5_path, "a") as hdf5_file:
+            with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
                 sample_group = hdf5_file.get("sample")
                 #If layer group exists, overwrite the values
                 if f"layer_{index}" in sample_group:
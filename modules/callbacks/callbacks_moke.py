@@ -1,4 +1,4 @@
-from dash import html, dcc, Input, Output, State, ctx
+from dash import html, dcc, Input, Output, State, ctx, no_update
 
 from ..hdf5_compilers.hdf5compile_moke import *
 
@@ -32,13 +32,12 @@ def callbacks_moke(app):
     )
     @check_conditions(moke_conditions, hdf5_path_index=0)
     def moke_scan_hdf5_for_datasets(hdf5_path):
-        with h5py.File(hdf5_path, "r") as hdf5_file:
-            dataset_list = get_hdf5_datasets(hdf5_file, dataset_type="moke")
+        dataset_list = get_catalog_datasets(hdf5_path, dataset_type="moke")
 
         return dataset_list, dataset_list[0]
     
-    # Reads the given dataset into a DataFrame, then serialize it to json.
-    # Returns the json and the columns of the df as options for the plot selection
+    # Reads the given dataset into a DataFrame, then keeps it in the server-side results store.
+    # Returns the store token and the columns of the df as options for the plot selection
     @app.callback(
         [Output("moke_results_store", "data"),
          Output("moke_heatmap_select", "options"),
@@ -48,18 +47,20 @@ def callbacks_moke(app):
     )
     @check_conditions(moke_conditions, hdf5_path_index=1)
     def moke_read_dataset_into_store(selected_dataset, hdf5_path):
-        with h5py.File(hdf5_path, "r") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
             moke_group = hdf5_file.get(selected_dataset)
             moke_df = moke_make_results_dataframe_from_hdf5(moke_group)
 
             if moke_df is None:
                 raise PreventUpdate
 
-            moke_df_json = moke_df.to_json(orient="split")
+            moke_df_token = put_results_dataframe(
+                moke_df, builder="moke_results", hdf5_path=hdf5_path, dataset_name=selected_dataset
+            )
             # First three columns are x_pos, y_pos and the ignored tag
             options = list(moke_df.columns[3:])
 
-        return moke_df_json, options, None
+        return moke_df_token, options, None
 
     # Callback for heatmap selection
     @app.callback(
@@ -78,8 +79,10 @@ def callbacks_moke(app):
         prevent_initial_call=True,
     )
     @check_conditions(moke_conditions, hdf5_path_index=5)
-    def moke_update_heatmap(heatmap_select,z_min,z_max,precision,edit_toggle,hdf5_path,moke_df_json):
-        moke_df = pd.read_json(StringIO(moke_df_json), orient="split")
+    def moke_update_heatmap(heatmap_select,z_min,z_max,precision,edit_toggle,hdf5_path,moke_df_token):
+        moke_df = get_results_dataframe(moke_df_token)
+        if moke_df is None:
+            raise PreventUpdate
         # Reset colorbar bounds when needed
         if ctx.triggered_id in [
             "moke_heatmap_select",
@@ -110,6 +113,7 @@ def callbacks_moke(app):
             colorbar_title=colorbar_title,
             precision=precision,
             masking=masking,
+            grid=get_results_heatmap_grid(moke_df_token),
         )
 
         z_min = np.round(fig.data[0].zmin, precision)
@@ -144,46 +148,44 @@ def callbacks_moke(app):
 
         fig = go.Figure()
 
-        with h5py.File(hdf5_path, "r") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
             moke_group = hdf5_file[selected_dataset]
-            measurement_df = moke_get_measurement_from_hdf5(
-                moke_group, target_x, target_y
+            # Treated loops are cached, switching plot modes or revisiting a position does not treat them again
+            measurement_df = moke_get_treated_measurement(
+                moke_group, target_x, target_y, treatment_dict
             )
+            # The results are a lazy view of the file, the plots are built before the file is released
             results_dict = moke_get_results_from_hdf5(moke_group, target_x, target_y)
 
-        measurement_df = moke_treat_measurement_dataframe(
-            measurement_df, treatment_dict
-        )
-
-        title_tag = ""
-        if plot_options == "oscilloscope":
-            fig = moke_plot_oscilloscope_from_dataframe(fig, measurement_df)
-            title_tag = "oscilloscope plot"
-        elif plot_options == "loop":
-            fig = moke_plot_loop_from_dataframe(fig, measurement_df)
-            title_tag = "hysteresis loop"
-        elif plot_options == "stored_result":
-            fig = moke_plot_loop_from_dataframe(fig, measurement_df)
-            if heatmap_select == "coercivity_m0_(T)":
-                fig = moke_plot_vlines(
-                    fig,
-                    values=[
-                        results_dict["coercivity_m0"]["negative"],
-                        results_dict["coercivity_m0"]["positive"],
-                    ],
-                )
-            if heatmap_select == "coercivity_dmdh_(T)":
-                fig = moke_plot_vlines(
-                    fig,
-                    values=[
-                        results_dict["coercivity_dmdh"]["negative"],
-                        results_dict["coercivity_dmdh"]["positive"],
-                    ],
-                )
-            if heatmap_select == "intercept_field_(T)":
-                fig = moke_plot_intercept(
-                    fig, intercept_dict=results_dict["intercept_field"]
-                )
+            title_tag = ""
+            if plot_options == "oscilloscope":
+                fig = moke_plot_oscilloscope_from_dataframe(fig, measurement_df)
+                title_tag = "oscilloscope plot"
+            elif plot_options == "loop":
+                fig = moke_plot_loop_from_dataframe(fig, measurement_df)
+                title_tag = "hysteresis loop"
+            elif plot_options == "stored_result":
+                fig = moke_plot_loop_from_dataframe(fig, measurement_df)
+                if heatmap_select == "coercivity_m0_(T)":
+                    fig = moke_plot_vlines(
+                        fig,
+                        values=[
+                            results_dict["coercivity_m0"]["negative"],
+                            results_dict["coercivity_m0"]["positive"],
+                        ],
+                    )
+                if heatmap_select == "coercivity_dmdh_(T)":
+                    fig = moke_plot_vlines(
+                        fig,
+                        values=[
+                            results_dict["coercivity_dmdh"]["negative"],
+                            results_dict["coercivity_dmdh"]["positive"],
+                        ],
+                    )
+                if heatmap_select == "intercept_field_(T)":
+                    fig = moke_plot_intercept(
+                        fig, intercept_dict=results_dict["intercept_field"]
+                    )
 
         fig.update_layout(
             plot_layout(title=f"{title_tag} <br>x = {target_x}, y = {target_y}"),
@@ -202,11 +204,13 @@ def callbacks_moke(app):
     @check_conditions(moke_conditions, hdf5_path_index=1)
     def moke_make_database(n_clicks, hdf5_path, treatment_dict, selected_dataset):
         if n_clicks > 0:
-            with h5py.File(hdf5_path, "a") as hdf5_file:
-                moke_group = hdf5_file[selected_dataset]
-                results_dict = moke_batch_fit(moke_group, treatment_dict)
-                moke_results_dict_to_hdf5(moke_group, results_dict, treatment_dict)
-                return "Great Success!"
+            results_dict, skipped_list = moke_build_database(
+                hdf5_path, selected_dataset, treatment_dict, incremental=True
+            )
+            return (
+                f"Great Success! {len(results_dict)} positions fitted, "
+                f"{len(skipped_list)} unchanged positions skipped"
+            )
 
     @app.callback(
         [
@@ -270,11 +274,106 @@ def callbacks_moke(app):
     @check_conditions(moke_conditions, hdf5_path_index=1)
     def make_loop_map(n_clicks, hdf5_path, options_dict, normalize, dataset_select):
         if n_clicks > 0:
-            with h5py.File(hdf5_path, "a") as hdf5_file:
+            with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
                 moke_group = hdf5_file[dataset_select]
                 fig = moke_plot_loop_map(moke_group, options_dict, normalize)
                 return fig
 
+    # Runs a treatment sweep, or lists the parameter sets of the stored sweep when the dataset changes
+    @app.callback(
+        [
+            Output("moke_sweep_set_select", "options"),
+            Output("moke_sweep_set_select", "value"),
+            Output("moke_sweep_metric_select", "options"),
+            Output("moke_sweep_text_box", "children"),
+        ],
+        Input("moke_sweep_button", "n_clicks"),
+        Input("moke_select_dataset", "value"),
+        State("hdf5_path_store", "data"),
+        State("moke_data_treatment_store", "data"),
+        State("moke_sweep_coil_factor", "value"),
+        State("moke_sweep_smoothing_polyorder", "value"),
+        State("moke_sweep_smoothing_range", "value"),
+        State("moke_sweep_flags", "value"),
+    )
+    @check_conditions(moke_conditions, hdf5_path_index=2)
+    def moke_make_sweep(
+        n_clicks,
+        selected_dataset,
+        hdf5_path,
+        treatment_dict,
+        coil_factor_text,
+        smoothing_polyorder_text,
+        smoothing_range_text,
+        sweep_flags,
+    ):
+        if selected_dataset is None:
+            raise PreventUpdate
+
+        metric_options = [f"{metric}_({unit})" for metric, unit in MOKE_SWEEP_METRICS.items()]
+
+        if ctx.triggered_id == "moke_sweep_button":
+            if treatment_dict is None:
+                raise PreventUpdate
+            try:
+                sweep_dict = {
+                    "coil_factor": moke_parse_sweep_values(coil_factor_text, float),
+                    "smoothing_polyorder": moke_parse_sweep_values(smoothing_polyorder_text, int),
+                    "smoothing_range": moke_parse_sweep_values(smoothing_range_text, int),
+                }
+                for flag in sweep_flags:
+                    sweep_dict[flag] = [True, False]
+                label_list = moke_build_treatment_sweep(hdf5_path, selected_dataset, treatment_dict, sweep_dict)
+            except ValueError as error:
+                return no_update, no_update, no_update, str(error)
+            text = f"Great Success! {len(label_list)} parameter sets evaluated"
+        else:
+            with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+                label_list = moke_get_sweep_labels(hdf5_file[selected_dataset])
+            text = ""
+
+        set_options = [{"label": label, "value": str(i)} for i, label in enumerate(label_list)]
+        set_value = "0" if label_list else None
+
+        return set_options, set_value, metric_options, text
+
+    # Heatmap of one parameter set of the sweep, the colorbar is shared by every set to compare them
+    @app.callback(
+        Output("moke_sweep_heatmap", "figure"),
+        Input("moke_sweep_set_select", "value"),
+        Input("moke_sweep_metric_select", "value"),
+        State("hdf5_path_store", "data"),
+        State("moke_select_dataset", "value"),
+        State("moke_heatmap_precision", "value"),
+        prevent_initial_call=True,
+    )
+    @check_conditions(moke_conditions, hdf5_path_index=2)
+    def moke_update_sweep_heatmap(set_select, metric_select, hdf5_path, selected_dataset, precision):
+        if set_select is None or metric_select is None:
+            raise PreventUpdate
+
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+            moke_group = hdf5_file[selected_dataset]
+            if "treatment_sweep" not in moke_group:
+                raise PreventUpdate
+            sweep_df = moke_make_sweep_dataframe_from_hdf5(moke_group, int(set_select))
+            z_min, z_max = moke_get_sweep_metric_range(moke_group, metric_select)
+            label = moke_get_sweep_labels(moke_group)[int(set_select)]
+
+        name, unit = split_name_and_unit(metric_select)
+        fig = make_heatmap_from_dataframe(
+            sweep_df,
+            values=metric_select,
+            z_min=None if np.isnan(z_min) else z_min,
+            z_max=None if np.isnan(z_max) else z_max,
+            plot_title=f"{name} MOKE map <br>{label}",
+            colorbar_title=f"{unit}",
+            precision=precision if precision is not None else 2,
+            masking=True,
+        )
+
+        return fig
+
     # Callback to deal with heatmap edit mode
     @app.callback(
         Output("moke_text_box", "children", allow_duplicate=True),
@@ -292,12 +391,9 @@ def callbacks_moke(app):
         target_x = heatmap_click["points"][0]["x"]
         target_y = heatmap_click["points"][0]["y"]
 
-        with h5py.File(hdf5_path, "a") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
             moke_group = hdf5_file[selected_dataset]
             position_group = get_target_position_group(moke_group, target_x, target_y)
-            if not position_group.attrs["ignored"]:
-                position_group.attrs["ignored"] = True
-                return f"{target_x}, {target_y} ignore set to True"
-            else:
-                position_group.attrs["ignored"] = False
-                return f"{target_x}, {target_y} ignore set to False"
\ No newline at end of file
+            # Keeps the ignored column of the position table in sync with the position attribute
+            ignored = toggle_position_ignored(moke_group, position_group)
+            return f"{target_x}, {target_y} ignore set to {ignored}"
\ No newline at end of file
@@ -34,14 +34,13 @@ def callbacks_profil(app):
     )
     @check_conditions(profil_conditions, hdf5_path_index=0)
     def profil_scan_hdf5_for_datasets(hdf5_path):
-        with h5py.File(hdf5_path, "r") as hdf5_file:
-            dataset_list = get_hdf5_datasets(hdf5_file, dataset_type="profil")
+        dataset_list = get_catalog_datasets(hdf5_path, dataset_type="profil")
 
         return dataset_list, dataset_list[0]
 
 
-    # Reads the given dataset into a DataFrame, then serialize it to json.
-    # Returns the json and the columns of the df as options for the plot selection
+    # Reads the given dataset into a DataFrame, then keeps it in the server-side results store.
+    # Returns the store token and the columns of the df as options for the plot selection
     @app.callback(
         [Output("profil_results_store", "data"),
          Output("profil_heatmap_select", "options"),
@@ -51,20 +50,22 @@ def callbacks_profil(app):
     )
     @check_conditions(profil_conditions, hdf5_path_index=1)
     def profil_read_dataset_into_store(selected_dataset, hdf5_path):
-        with h5py.File(hdf5_path, "r") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
             profil_group = hdf5_file.get(selected_dataset)
             profil_df = profil_make_results_dataframe_from_hdf5(profil_group)
 
             if profil_df is None:
                 raise PreventUpdate
 
-            profil_df_json = profil_df.to_json(orient="split")
+            profil_df_token = put_results_dataframe(
+                profil_df, builder="profil_results", hdf5_path=hdf5_path, dataset_name=selected_dataset
+            )
             # First three columns are x_pos, y_pos and the ignored tag
             options = list(profil_df.columns[3:])
 
-        return profil_df_json, options, None
+        return profil_df_token, options, None
 
-    # Reads from the serialized dataframe in store, and plots the heatmap
+    # Reads the dataframe from the results store, and plots the heatmap
     # Handles heatmap plotting options such as colorbar values and precision
     # Returns a figure and the colorbar values
     @app.callback(
@@ -83,8 +84,10 @@ def callbacks_profil(app):
         prevent_initial_call=True,
     )
     @check_conditions(profil_conditions, hdf5_path_index=5)
-    def profil_update_heatmap(heatmap_select,z_min,z_max,precision,edit_toggle,hdf5_path,profil_df_json):
-        profil_df = pd.read_json(StringIO(profil_df_json), orient="split")
+    def profil_update_heatmap(heatmap_select,z_min,z_max,precision,edit_toggle,hdf5_path,profil_df_token):
+        profil_df = get_results_dataframe(profil_df_token)
+        if profil_df is None:
+            raise PreventUpdate
         # Reset colorbar bounds when needed
         if ctx.triggered_id in [
             "profil_heatmap_select",
@@ -114,6 +117,7 @@ def callbacks_profil(app):
             masking=masking,
             plot_title=plot_title,
             colorbar_title=colorbar_title,
+            grid=get_results_heatmap_grid(profil_df_token),
         )
 
         z_min = np.round(fig.data[0].zmin, precision)
@@ -147,7 +151,7 @@ def callbacks_profil(app):
             vertical_spacing=0.1,
         )
 
-        with h5py.File(hdf5_path, "r") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
             profil_group = hdf5_file[selected_dataset]
             measurement_df = profil_get_measurement_from_hdf5(
                 profil_group, target_x, target_y
@@ -206,7 +210,7 @@ def callbacks_profil(app):
     ):
         if n_clicks > 0:
             if fit_mode == "Batch fitting":
-                with h5py.File(hdf5_path, "a") as hdf5_file:
+                with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
                     profil_group = hdf5_file[selected_dataset]
                     positions_group = get_positions_group(profil_group)
                     for position, position_group in positions_group.items():
@@ -219,7 +223,7 @@ def callbacks_profil(app):
                 return "Successfully refitted data"
 
             if fit_mode == "Spot fitting":
-                with h5py.File(hdf5_path, "a") as hdf5_file:
+                with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
                     profil_group = hdf5_file[selected_dataset]
                     position_group = get_target_position_group(
                         profil_group, target_position[0], target_position[1]
@@ -231,7 +235,7 @@ def callbacks_profil(app):
                 return f"Successfully refitted position {target_position}"
 
             if fit_mode == "Manual":
-                with h5py.File(hdf5_path, "a") as hdf5_file:
+                with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
                     profil_group = hdf5_file[selected_dataset]
                     position_group = get_target_position_group(profil_group, target_position[0], target_position[1])
                     results_group = safe_create_new_subgroup(position_group, new_subgroup_name="results")
@@ -258,15 +262,12 @@ def callbacks_profil(app):
         target_x = heatmap_click["points"][0]["x"]
         target_y = heatmap_click["points"][0]["y"]
 
-        with h5py.File(hdf5_path, "a") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
             profil_group = hdf5_file[selected_dataset]
             position_group = get_target_position_group(profil_group, target_x, target_y)
-            if not position_group.attrs["ignored"]:
-                position_group.attrs["ignored"] = True
-                return f"{target_x}, {target_y} ignore set to True"
-            else:
-                position_group.attrs["ignored"] = False
-                return f"{target_x}, {target_y} ignore set to False"
+            # Keeps the ignored column of the position table in sync with the position attribute
+            ignored = toggle_position_ignored(profil_group, position_group)
+            return f"{target_x}, {target_y} ignore set to {ignored}"
 
 
     # Callback for fit modes
@@ -38,47 +38,63 @@ def callbacks_xrd(app):
             # No datasets in esrf mode, return the root group
             dataset_list = ["/"]
         else:
-            with h5py.File(hdf5_path, "r") as hdf5_file:
-                dataset_list = []
-                dataset_list = dataset_list + get_hdf5_datasets(hdf5_file, dataset_type="xrd")
-                dataset_list = dataset_list + get_hdf5_datasets(hdf5_file, dataset_type="xrd_wafer")
-                dataset_list = dataset_list + get_hdf5_datasets(hdf5_file, dataset_type="xrd_furnace")
+            dataset_list = get_catalog_datasets(hdf5_path, dataset_type=["xrd", "xrd_wafer", "xrd_furnace"])
 
         return dataset_list, dataset_list[0]
 
-    # Reads the given dataset into a DataFrame, then serialize it to json.
-    # Returns the json and the columns of the df as options for the plot selection
+    # Reads the given dataset into a DataFrame, then keeps it in the server-side results store.
+    # Returns the store token and the columns of the df as options for the plot selection
     @app.callback(
         [Output("xrd_results_store", "data"),
          Output("xrd_heatmap_select", "options"),
          Output("xrd_heatmap_select", "value")],
         Input("xrd_select_dataset", "value"),
         Input("xrd_analysis_toggle", "value"),
+        Input("xrd_peak_q_min", "value"),
+        Input("xrd_peak_q_max", "value"),
         State("xrd_current_path_store", "data"),
         State("xrd_nexus_mode_store", "data"),
+        State("xrd_heatmap_select", "value"),
     )
-    @check_conditions(xrd_conditions, hdf5_path_index=2)
-    def xrd_read_dataset_into_store(selected_dataset, analysis_toggle, hdf5_path, nexus_mode):
-        with h5py.File(hdf5_path, "r") as hdf5_file:
+    @check_conditions(xrd_conditions, hdf5_path_index=4)
+    def xrd_read_dataset_into_store(
+        selected_dataset, analysis_toggle, q_min, q_max, hdf5_path, nexus_mode, heatmap_select
+    ):
+        # Moving the peak window only changes the peak maps of the analysis mode
+        if ctx.triggered_id in ["xrd_peak_q_min", "xrd_peak_q_max"] and (not analysis_toggle or nexus_mode):
+            raise PreventUpdate
+
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
             xrd_group = hdf5_file.get(selected_dataset)
+            builder_kwargs = {}
             if analysis_toggle:
                 if nexus_mode:
-                    xrd_make_analysis_dataframe_from_nexus(xrd_group)
+                    builder = "xrd_nexus_analysis"
+                    xrd_df = xrd_make_analysis_dataframe_from_nexus(xrd_group)
                 else:
-                    xrd_df = xrd_make_analysis_dataframe_from_hdf5(xrd_group)
+                    builder = "xrd_analysis"
+                    builder_kwargs = {"q_min": q_min, "q_max": q_max}
+                    xrd_df = xrd_make_analysis_dataframe_from_hdf5(xrd_group, q_min, q_max)
             else:
+                builder = "xrd_results"
                 xrd_df = xrd_make_results_dataframe_from_hdf5(xrd_group)
 
             if xrd_df is None:
                 raise PreventUpdate
 
-            xrd_df_json = xrd_df.to_json(orient="split")
+            xrd_df_token = put_results_dataframe(
+                xrd_df, builder=builder, hdf5_path=hdf5_path, dataset_name=selected_dataset,
+                builder_kwargs=builder_kwargs
+            )
             # First three columns are x_pos, y_pos and the ignored tag
             options = list(xrd_df.columns[3:])
 
-        return xrd_df_json, options, None
+        # Keep the plotted map when only the peak window moved
+        if ctx.triggered_id in ["xrd_peak_q_min", "xrd_peak_q_max"] and heatmap_select in options:
+            return xrd_df_token, options, heatmap_select
+        return xrd_df_token, options, None
 
-    # Reads from the serialized dataframe in store, and plots the heatmap
+    # Reads the dataframe from the results store, and plots the heatmap
     # Handles heatmap plotting options such as colorbar values and precision
     # Returns a figure and the colorbar values
     @app.callback(
@@ -97,8 +113,10 @@ def callbacks_xrd(app):
         prevent_initial_call=True,
     )
     @check_conditions(xrd_conditions, hdf5_path_index=5)
-    def xrd_update_heatmap(heatmap_select,z_min,z_max,precision,edit_toggle,hdf5_path,xrd_df_json):
-        xrd_df = pd.read_json(StringIO(xrd_df_json), orient="split")
+    def xrd_update_heatmap(heatmap_select,z_min,z_max,precision,edit_toggle,hdf5_path,xrd_df_token):
+        xrd_df = get_results_dataframe(xrd_df_token)
+        if xrd_df is None:
+            raise PreventUpdate
         # Reset colorbar bounds when needed
         if ctx.triggered_id in [
             "xrd_heatmap_select",
@@ -138,6 +156,7 @@ def callbacks_xrd(app):
             masking=masking,
             colorscale=colorscale,
             scaling=scaling,
+            grid=get_results_heatmap_grid(xrd_df_token),
         )
 
         z_min = np.round(fig.data[0].zmin, precision)
@@ -195,7 +214,7 @@ def callbacks_xrd(app):
             z_max = None
 
         colors = cycle(px.colors.qualitative.Plotly)
-        with h5py.File(hdf5_path, "r") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
             xrd_group = hdf5_file[selected_dataset]
             if plot_select == "integrated":
                 if nexus_mode:
@@ -270,15 +289,12 @@ def callbacks_xrd(app):
         target_x = heatmap_click["points"][0]["x"]
         target_y = heatmap_click["points"][0]["y"]
 
-        with h5py.File(hdf5_path, "a") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
             xrd_group = hdf5_file[selected_dataset]
             position_group = get_target_position_group(xrd_group, target_x, target_y)
-            if not position_group.attrs["ignored"]:
-                position_group.attrs["ignored"] = True
-                return f"{target_x}, {target_y} ignore set to True"
-            else:
-                position_group.attrs["ignored"] = False
-                return f"{target_x}, {target_y} ignore set to False"
+            # Keeps the ignored column of the position table in sync with the position attribute
+            ignored = toggle_position_ignored(xrd_group, position_group)
+            return f"{target_x}, {target_y} ignore set to {ignored}"
 
 
     @app.callback(
@@ -287,30 +303,28 @@ def callbacks_xrd(app):
         State("xrd_current_path_store", "data"),
         State("xrd_select_dataset", "value"),
         State("xrd_nexus_mode_store", "data"),
+        State("xrd_export_format", "value"),
         prevent_initial_call=True,
     )
     @check_conditions(xrd_conditions, hdf5_path_index=1)
-    def xrd_export_all(n_clicks, hdf5_path, selected_dataset, nexus_mode):
+    def xrd_export_all(n_clicks, hdf5_path, selected_dataset, nexus_mode, export_format):
         if nexus_mode:
             raise PreventUpdate
         if n_clicks > 0:
+            archive = None if export_format in [None, "folder"] else export_format
             hdf5_path = Path(hdf5_path)
             export_path = hdf5_path.parent / selected_dataset / "xrd_export"
-            if not os.path.exists(export_path):
-                os.makedirs(export_path)
-            else:
+            if archive is not None:
+                export_path = export_path.with_name(export_path.name + XRD_EXPORT_ARCHIVES[archive])
+            if os.path.exists(export_path):
                 raise NameError(f"{export_path} already exists, aborting to prevent overwrite")
 
-            with h5py.File(hdf5_path, "r") as hdf5_file:
-                xrd_group = hdf5_file[selected_dataset]
-                positions_group = get_positions_group(xrd_group)
-                xrd_export_sum_spectrum(positions_group, export_path)
-                for position, position_group in positions_group.items():
-                    if position == "alignment_scans":
-                        continue
-                    export_xrd_position_to_files(position_group, export_path)
+            export_stats = xrd_export_dataset(hdf5_path, selected_dataset, export_path, archive=archive)
 
-            return f"Successfully exported to {export_path}"
+            return (
+                f"Successfully exported {export_stats['positions']} positions to {export_stats['path']} "
+                f"in {export_stats['seconds']:.1f} s"
+            )
 
     @app.callback(
         Output("xrd_nexus_mode_store", "data"),
@@ -379,41 +393,72 @@ def callbacks_xrd(app):
             raise PreventUpdate
 
 
+    # Images are integrated on a pool of processes, progress is recorded for the progress bar of the popup
     @app.callback(
         [Output("xrd_text_box", "children", allow_duplicate=True),
-         Output("pyfai_popup", "is_open", allow_duplicate=True)],
+         Output("pyfai_popup", "is_open", allow_duplicate=True),
+         Output("pyfai_progress_interval", "disabled", allow_duplicate=True)],
         Input("pyfai_integrate_button", "n_clicks"),
         State("hdf5_path_store", "data"),
         State("xrd_select_dataset", "value"),
         State("pyfai_poni_select", "value"),
         State("pyfai_function_select", "value"),
         State("pyfai_points", "value"),
+        State("pyfai_method_select", "value"),
         prevent_initial_call=True,
     )
-    def xrd_reintegrate_dataset(n_clicks, hdf5_file, selected_dataset, poni_select, function_select, points):
+    def xrd_reintegrate_dataset(
+        n_clicks, hdf5_file, selected_dataset, poni_select, function_select, points, method_select
+    ):
         if n_clicks > 0:
             poni_path = Path(os.getcwd() + "/calibrations/esrf_poni/" + poni_select).with_suffix(".poni")
-            poni = pyFAI.load(str(poni_path))
-
-            with h5py.File(hdf5_file, "a") as file:
-                xrd_group = file[selected_dataset]
-                positions_group = get_positions_group(xrd_group)
-                for position, position_group in positions_group.items():
-                    if position == "alignment_scans":
-                        continue
-                    image = position_group["measurement/2Dimage"][()]
 
-                    if function_select == "integrate1d":
-                        reintegrated_dict = xrd_pyfai_integrate1d(poni, image, points)
+            def progress_callback(done, total, frames_per_second):
+                xrd_set_reintegration_progress(hdf5_file, selected_dataset, done, total, frames_per_second)
+
+            summary = xrd_reintegrate_dataset_parallel(
+                hdf5_file,
+                selected_dataset,
+                poni_path,
+                function_select,
+                points,
+                method=method_select or XRD_PYFAI_METHOD,
+                progress_callback=progress_callback,
+            )
+
+            return (
+                f"Integration successful, {summary['frames']} frames in {summary['seconds']:.1f} s "
+                f"({summary['frames_per_second']:.1f} frames/s)",
+                False,
+                True,
+            )
 
-                    elif function_select == "medfilt1d":
-                        reintegrated_dict = xrd_pyfai_medfilt1d(poni, image, points)
-
-                    xrd_write_integrated_to_hdf5(position_group, reintegrated_dict, overwrite=True)
+    @app.callback(
+        Output("pyfai_progress_interval", "disabled", allow_duplicate=True),
+        Input("pyfai_integrate_button", "n_clicks"),
+        prevent_initial_call=True,
+    )
+    def xrd_start_reintegration_progress(n_clicks):
+        if n_clicks > 0:
+            return False
+        raise PreventUpdate
 
-                file.flush()
+    @app.callback(
+        [Output("pyfai_progress", "value"),
+         Output("pyfai_progress", "label")],
+        Input("pyfai_progress_interval", "n_intervals"),
+        State("hdf5_path_store", "data"),
+        State("xrd_select_dataset", "value"),
+        prevent_initial_call=True,
+    )
+    def xrd_update_reintegration_progress(n_intervals, hdf5_file, selected_dataset):
+        progress = xrd_get_reintegration_progress(hdf5_file, selected_dataset)
+        if progress is None or progress["total"] == 0:
+            raise PreventUpdate
 
-            return "Integration successful", False
+        value = 100 * progress["done"] / progress["total"]
+        label = f"{progress['done']}/{progress['total']} ({progress['frames_per_second']:.1f} frames/s)"
+        return value, label
 
 
 
@@ -0,0 +1,155 @@
+"""
+Conversions between the abscissas of diffraction patterns: scattering vector q, scattering angle 2θ and d-spacing.
+Every conversion is a chain of NumPy ufuncs evaluated in place in a single output array, arrays already in the
+requested unit are returned as they are, without a copy.
+"""
+
+import numpy as np
+
+# hc/e in keV.nm, value used by every XRD library written so far
+XRD_HC_KEV_NM = 1.2363
+
+# Scale factor of each unit to the reference unit of its axis (nm^-1, deg and nm)
+# SmartLab libraries label their q axis "nm-1"
+Q_UNITS = {"nm^-1": 1.0, "nm-1": 1.0, "A^-1": 10.0}
+TTH_UNITS = {"deg": 1.0, "rad": 180 / np.pi}
+D_UNITS = {"nm": 1.0, "A": 0.1}
+
+AXIS_UNITS = {"q": Q_UNITS, "tth": TTH_UNITS, "d": D_UNITS}
+AXIS_REFERENCE_UNITS = {"q": "nm^-1", "tth": "deg", "d": "nm"}
+
+
+def xrd_wavelength(energy):
+    """
+    Wavelength of a photon beam.
+
+    @param energy: photon energy in keV
+    @return: wavelength in nm
+    """
+    if energy is None or energy <= 0:
+        raise ValueError(f"Photon energy must be a positive number of keV, got {energy}")
+    return XRD_HC_KEV_NM / energy
+
+
+def _unit_scale(axis, unit):
+    """Scale factor of a unit to the reference unit of its axis"""
+    try:
+        return AXIS_UNITS[axis][unit]
+    except KeyError:
+        raise KeyError(f"Unknown unit {unit} for axis {axis}, expected one of {list(AXIS_UNITS.get(axis, {}))}")
+
+
+def xrd_convert_units(values, axis, from_unit, to_unit, out=None):
+    """
+    Change the unit of an axis without changing the axis.
+
+    @param values: array of values in from_unit
+    @param axis: "q", "tth" or "d"
+    @param from_unit: unit of values
+    @param to_unit: unit of the result
+    @param out: optional float array receiving the result
+    @return: array in to_unit, values itself when both units are the same and out is None
+    """
+    values = np.asarray(values)
+    scale = _unit_scale(axis, from_unit) / _unit_scale(axis, to_unit)
+    if scale == 1 and out is None:
+        return values
+    return np.multiply(values, scale, out=out, dtype="float64" if out is None else None)
+
+
+def xrd_convert_axis(values, from_axis, to_axis, energy=None, from_unit=None, to_unit=None, out=None):
+    """
+    Convert an abscissa between q, 2θ and d-spacing, with q = 4π sin(θ) / λ and d = 2π / q.
+    The energy is only needed when 2θ is on one side of the conversion.
+
+    @param values: array of values of from_axis in from_unit
+    @param from_axis: "q", "tth" or "d"
+    @param to_axis: "q", "tth" or "d"
+    @param energy: photon energy in keV
+    @param from_unit: unit of values, the reference unit of from_axis if None
+    @param to_unit: unit of the result, the reference unit of to_axis if None
+    @param out: optional float array receiving the result, may be values itself
+    @return: array of to_axis values
+    """
+    if from_axis not in AXIS_UNITS or to_axis not in AXIS_UNITS:
+        raise KeyError(f"Unknown axis {from_axis} or {to_axis}, expected one of {list(AXIS_UNITS)}")
+    from_unit = AXIS_REFERENCE_UNITS[from_axis] if from_unit is None else from_unit
+    to_unit = AXIS_REFERENCE_UNITS[to_axis] if to_unit is None else to_unit
+
+    if from_axis == to_axis:
+        return xrd_convert_units(values, from_axis, from_unit, to_unit, out=out)
+
+    values = np.asarray(values)
+    from_scale = _unit_scale(from_axis, from_unit)
+    to_scale = _unit_scale(to_axis, to_unit)
+    if "tth" in (from_axis, to_axis):
+        wavelength = xrd_wavelength(energy)
+
+    # Every step writes in the same array, only the first one allocates it when out is None
+    if from_axis == "tth":
+        # 2θ in deg to sin(θ)
+        result = np.multiply(values, from_scale * np.pi / 360, out=out, dtype="float64" if out is None else None)
+        np.sin(result, out=result)
+        if to_axis == "q":
+            np.multiply(result, 4 * np.pi / wavelength / to_scale, out=result)
+        else:
+            np.divide(wavelength / 2 / to_scale, result, out=result)
+        return result
+
+    if from_axis == "q":
+        # q in nm^-1 to sin(θ) or d in nm
+        factor = wavelength / (4 * np.pi) if to_axis == "tth" else 1
+        result = np.multiply(values, from_scale * factor, out=out, dtype="float64" if out is None else None)
+        if to_axis == "d":
+            np.divide(2 * np.pi / to_scale, result, out=result)
+            return result
+    else:
+        # d in nm to sin(θ) or q in nm^-1
+        result = np.multiply(values, from_scale, out=out, dtype="float64" if out is None else None)
+        if to_axis == "q":
+            np.divide(2 * np.pi / to_scale, result, out=result)
+            return result
+        np.divide(wavelength / 2, result, out=result)
+
+    # sin(θ) to 2θ
+    np.arcsin(result, out=result)
+    np.multiply(result, 360 / np.pi / to_scale, out=result)
+    return result
+
+
+def xrd_q_tth(q_list, energy, q_unit="nm^-1", tth_unit="deg"):
+    """
+    Scattering angle of scattering vectors.
+
+    @param q_list: q values in q_unit
+    @param energy: photon energy in keV
+    @return: array of 2θ values in tth_unit
+    """
+    return xrd_convert_axis(q_list, "q", "tth", energy=energy, from_unit=q_unit, to_unit=tth_unit)
+
+
+def xrd_tth_q(tth_list, energy, tth_unit="deg", q_unit="nm^-1"):
+    """
+    Scattering vector of scattering angles.
+
+    @param tth_list: 2θ values in tth_unit
+    @param energy: photon energy in keV
+    @return: array of q values in q_unit
+    """
+    return xrd_convert_axis(tth_list, "tth", "q", energy=energy, from_unit=tth_unit, to_unit=q_unit)
+
+
+def xrd_read_axis(dataset, axis, unit=None):
+    """
+    Read an abscissa dataset in a given unit, following its "units" attribute (reference unit if it has none).
+
+    @param dataset: h5py dataset of q, 2θ or d values
+    @param axis: "q", "tth" or "d"
+    @param unit: unit of the result, the reference unit of the axis if None
+    @return: array in unit
+    """
+    stored_unit = dataset.attrs.get("units", AXIS_REFERENCE_UNITS[axis])
+    if isinstance(stored_unit, bytes):
+        stored_unit = stored_unit.decode()
+    unit = AXIS_REFERENCE_UNITS[axis] if unit is None else unit
+    return xrd_convert_units(dataset[()], axis, stored_unit, unit)
@@ -7,12 +7,9 @@ from ..functions.functions_shared import *
 def edx_conditions(hdf5_path, *args, **kwargs):
     if hdf5_path is None:
         return False
-    if not h5py.is_hdf5(hdf5_path):
+    dataset_list = get_catalog_datasets(hdf5_path, dataset_type="edx")
+    if len(dataset_list) == 0:
         return False
-    with h5py.File(hdf5_path, "r") as hdf5_file:
-        dataset_list = get_hdf5_datasets(hdf5_file, dataset_type="edx")
-        if len(dataset_list) == 0:
-            return False
     return True
 
 
@@ -36,31 +33,32 @@ def edx_make_results_dataframe_from_hdf5(edx_group):
     data_dict_list = []
 
     positions_group = get_positions_group(edx_group)
+    # Coordinates of the spots inside the wafer, read from the position table
+    coordinates_df = make_coordinates_dataframe(edx_group)
 
-    for position, position_group in positions_group.items():
-        instrument_group = position_group.get('instrument')
-        # Exclude spots outside the wafer
-        if np.abs(instrument_group["x_pos"][()]) + np.abs(instrument_group["y_pos"][()]) <= 60:
+    for position, x_pos, y_pos, ignored in coordinates_df.itertuples(name=None):
+        results_group = positions_group[position].get('results')
 
-            results_group = position_group.get('results')
+        data_dict = {"x_pos (mm)": x_pos,
+                     "y_pos (mm)": y_pos,
+                     "ignored": ignored}
 
-            data_dict = {"x_pos (mm)": instrument_group["x_pos"][()],
-                         "y_pos (mm)": instrument_group["y_pos"][()],
-                         "ignored": position_group.attrs["ignored"]}
-
-            if results_group is None:
-                continue
+        if results_group is None:
+            continue
 
-            for element, element_group in results_group.items():
-                if 'AtomPercent' in element_group:
-                    data_dict[element] = element_group['AtomPercent'][()]
-            data_dict_list.append(data_dict)
+        for element, element_group in results_group.items():
+            if 'AtomPercent' in element_group:
+                data_dict[element] = element_group['AtomPercent'][()]
+        data_dict_list.append(data_dict)
 
     result_dataframe = pd.DataFrame(data_dict_list)
 
     return result_dataframe
 
 
+register_results_builder("edx_results", edx_make_results_dataframe_from_hdf5)
+
+
 def edx_get_measurement_from_hdf5(edx_group, target_x, target_y):
     position_group = get_target_position_group(edx_group, target_x, target_y)
     measurement_group = position_group.get('measurement')
@@ -1,7 +1,32 @@
+import multiprocessing
+import os
+import threading
+import time
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
 import h5py
 import numpy as np
 
-from modules.functions.functions_shared import extract_value_unit
+from modules.functions.functions_shared import extract_value_unit, get_positions_group, hdf5_file_stamp
+
+# Pooled read handles unused for this many seconds are closed
+HDF5_POOL_IDLE_SECONDS = 10
+
+# Process-wide pool of HDF5 handles shared by the Dash callbacks, keyed by resolved file path
+_hdf5_handle_pool = {}
+_hdf5_handle_pool_lock = threading.Lock()
+_hdf5_pool_local = threading.local()
+_hdf5_pool_sweeper = {"thread": None}
+
+# Catalog of the datasets contained in each HDF5 file, keyed by resolved file path
+_hdf5_catalog_cache = {}
+
+# Start method of the worker processes on every platform, spawned processes share no HDF5 handle, lock or thread with
+# the server, forked ones would copy them in whatever state the other callback threads left them
+HDF5_PROCESS_START_METHOD = "spawn"
 
 
 def write_dict_to_hdf5(xrd_dict, node):
@@ -104,6 +129,70 @@ def hdf5_group_to_dict(hdf5_group):
     return nested_dict
 
 
+class HDF5GroupView(Mapping):
+    """
+    Read-only nested mapping over a h5py.Group, datasets are only read when their key is accessed.
+    Subgroups are returned as views as well. The view is only valid while the file is open,
+    call materialize() to keep the values after closing it.
+    """
+
+    def __init__(self, hdf5_group, cache=True):
+        self._group = hdf5_group
+        self._cache = {} if cache else None
+
+    def __getitem__(self, key):
+        if self._cache is not None and key in self._cache:
+            return self._cache[key]
+
+        item = self._group.get(key)
+        if isinstance(item, h5py.Dataset):
+            value = item[()]
+        elif isinstance(item, h5py.Group):
+            value = HDF5GroupView(item, cache=self._cache is not None)
+        else:
+            raise KeyError(f"{key} not found in {self._group.name}")
+
+        if self._cache is not None:
+            self._cache[key] = value
+        return value
+
+    def __iter__(self):
+        for key, item in self._group.items():
+            if isinstance(item, (h5py.Dataset, h5py.Group)):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"HDF5GroupView({self._group.name})"
+
+    def materialize(self):
+        """
+        Read every dataset under the group, same output as hdf5_group_to_dict.
+
+        @return: nested dictionary
+        """
+        nested_dict = {}
+        for key in self:
+            value = self[key]
+            if isinstance(value, HDF5GroupView):
+                value = value.materialize()
+            nested_dict[key] = value
+        return nested_dict
+
+
+def hdf5_group_to_view(hdf5_group, cache=True):
+    """
+    Lazy counterpart of hdf5_group_to_dict, datasets are read when accessed.
+
+    @param hdf5_group: h5py.Group
+    @param cache: if True, each dataset is read at most once
+    @return: HDF5GroupView
+    """
+    return HDF5GroupView(hdf5_group, cache=cache)
+
+
 def get_sample_info_from_hdf5(hdf5_path):
     info_dict = {}
 
@@ -124,3 +213,254 @@ def hdf5_squeeze_dataset(hdf5_file, dataset_group):
     for name, value in attrs_dict.items():
         new_dataset_group.attrs["name"] = value
 
+
+def _get_hdf5_pool_entry(hdf5_path):
+    key = str(Path(hdf5_path).resolve())
+    with _hdf5_handle_pool_lock:
+        entry = _hdf5_handle_pool.get(key)
+        if entry is None:
+            entry = {
+                "path": key,
+                "handle": None,
+                "stamp": None,
+                "condition": threading.Condition(),
+                "readers": 0,
+                "writer": None,
+                "writers_waiting": 0,
+                "write_depth": 0,
+                "last_used": 0.0,
+            }
+            _hdf5_handle_pool[key] = entry
+    return entry
+
+
+def _close_hdf5_pool_entry(entry):
+    if entry["handle"] is not None:
+        entry["handle"].close()
+    entry["handle"] = None
+    entry["stamp"] = None
+
+
+def _get_thread_reads():
+    """Number of pooled reads currently open by this thread, per file"""
+    if not hasattr(_hdf5_pool_local, "reads"):
+        _hdf5_pool_local.reads = {}
+    return _hdf5_pool_local.reads
+
+
+def _sweep_hdf5_pool():
+    """Close the read handles left unused for HDF5_POOL_IDLE_SECONDS, runs in a daemon thread"""
+    while True:
+        time.sleep(max(HDF5_POOL_IDLE_SECONDS / 2, 0.1))
+        with _hdf5_handle_pool_lock:
+            entry_list = list(_hdf5_handle_pool.values())
+        now = time.monotonic()
+        for entry in entry_list:
+            with entry["condition"]:
+                idle = entry["readers"] == 0 and entry["writer"] is None
+                if idle and entry["handle"] is not None and now - entry["last_used"] > HDF5_POOL_IDLE_SECONDS:
+                    _close_hdf5_pool_entry(entry)
+
+
+def _start_hdf5_pool_sweeper():
+    with _hdf5_handle_pool_lock:
+        if _hdf5_pool_sweeper["thread"] is None or not _hdf5_pool_sweeper["thread"].is_alive():
+            _hdf5_pool_sweeper["thread"] = threading.Thread(target=_sweep_hdf5_pool, daemon=True)
+            _hdf5_pool_sweeper["thread"].start()
+
+
+@contextmanager
+def pooled_hdf5_file(hdf5_path, mode="r"):
+    """
+    Drop-in replacement for h5py.File in Dash callbacks and writers, keeping read handles open between callbacks.
+
+    Readers share one pooled handle and run concurrently, the per-file lock is only held while the handle is opened
+    or swapped. The handle is reopened when the file inode, mtime or size changes and closed after
+    HDF5_POOL_IDLE_SECONDS without readers, so the file is not kept locked against other programs.
+    Write modes wait for the readers to leave, close the pooled handle and keep other threads out of the file until
+    the write handle is closed. Reads and writes nested in a write of the same thread use the write handle.
+
+    @param hdf5_path: path to the HDF5 file
+    @param mode: "r" for pooled read access, "r+" or "a" for write access
+    @return: h5py.File
+    """
+    if mode not in ["r", "r+", "a"]:
+        raise ValueError("Pooled HDF5 handles only support 'r', 'r+' and 'a' modes.")
+
+    entry = _get_hdf5_pool_entry(hdf5_path)
+    condition = entry["condition"]
+    thread_id = threading.get_ident()
+    thread_reads = _get_thread_reads()
+
+    with condition:
+        nested = entry["writer"] == thread_id
+        if nested:
+            entry["write_depth"] += 1
+        elif mode == "r":
+            # Waiting writers go first, unless this thread already reads the file and would never let them in
+            already_reading = thread_reads.get(entry["path"], 0) > 0
+            condition.wait_for(
+                lambda: entry["writer"] is None and (already_reading or entry["writers_waiting"] == 0)
+            )
+            stamp = hdf5_file_stamp(entry["path"])
+            handle = entry["handle"]
+            # A handle in use by other readers is kept until they leave, then reopened on the next read
+            if entry["readers"] == 0 and (handle is None or not handle.id.valid or entry["stamp"] != stamp):
+                _close_hdf5_pool_entry(entry)
+                entry["handle"] = h5py.File(entry["path"], "r")
+                entry["stamp"] = stamp
+            entry["readers"] += 1
+            thread_reads[entry["path"]] = thread_reads.get(entry["path"], 0) + 1
+        else:
+            if thread_reads.get(entry["path"], 0) > 0:
+                raise RuntimeError(f"Cannot open {entry['path']} for writing while it is being read in the same thread.")
+            entry["writers_waiting"] += 1
+            try:
+                condition.wait_for(lambda: entry["writer"] is None and entry["readers"] == 0)
+            finally:
+                entry["writers_waiting"] -= 1
+            _close_hdf5_pool_entry(entry)
+            entry["writer"] = thread_id
+            entry["write_depth"] = 1
+        handle = entry["handle"]
+
+    if nested:
+        try:
+            yield handle
+        finally:
+            with condition:
+                entry["write_depth"] -= 1
+
+    elif mode == "r":
+        try:
+            yield handle
+        finally:
+            with condition:
+                entry["readers"] -= 1
+                thread_reads[entry["path"]] -= 1
+                entry["last_used"] = time.monotonic()
+                condition.notify_all()
+            _start_hdf5_pool_sweeper()
+
+    else:
+        try:
+            with h5py.File(entry["path"], mode) as handle:
+                entry["handle"] = handle
+                yield handle
+        finally:
+            with condition:
+                entry["handle"] = None
+                entry["stamp"] = None
+                entry["writer"] = None
+                entry["write_depth"] = 0
+                condition.notify_all()
+
+
+def release_pooled_hdf5_file(hdf5_path):
+    """
+    Close the pooled read handle of a file once its readers are done, needed before opening it with h5py.File
+    directly. Writers should rather open the file with pooled_hdf5_file.
+
+    @param hdf5_path: path to the HDF5 file
+    @return: None
+    """
+    entry = _get_hdf5_pool_entry(hdf5_path)
+    if _get_thread_reads().get(entry["path"], 0) > 0 or entry["writer"] == threading.get_ident():
+        raise RuntimeError(f"Cannot release {entry['path']} while it is open in the same thread.")
+    with entry["condition"]:
+        entry["condition"].wait_for(lambda: entry["writer"] is None and entry["readers"] == 0)
+        _close_hdf5_pool_entry(entry)
+
+
+def start_hdf5_process_pool(max_workers, initializer=None, initargs=()):
+    """
+    Pool of processes working on HDF5 files, started with HDF5_PROCESS_START_METHOD. The processes import the modules
+    of their tasks in a fresh interpreter: tasks and initializer have to be module level functions of the functions
+    or hdf5_compilers modules, and everything they need, paths and settings included, has to be passed as arguments
+    or through initargs. The main module is imported as well, app.py only builds the app in create_app for this reason.
+
+    @param max_workers: number of processes
+    @param initializer: called as initializer(*initargs) when each process starts
+    @param initargs: arguments of initializer
+    @return: ProcessPoolExecutor, to be shut down by the caller
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(HDF5_PROCESS_START_METHOD),
+        initializer=initializer,
+        initargs=initargs,
+    )
+
+
+def scan_hdf5_catalog(hdf5_file):
+    """
+    Scan the root groups and datasets of a HDF5 file and summarize them without reading any data.
+
+    @param hdf5_file: opened h5py.File
+    @return: dict {dataset_name: {"HT_type", "writers", "n_positions", "attrs"}}
+    """
+    catalog = {}
+    for dataset, dataset_group in hdf5_file.items():
+        attrs_dict = dict(dataset_group.attrs)
+        ht_type = attrs_dict.get("HT_type")
+        # Root datasets are listed too, as by get_hdf5_datasets, they just have no positions
+        if not isinstance(dataset_group, h5py.Group):
+            catalog[dataset] = {"HT_type": ht_type, "writers": {}, "n_positions": None, "attrs": attrs_dict}
+            continue
+
+        n_positions = None
+        if ht_type is not None:
+            n_positions = len(get_positions_group(dataset_group))
+
+        catalog[dataset] = {
+            "HT_type": ht_type,
+            "writers": {key: value for key, value in attrs_dict.items() if key.endswith("_writer")},
+            "n_positions": n_positions,
+            "attrs": attrs_dict,
+        }
+    return catalog
+
+
+def get_hdf5_catalog(hdf5_path):
+    """
+    Return the catalog of a HDF5 file. The file is only scanned again when its inode or mtime changes.
+
+    @param hdf5_path: path to the HDF5 file
+    @return: dict generated by scan_hdf5_catalog, empty if the path is not a valid HDF5 file
+    """
+    key = str(Path(hdf5_path).resolve())
+    try:
+        stamp = hdf5_file_stamp(key)
+    except OSError:
+        return {}
+
+    cached = _hdf5_catalog_cache.get(key)
+    if cached is not None and cached["stamp"] == stamp:
+        return cached["catalog"]
+
+    if not h5py.is_hdf5(key):
+        catalog = {}
+    else:
+        with pooled_hdf5_file(key, "r") as hdf5_file:
+            catalog = scan_hdf5_catalog(hdf5_file)
+
+    _hdf5_catalog_cache[key] = {"stamp": stamp, "catalog": catalog}
+    return catalog
+
+
+def get_catalog_datasets(hdf5_path, dataset_type):
+    """
+    Cached equivalent of get_hdf5_datasets, working from the file path
+
+    @param hdf5_path: path to the HDF5 file
+    @param dataset_type: HT_type to look for, a list of HT_types, or "all"
+    @return: list of dataset names
+    """
+    catalog = get_hdf5_catalog(hdf5_path)
+    if dataset_type == "all":
+        return list(catalog.keys())
+
+    if isinstance(dataset_type, str):
+        dataset_type = [dataset_type]
+    return [dataset for dataset, info in catalog.items() if info["HT_type"] in dataset_type]
+
@@ -1,7 +1,12 @@
 """ """
+import hashlib
+import itertools
+import json
+import threading
+import warnings
 import numpy as np
 from numpy.f2py.crackfortran import groupends
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from scipy.signal import savgol_filter
 from plotly.subplots import make_subplots
 
@@ -12,12 +17,9 @@ from ..functions.functions_shared import *
 def moke_conditions(hdf5_path, *args, **kwargs):
     if hdf5_path is None:
         return False
-    if not h5py.is_hdf5(hdf5_path):
+    dataset_list = get_catalog_datasets(hdf5_path, dataset_type="moke")
+    if len(dataset_list) == 0:
         return False
-    with h5py.File(hdf5_path, "r") as hdf5_file:
-        dataset_list = get_hdf5_datasets(hdf5_file, dataset_type="moke")
-        if len(dataset_list) == 0:
-            return False
     return True
 
 def moke_make_path_dictionary(source_path, pattern=r"^p(\d+)"):
@@ -42,55 +44,247 @@ def moke_make_path_dictionary(source_path, pattern=r"^p(\d+)"):
     return grouped_dict
 
 
+MOKE_SHOT_CHANNELS = ["magnetization", "pulse", "reflectivity", "integrated_pulse"]
+
+# Saturated sections of the intercept fits are flat lines instead of linear fits
+MOKE_INTERCEPT_FORCE_FLAT = True
+
+# Number of points kept for each loop of the loop map
+MOKE_LOOP_MAP_POINTS = 150
+
+# Per position metrics of the shot to shot spread, written by the MOKE writer, with their units
+MOKE_SHOT_STATISTICS_UNITS = {
+    "magnetization_noise": "V",
+    "reflectivity_noise": "V",
+    "snr": "arb",
+    "magnetization_drift": "V/shot",
+    "reflectivity_drift": "V/shot",
+}
+
+# Memory budget of the treated loops cache, in bytes
+MOKE_TREATED_CACHE_MAX_BYTES = 256 * 1024**2
+
+# Treated loops, keyed by (file path, file stamp, dataset, position, shot index, treatment hash)
+_moke_treated_cache = OrderedDict()
+_moke_treated_cache_lock = threading.Lock()
+_moke_treated_cache_size = {"bytes": 0}
+
+# Metrics of the treatment sweeps, with their units, same names as the columns of the results dataframe
+MOKE_SWEEP_METRICS = {
+    "max_kerr_signal": "V",
+    "reflectivity": "V",
+    "coercivity_m0": "T",
+    "coercivity_dmdh": "T",
+    "intercept_field": "T",
+    "remanent_kerr_signal": "arb",
+}
+
+# Largest number of parameter sets of a treatment sweep
+MOKE_SWEEP_MAX_SETS = 256
+
+# Part of the treatment hash stored with the results, bump it when the fits change to refit every position
+MOKE_FIT_VERSION = "1"
+
+
+def moke_is_stacked_measurement(measurement_group):
+    """
+    Check if a measurement group stores its shots as stacked (samples x shots) arrays (moke writer >= 0.5)
+    instead of one shot_N group per shot.
+
+    @param measurement_group: MOKE measurement group of a position
+    @return: True if the shots are stacked, False for the legacy layout
+    """
+    return all(channel in measurement_group for channel in MOKE_SHOT_CHANNELS)
+
+
+def moke_get_shot_count(measurement_group):
+    """
+    Count the shots of a measurement group, for both storage layouts.
+
+    @param measurement_group: MOKE measurement group of a position
+    @return: number of shots
+    """
+    if moke_is_stacked_measurement(measurement_group):
+        return measurement_group["magnetization"].shape[1]
+    return len([name for name in measurement_group.keys() if re.fullmatch(r"shot_\d+", name)])
+
+
+def moke_read_shot_arrays(measurement_group, index=0):
+    """
+    Read the channels of one shot of a measurement group, for both storage layouts.
+
+    @param measurement_group: MOKE measurement group of a position
+    @param index: shot number starting at 1, 0 for the mean of all shots
+    @return: dictionary {channel: array} for every channel of MOKE_SHOT_CHANNELS
+    """
+    if index == 0:
+        mean_shot_group = measurement_group.get("shot_mean")
+        if mean_shot_group is None:
+            raise KeyError("Failed to retrieve shot_mean group")
+        return {channel: mean_shot_group[f"{channel}_mean"][()] for channel in MOKE_SHOT_CHANNELS}
+
+    if moke_is_stacked_measurement(measurement_group):
+        if index > measurement_group["magnetization"].shape[1]:
+            raise KeyError(
+                "Failed to retrieve shot, index is probably out of bounds"
+            )
+        return {channel: measurement_group[channel][:, index - 1] for channel in MOKE_SHOT_CHANNELS}
+
+    shot_group = measurement_group.get(f"shot_{index}")
+    if shot_group is None:
+        raise KeyError(
+            "Failed to retrieve shot group, index is probably out of bounds"
+        )
+    return {channel: shot_group[f"{channel}_{index}"][()] for channel in MOKE_SHOT_CHANNELS}
+
+
+def moke_init_shot_statistics(length):
+    """
+    Accumulators of the shot statistics of a position, updated one shot at a time so that memory does not
+    depend on the number of shots.
+
+    @param length: number of samples per shot
+    @return: dictionary of accumulators, see moke_update_shot_statistics
+    """
+    return {
+        "count": 0,
+        "mean": {channel: np.zeros(length) for channel in MOKE_SHOT_CHANNELS},
+        "m2": {channel: np.zeros(length) for channel in MOKE_SHOT_CHANNELS},
+        "offsets": {"magnetization": [], "reflectivity": []},
+    }
+
+
+def moke_update_shot_statistics(statistics_dict, shot_dict):
+    """
+    Add one shot to the accumulators, with Welford's update of the running mean and sum of squared deviations.
+
+    @param statistics_dict: accumulators from moke_init_shot_statistics
+    @param shot_dict: dictionary {channel: 1D array} of one shot, for every channel of MOKE_SHOT_CHANNELS
+    @return: None
+    """
+    statistics_dict["count"] += 1
+    count = statistics_dict["count"]
+    for channel in MOKE_SHOT_CHANNELS:
+        values = np.asarray(shot_dict[channel], dtype="float")
+        mean = statistics_dict["mean"][channel]
+        delta = values - mean
+        mean += delta / count
+        statistics_dict["m2"][channel] += delta * (values - mean)
+    # Average level of each shot, used for the drift
+    for channel, offset_list in statistics_dict["offsets"].items():
+        offset_list.append(_nan_reduce(np.nanmean, np.asarray(shot_dict[channel], dtype="float")))
+
+
+def _shot_drift(offset_list):
+    """Slope of the average level of the shots against the shot number, NaN with less than two shots"""
+    if len(offset_list) < 2:
+        return np.nan
+    shot_number = np.arange(len(offset_list)) - (len(offset_list) - 1) / 2
+    offsets = np.asarray(offset_list)
+    return float(np.sum(shot_number * (offsets - offsets.mean())) / np.sum(shot_number**2))
+
+
+def moke_finalize_shot_statistics(statistics_dict):
+    """
+    Per sample mean and standard deviation of every channel and per position noise, SNR and drift.
+    The standard deviation is the sample one (ddof=1), NaN with a single shot.
+    The SNR is the half amplitude of the mean magnetization over the magnetization noise, NaN without noise.
+
+    @param statistics_dict: accumulators from moke_init_shot_statistics
+    @return: dictionary {"mean": {channel: array}, "std": {channel: array}, "metrics": {name: float}}
+    """
+    count = statistics_dict["count"]
+    std_dict = {}
+    for channel, m2 in statistics_dict["m2"].items():
+        if count < 2:
+            std_dict[channel] = np.full_like(m2, np.nan)
+        else:
+            std_dict[channel] = np.sqrt(m2 / (count - 1))
+
+    mean_dict = statistics_dict["mean"]
+    magnetization_noise = _nan_reduce(np.nanmean, std_dict["magnetization"])
+    amplitude = (
+        _nan_reduce(np.nanmax, mean_dict["magnetization"]) - _nan_reduce(np.nanmin, mean_dict["magnetization"])
+    ) / 2
+    snr = np.nan
+    if magnetization_noise > 0:
+        snr = amplitude / magnetization_noise
+
+    metrics_dict = {
+        "magnetization_noise": float(magnetization_noise),
+        "reflectivity_noise": float(_nan_reduce(np.nanmean, std_dict["reflectivity"])),
+        "snr": float(snr),
+        "magnetization_drift": _shot_drift(statistics_dict["offsets"]["magnetization"]),
+        "reflectivity_drift": _shot_drift(statistics_dict["offsets"]["reflectivity"]),
+    }
+
+    return {"mean": mean_dict, "std": std_dict, "metrics": metrics_dict}
+
+
 def moke_get_measurement_from_hdf5(moke_group, target_x, target_y, index=1):
     position_group = get_target_position_group(moke_group, target_x, target_y)
     measurement_group = position_group.get("measurement")
     time_array = measurement_group[f"time"][()]
 
-    if index == 0:
-        mean_shot_group = measurement_group.get(["shot_mean"])
-
-        magnetization_array = mean_shot_group["magnetization_mean"][()]
-        pulse_array = mean_shot_group["pulse_mean"][()]
-        reflectivity_array = mean_shot_group["reflectivity_mean"][()]
-        integrated_pulse_array = mean_shot_group["integrated_pulse_mean"][()]
-
-        measurement_dataframe = pd.DataFrame(
-            {
-                "magnetization": magnetization_array,
-                "pulse": pulse_array,
-                "reflectivity": reflectivity_array,
-                "integrated_pulse": integrated_pulse_array,
-                "time": time_array,
-            }
-        )
+    if index < 0:
+        raise KeyError("Shot index must be positive, 0 selects the mean of all shots")
 
-        return measurement_dataframe
+    measurement_dataframe = pd.DataFrame(moke_read_shot_arrays(measurement_group, index))
+    measurement_dataframe["time"] = time_array
 
-    elif index > 0:
-        shot_group = measurement_group.get(f"shot_{index}")
+    return measurement_dataframe
 
-        if shot_group is None:
-            raise KeyError(
-                "Failed to retrieve shot group, index is probably out of bounds"
-            )
 
-        magnetization_array = shot_group[f"magnetization_{index}"][()]
-        pulse_array = shot_group[f"pulse_{index}"][()]
-        reflectivity_array = shot_group[f"reflectivity_{index}"][()]
-        integrated_pulse_array = shot_group[f"integrated_pulse_{index}"][()]
-
-        measurement_dataframe = pd.DataFrame(
-            {
-                "magnetization": magnetization_array,
-                "pulse": pulse_array,
-                "reflectivity": reflectivity_array,
-                "integrated_pulse": integrated_pulse_array,
-                "time": time_array,
-            }
-        )
+def _moke_treated_cache_pop(key):
+    columns, labels = _moke_treated_cache.pop(key)
+    _moke_treated_cache_size["bytes"] -= sum(array.nbytes for array in columns.values()) + labels.nbytes
+
+
+def moke_get_treated_measurement(moke_group, target_x, target_y, treatment_dict, index=1):
+    """
+    Treated measurement of a position, served from a bounded LRU cache when the same loop has already been treated
+    with the same treatment. Entries of a file are dropped as soon as the file changes on disk.
+
+    @param moke_group: MOKE dataset group
+    @param target_x: x coordinate of the position
+    @param target_y: y coordinate of the position
+    @param treatment_dict: data treatment dictionary
+    @param index: shot number starting at 1, 0 for the mean of all shots
+    @return: treated measurement DataFrame, same as moke_treat_measurement_dataframe
+    """
+    position_group = get_target_position_group(moke_group, target_x, target_y)
+    file_path = os.path.abspath(moke_group.file.filename)
+    try:
+        stat = os.stat(file_path)
+        file_stamp = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        file_stamp = None
+
+    key = (file_path, file_stamp, moke_group.name, position_group.name, index, moke_treatment_hash(treatment_dict))
+    with _moke_treated_cache_lock:
+        cached = _moke_treated_cache.get(key)
+        if cached is not None:
+            _moke_treated_cache.move_to_end(key)
+            columns, labels = cached
+            return pd.DataFrame(columns, index=labels)
+
+    measurement_group = position_group.get("measurement")
+    measurement_dict = moke_read_shot_arrays(measurement_group, index)
+    measurement_dict["time"] = measurement_group["time"][()]
+    columns, labels = moke_treat_measurement_arrays(measurement_dict, treatment_dict)
 
-        return measurement_dataframe
+    with _moke_treated_cache_lock:
+        # Entries of an older version of the file can never be hit again
+        for stale_key in [k for k in _moke_treated_cache if k[0] == file_path and k[1] != file_stamp]:
+            _moke_treated_cache_pop(stale_key)
+
+        if key not in _moke_treated_cache:
+            _moke_treated_cache[key] = (columns, labels)
+            _moke_treated_cache_size["bytes"] += sum(array.nbytes for array in columns.values()) + labels.nbytes
+        while _moke_treated_cache_size["bytes"] > MOKE_TREATED_CACHE_MAX_BYTES and len(_moke_treated_cache) > 1:
+            _moke_treated_cache_pop(next(iter(_moke_treated_cache)))
+
+    return pd.DataFrame(columns, index=labels)
 
 
 def moke_get_results_from_hdf5(moke_group, target_x, target_y):
@@ -98,7 +292,8 @@ def moke_get_results_from_hdf5(moke_group, target_x, target_y):
     results_group = position_group.get("results")
     if results_group is None:
         raise KeyError("results group not found in file")
-    data_dict = hdf5_group_to_dict(results_group)
+    # Lazy view, callers only read a few results and it must be used while the file is open
+    data_dict = hdf5_group_to_view(results_group)
     return data_dict
 
 
@@ -134,106 +329,123 @@ def moke_integrate_pulse_array(pulse_array):
     return field_array
 
 
-def moke_treat_measurement_dataframe(measurement_df, options_dict):
-    # Check compatibility with the provided data treatment dictionary
-    try:
-        coil_factor = float(options_dict["coil_factor"])
-        pulse_voltage = float(options_dict["pulse_voltage"])
-        smoothing = options_dict["smoothing"]
-        smoothing_polyorder = int(options_dict["smoothing_polyorder"])
-        smoothing_range = int(options_dict["smoothing_range"])
-        correct_offset = options_dict["correct_offset"]
-        filter_zero = options_dict["filter_zero"]
-        connect_loops = options_dict["connect_loops"]
-        shift_loops = options_dict["shift_loops"]
+def moke_parse_treatment_options(options_dict):
+    """
+    Check compatibility with the provided data treatment dictionary and convert its values.
 
+    @param options_dict: data treatment dictionary from callbacks_moke.store_data_treatment
+    @return: dictionary of converted treatment options
+    """
+    try:
+        return {
+            "coil_factor": float(options_dict["coil_factor"]),
+            "pulse_voltage": float(options_dict["pulse_voltage"]),
+            "smoothing": options_dict["smoothing"],
+            "smoothing_polyorder": int(options_dict["smoothing_polyorder"]),
+            "smoothing_range": int(options_dict["smoothing_range"]),
+            "correct_offset": options_dict["correct_offset"],
+            "filter_zero": options_dict["filter_zero"],
+            "connect_loops": options_dict["connect_loops"],
+            "shift_loops": options_dict["shift_loops"],
+        }
     except KeyError:
         raise KeyError(
             "Invalid data treatment dictionary, "
             "check compatibility between callbacks_moke.store_data_treatment and functions_moke.treat_data"
         )
 
-    # Set field using coil parameters
-    midpoint = len(measurement_df) // 2
-    max_field = pulse_voltage * coil_factor / 100
 
-    measurement_df.loc[:midpoint, "field"] = measurement_df.loc[
-        :midpoint, "integrated_pulse"
-    ].apply(lambda x: -x * max_field / np.abs(measurement_df["integrated_pulse"].min()))
-    measurement_df.loc[midpoint:, "field"] = measurement_df.loc[
-        midpoint:, "integrated_pulse"
-    ].apply(lambda x: -x * max_field / np.abs(measurement_df["integrated_pulse"].max()))
+def _nan_reduce(function, array):
+    """Apply a nan-aware reduction, returning NaN instead of warning when there is no valid value (as pandas does)"""
+    if array.size == 0 or np.all(np.isnan(array)):
+        return np.nan
+    return function(array)
+
+
+def _select_rows(columns, labels, keep):
+    return {key: value[keep] for key, value in columns.items()}, labels[keep]
+
+
+def moke_treat_measurement_arrays(measurement_dict, options_dict, index=None):
+    """
+    Array based data treatment of a MOKE measurement, same semantics as the original row by row pandas treatment
+    (kept in tests/test_functions_moke.py), including its label based half selections.
+
+    @param measurement_dict: dictionary {column: 1D array}, must contain integrated_pulse and magnetization
+    @param options_dict: data treatment dictionary from callbacks_moke.store_data_treatment
+    @param index: row labels of the measurement, 0 to n-1 if None
+    @return: (dictionary {column: 1D array} with an added field column, array of row labels)
+    """
+    options = moke_parse_treatment_options(options_dict)
+
+    columns = {key: np.array(value, dtype="float") for key, value in measurement_dict.items()}
+    length = len(columns["integrated_pulse"])
+    labels = np.arange(length) if index is None else np.asarray(index)
+
+    # Set field using coil parameters, the first half is scaled by the minimum and the second one by the maximum
+    midpoint = length // 2
+    max_field = options["pulse_voltage"] * options["coil_factor"] / 100
+    integrated_pulse = columns["integrated_pulse"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        negative_field = -integrated_pulse * max_field / np.abs(_nan_reduce(np.nanmin, integrated_pulse))
+        positive_field = -integrated_pulse * max_field / np.abs(_nan_reduce(np.nanmax, integrated_pulse))
+    field = np.where(labels <= midpoint, negative_field, np.nan)
+    columns["field"] = np.where(labels >= midpoint, positive_field, field)
 
     # Vertically center the loop
-    if correct_offset:
-        magnetization_offset = measurement_df["magnetization"].mean()
-        measurement_df.loc[:, "magnetization"] = measurement_df.loc[
-            :, "magnetization"
-        ].apply(lambda x: x - magnetization_offset)
+    if options["correct_offset"]:
+        columns["magnetization"] = columns["magnetization"] - _nan_reduce(np.nanmean, columns["magnetization"])
 
     # Shift loops
-    if shift_loops:
-        # Step 1: Remove NaNs (if filtering left them)
-        measurement_df = measurement_df[measurement_df["field"].notna()]
-
-        # Step 2: Split into two halves (assuming they're in time order)
-        midpoint = len(measurement_df) // 2
-        first_pulse = measurement_df.iloc[:midpoint]  # 0 → -X → 0
-        second_pulse = measurement_df.iloc[midpoint:]  # 0 → +X → 0
+    if options["shift_loops"]:
+        columns, labels = _select_rows(columns, labels, ~np.isnan(columns["field"]))
 
+        midpoint = len(labels) // 2
+        magnetization = columns["magnetization"]
         average_shift = (
-            second_pulse["magnetization"][:300].mean()
-            - first_pulse["magnetization"][700:].mean()
+            _nan_reduce(np.nanmean, magnetization[midpoint:][:300])
+            - _nan_reduce(np.nanmean, magnetization[:midpoint][700:])
         )
 
-        measurement_df.loc[midpoint:, "magnetization"] = measurement_df.loc[
-            midpoint:, "magnetization"
-        ].apply(lambda x: x - average_shift / 2)
-
-        measurement_df.loc[:midpoint, "magnetization"] = measurement_df.loc[
-            :midpoint, "magnetization"
-        ].apply(lambda x: x + average_shift / 2)
+        magnetization = np.where(labels >= midpoint, magnetization - average_shift / 2, magnetization)
+        columns["magnetization"] = np.where(labels <= midpoint, magnetization + average_shift / 2, magnetization)
 
     # Remove oddities around H=0 by forcing points in the positive(negative) loop to be over(under) a threshold
-    if filter_zero:
-        length = len(measurement_df)
-        measurement_df = measurement_df[measurement_df["field"].notna()]
-
-        measurement_df.loc[: length // 2, "field"] = measurement_df.loc[
-            : length // 2, "field"
-        ].where(measurement_df["field"] > 1e-2)
-        measurement_df.loc[length // 2 :, "field"] = measurement_df.loc[
-            length // 2 :, "field"
-        ].where(measurement_df["field"] < -1e-2)
-
-    if connect_loops:
-        # Step 1: Remove NaNs (if filtering left them)
-        measurement_df = measurement_df[measurement_df["field"].notna()]
-
-        # Step 2: Split into two halves (assuming they're in time order)
-        midpoint = len(measurement_df) // 2
-        first_pulse = measurement_df.iloc[:midpoint]  # 0 → -X → 0
-        second_pulse = measurement_df.iloc[midpoint:]  # 0 → +X → 0
-
-        # Step 3: Rearrange: +X → 0 → -X → 0 → +X (start from end of second pulse)
-        reordered = pd.concat([second_pulse, first_pulse], ignore_index=True)
-
-        # Step 4 (optional): Loop continuity — duplicate first few points at end
-        wrap_points = 1  # number of points to "wrap"
-        if len(reordered) >= wrap_points:
-            reordered = pd.concat(
-                [reordered, reordered.iloc[:wrap_points]], ignore_index=True
-            )
-
-        measurement_df = reordered
+    if options["filter_zero"]:
+        half_length = len(labels) // 2
+        columns, labels = _select_rows(columns, labels, ~np.isnan(columns["field"]))
+
+        field = columns["field"]
+        with np.errstate(invalid="ignore"):
+            field = np.where((labels <= half_length) & ~(field > 1e-2), np.nan, field)
+            columns["field"] = np.where((labels >= half_length) & ~(field < -1e-2), np.nan, field)
+
+    if options["connect_loops"]:
+        columns, labels = _select_rows(columns, labels, ~np.isnan(columns["field"]))
+
+        # Rearrange: +X → 0 → -X → 0 → +X (start from the second pulse), then duplicate the first point at the end
+        midpoint = len(labels) // 2
+        order = np.concatenate([np.arange(midpoint, len(labels)), np.arange(midpoint)])
+        if len(order) >= 1:
+            order = np.append(order, order[0])
+        columns = {key: value[order] for key, value in columns.items()}
+        labels = np.arange(len(order))
 
     # Smoothing
-    if smoothing:
-        measurement_df.loc[:, "magnetization"] = savgol_filter(
-            measurement_df["magnetization"], smoothing_range, smoothing_polyorder
+    if options["smoothing"]:
+        columns["magnetization"] = savgol_filter(
+            columns["magnetization"], options["smoothing_range"], options["smoothing_polyorder"]
         )
 
-    return measurement_df
+    return columns, labels
+
+
+def moke_treat_measurement_dataframe(measurement_df, options_dict):
+    measurement_dict = {column: measurement_df[column].to_numpy() for column in measurement_df.columns}
+    columns, labels = moke_treat_measurement_arrays(
+        measurement_dict, options_dict, index=measurement_df.index.to_numpy()
+    )
+    return pd.DataFrame(columns, index=labels)
 
 
 def moke_calc_max_kerr_rotation(data: pd.DataFrame):
@@ -340,21 +552,17 @@ def moke_calc_remanence(data: pd.DataFrame):
     return remanence_positive, remanence_negative
 
 
-def moke_fit_intercept(data: pd.DataFrame, treatment_dict: dict):
+def moke_intercept_field_ranges(treatment_dict: dict):
     """
-    From a dataframe, fit for the intercept field and return the intercept field values
+    Field bounds (T) of the linear and saturated sections used by the intercept fits
 
     Parameters:
-        data(pd.Dataframe) : source dataframe with a 'field' and 'magnetization' column
         treatment_dict(dict) : Dictionary with data treatment information. See callbacks_moke.store_data_treatment
 
     Returns:
-        float, float, dict
-        Returned dictionary contains the direct results from the fits for plotting
+        float, float, float, float
+        Lower and upper bounds of the linear section, then of the saturated sections
     """
-
-    force_flat = True
-
     coil_factor = float(treatment_dict["coil_factor"])
     pulse_voltage = float(treatment_dict["pulse_voltage"])
     max_field = coil_factor / 100 * pulse_voltage
@@ -366,6 +574,26 @@ def moke_fit_intercept(data: pd.DataFrame, treatment_dict: dict):
     Hmin_sat = sat_field + 0.25
     Hmax_sat = 0.95 * max_field
 
+    return Hmin, Hmax, Hmin_sat, Hmax_sat
+
+
+def moke_fit_intercept(data: pd.DataFrame, treatment_dict: dict):
+    """
+    From a dataframe, fit for the intercept field and return the intercept field values
+
+    Parameters:
+        data(pd.Dataframe) : source dataframe with a 'field' and 'magnetization' column
+        treatment_dict(dict) : Dictionary with data treatment information. See callbacks_moke.store_data_treatment
+
+    Returns:
+        float, float, dict
+        Returned dictionary contains the direct results from the fits for plotting
+    """
+
+    force_flat = MOKE_INTERCEPT_FORCE_FLAT
+
+    Hmin, Hmax, Hmin_sat, Hmax_sat = moke_intercept_field_ranges(treatment_dict)
+
     non_nan = data[data["field"].notna()].index.values
 
     section = data.loc[non_nan, ("magnetization", "field")]
@@ -393,7 +621,7 @@ def moke_fit_intercept(data: pd.DataFrame, treatment_dict: dict):
     y2 = pos_sat_section["magnetization"].values
     if force_flat:
         slope2 = 0
-        intercept2 = np.polyfit(x2, y2, 0)
+        intercept2 = np.polyfit(x2, y2, 0)[0]
     else:
         slope2, intercept2 = np.polyfit(x2, y2, 1)
 
@@ -401,7 +629,7 @@ def moke_fit_intercept(data: pd.DataFrame, treatment_dict: dict):
     y3 = neg_sat_section["magnetization"].values
     if force_flat:
         slope3 = 0
-        intercept3 = np.polyfit(x3, y3, 0)
+        intercept3 = np.polyfit(x3, y3, 0)[0]
     else:
         slope3, intercept3 = np.polyfit(x3, y3, 1)
 
@@ -424,43 +652,275 @@ def moke_fit_intercept(data: pd.DataFrame, treatment_dict: dict):
     return float(positive_intercept_field), float(negative_intercept_field), fit_dict
 
 
-def moke_batch_fit(moke_group, treatment_dict):
-    results_dict = {}
+def moke_list_positions(moke_group):
+    """
+    Names of the measured positions of a MOKE dataset, in file order.
+
+    @param moke_group: MOKE dataset group
+    @return: list of position names
+    """
     positions_group = get_positions_group(moke_group)
-    for position, position_group in positions_group.items():
-        if "scan_parameters" in position:
-            continue
+    return [position for position in positions_group.keys() if "scan_parameters" not in position]
 
-        mean_shot_group = position_group.get("measurement/shot_mean")
 
-        magnetization_array = mean_shot_group["magnetization_mean"][()]
-        pulse_array = mean_shot_group["pulse_mean"][()]
-        reflectivity_array = mean_shot_group["reflectivity_mean"][()]
-        integrated_pulse_array = mean_shot_group["integrated_pulse_mean"][()]
+def moke_treatment_hash(treatment_dict):
+    """
+    Fingerprint of a data treatment dictionary and of the fit version, stored with the results of each position.
 
-        measurement_dataframe = pd.DataFrame(
-            {
-                "magnetization": magnetization_array,
-                "pulse": pulse_array,
-                "reflectivity": reflectivity_array,
-                "integrated_pulse": integrated_pulse_array,
-            }
-        )
+    @param treatment_dict: data treatment dictionary
+    @return: str hexadecimal digest
+    """
+    treatment_string = json.dumps({"fit_version": MOKE_FIT_VERSION, **treatment_dict}, sort_keys=True, default=str)
+    return hashlib.sha1(treatment_string.encode("utf-8")).hexdigest()
 
-        measurement_dataframe = moke_treat_measurement_dataframe(
-            measurement_dataframe, treatment_dict
-        )
 
-        max_kerr_rotation = moke_calc_max_kerr_rotation(measurement_dataframe)
-        reflectivity = moke_calc_reflectivity(measurement_dataframe)
-        coercivity_m0 = list(moke_calc_mzero_coercivity(measurement_dataframe))
-        coercivity_dmdh = list(moke_calc_derivative_coercivity(measurement_dataframe))
-        intercepts = list(moke_fit_intercept(measurement_dataframe, treatment_dict))
-        remanence = list(moke_calc_remanence(measurement_dataframe))
+def _attribute_to_str(value):
+    """String attributes are read as str or bytes depending on how they were written"""
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return str(value)
+
+
+def moke_get_measurement_stamp(position_group):
+    """
+    Stamp written by the MOKE writer each time a measurement is (re)written, empty for files written before 0.5.
+
+    @param position_group: MOKE position group
+    @return: str stamp
+    """
+    measurement_group = position_group.get("measurement")
+    if measurement_group is None:
+        return ""
+    return _attribute_to_str(measurement_group.attrs.get("measurement_stamp", ""))
+
+
+def moke_select_positions_to_fit(moke_group, treatment_dict):
+    """
+    Split the positions of a MOKE dataset between those that need a fit (new, changed measurement, different
+    treatment or missing results) and those whose stored results are up to date.
+
+    @param moke_group: MOKE dataset group
+    @param treatment_dict: data treatment dictionary
+    @return: (list of positions to fit, list of skipped positions)
+    """
+    treatment_hash = moke_treatment_hash(treatment_dict)
+    positions_group = get_positions_group(moke_group)
+
+    fit_list = []
+    skipped_list = []
+    for position in moke_list_positions(moke_group):
+        position_group = positions_group[position]
+        results_group = position_group.get("results")
+        if (
+            results_group is not None
+            and _attribute_to_str(results_group.attrs.get("treatment_hash", "")) == treatment_hash
+            and _attribute_to_str(results_group.attrs.get("measurement_stamp", ""))
+            == moke_get_measurement_stamp(position_group)
+        ):
+            skipped_list.append(position)
+        else:
+            fit_list.append(position)
+
+    return fit_list, skipped_list
+
+
+def moke_load_treated_matrix(moke_group, treatment_dict, position_list=None, index=0):
+    """
+    Treat the shot_mean traces of every position and stack them into (positions x samples) arrays.
+    Treated traces can have different lengths, they are padded with NaN up to the raw trace length + 1
+    (the longest a treatment can produce), so that the padding does not depend on which positions are loaded.
+
+    @param moke_group: MOKE dataset group
+    @param treatment_dict: data treatment dictionary
+    @param position_list: names of the positions to load, every position if None
+    @param index: shot number starting at 1, 0 for the mean of all shots
+    @return: (list of position names, dictionary {column: 2D array})
+    """
+    if position_list is None:
+        position_list = moke_list_positions(moke_group)
+
+    treated_list = []
+    length = 0
+    positions_group = get_positions_group(moke_group)
+    for position in position_list:
+        measurement_group = positions_group[position].get("measurement")
+        shot_arrays = moke_read_shot_arrays(measurement_group, index)
+        columns, labels = moke_treat_measurement_arrays(shot_arrays, treatment_dict)
+        treated_list.append(columns)
+        length = max(length, len(shot_arrays["magnetization"]) + 1, len(columns["field"]))
+
+    return position_list, _stack_treated_columns(treated_list, length)
+
+
+def _stack_treated_columns(treated_list, length):
+    """Stack treated traces into NaN padded (positions x length) arrays"""
+    matrix_dict = {}
+    for column in ["magnetization", "reflectivity", "field"]:
+        matrix = np.full((len(treated_list), length), np.nan)
+        for i, columns in enumerate(treated_list):
+            matrix[i, : len(columns[column])] = columns[column]
+        matrix_dict[column] = matrix
+    return matrix_dict
+
+
+def _masked_arg_extremum(values, mask, function=np.argmin):
+    """
+    Row-wise position of the first minimum (or maximum with np.argmax) of values where mask is set,
+    NaN values are skipped as pandas idxmin/idxmax do.
+
+    @return: (array of column indices, array of bool, False for rows without any candidate)
+    """
+    mask = mask & ~np.isnan(values)
+    fill_value = np.inf if function is np.argmin else -np.inf
+    index = function(np.where(mask, values, fill_value), axis=1)
+    return index, mask.any(axis=1)
+
+
+def _take_rows(matrix, index, valid):
+    """Pick one value per row, NaN for rows without any candidate"""
+    values = np.take_along_axis(matrix, index[:, None], axis=1)[:, 0]
+    return np.where(valid, values, np.nan)
+
+
+def _batched_linear_fit(x, y, mask, flat=False):
+    """
+    Closed form least squares of y = slope * x + intercept on the masked samples of every row.
+
+    @return: (slope array, intercept array), NaN for rows without enough samples
+    """
+    mask = mask & ~np.isnan(x) & ~np.isnan(y)
+    count = mask.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_mean = np.where(mask, x, 0).sum(axis=1) / count
+        y_mean = np.where(mask, y, 0).sum(axis=1) / count
+        if flat:
+            return np.zeros(len(x)), y_mean
+        x_centered = np.where(mask, x - x_mean[:, None], 0)
+        y_centered = np.where(mask, y - y_mean[:, None], 0)
+        slope = (x_centered * y_centered).sum(axis=1) / (x_centered**2).sum(axis=1)
+    intercept = y_mean - slope * x_mean
+    return slope, intercept
+
+
+def moke_batch_figures_of_merit(matrix_dict, treatment_dict, threshold=8.0e-3):
+    """
+    Compute the figures of merit of every position at once from the (positions x samples) treated arrays.
+    Same definitions as moke_calc_max_kerr_rotation, moke_calc_reflectivity, moke_calc_mzero_coercivity,
+    moke_calc_derivative_coercivity, moke_calc_remanence and moke_fit_intercept.
+    Positions without any point in a section get NaN instead of raising.
+
+    @param matrix_dict: dictionary {column: 2D array} from moke_load_treated_matrix
+    @param treatment_dict: data treatment dictionary
+    @param threshold: magnetization under which the m0 coercivity is set to 0
+    @return: dictionary {figure of merit: 1D array}, fit ranges are lists of arrays
+    """
+    magnetization = matrix_dict["magnetization"]
+    field = matrix_dict["field"]
+    with np.errstate(invalid="ignore"):
+        positive_field = field > 0
+        negative_field = field < 0
+
+    with warnings.catch_warnings():
+        # Rows full of NaN give NaN, as pandas does
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        kerr_max = np.nanmax(magnetization, axis=1)
+        kerr_min = np.nanmin(magnetization, axis=1)
+        reflectivity = np.nanmean(matrix_dict["reflectivity"], axis=1)
+    fom_dict = {
+        "max_kerr_signal": (kerr_max + np.abs(kerr_min)) / 2,
+        "reflectivity": reflectivity,
+    }
+
+    # Coercivity where the magnetization is closest to 0
+    index, valid = _masked_arg_extremum(np.abs(magnetization), positive_field)
+    coercivity_positive = _take_rows(field, index, valid)
+    index, valid = _masked_arg_extremum(np.abs(magnetization), negative_field)
+    coercivity_negative = _take_rows(field, index, valid)
+    no_loop = (kerr_max < threshold) & (kerr_min > -threshold)
+    fom_dict["coercivity_m0_positive"] = np.where(no_loop, 0, coercivity_positive)
+    fom_dict["coercivity_m0_negative"] = np.where(no_loop, 0, coercivity_negative)
+
+    # Coercivity at the extremes of dM/dH, avoiding derivative discrepancies around 0 field
+    derivative = np.zeros_like(magnetization)
+    derivative[:, 1:] = np.nan_to_num(np.diff(magnetization, axis=1), nan=0.0)
+    with np.errstate(invalid="ignore"):
+        derivative[np.abs(field) < 2e-3] = 0
+    index, valid = _masked_arg_extremum(derivative, positive_field, function=np.argmax)
+    fom_dict["coercivity_dmdh_positive"] = _take_rows(field, index, valid)
+    index, valid = _masked_arg_extremum(derivative, negative_field)
+    fom_dict["coercivity_dmdh_negative"] = _take_rows(field, index, valid)
+
+    # Remanence, magnetization where the field is closest to 0
+    with np.errstate(invalid="ignore"):
+        index, valid = _masked_arg_extremum(np.abs(field), magnetization > 0)
+        fom_dict["remanence_positive"] = _take_rows(magnetization, index, valid)
+        index, valid = _masked_arg_extremum(np.abs(field), magnetization < 0)
+        fom_dict["remanence_negative"] = _take_rows(magnetization, index, valid)
+
+    # Intercept field, from fits of the linear section and of both saturated sections
+    Hmin, Hmax, Hmin_sat, Hmax_sat = moke_intercept_field_ranges(treatment_dict)
+    with np.errstate(invalid="ignore"):
+        linear_mask = (np.abs(field) > Hmin) & (np.abs(field) < Hmax)
+        positive_mask = (field > Hmin_sat) & (field < Hmax_sat)
+        negative_mask = (field < -Hmin_sat) & (field > -Hmax_sat)
+    slope1, intercept1 = _batched_linear_fit(field, magnetization, linear_mask)
+    slope2, intercept2 = _batched_linear_fit(field, magnetization, positive_mask, flat=MOKE_INTERCEPT_FORCE_FLAT)
+    slope3, intercept3 = _batched_linear_fit(field, magnetization, negative_mask, flat=MOKE_INTERCEPT_FORCE_FLAT)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fom_dict["intercept_positive"] = (intercept2 - intercept1) / (slope1 - slope2)
+        fom_dict["intercept_negative"] = (intercept3 - intercept1) / (slope1 - slope3)
+
+    fom_dict.update(
+        {
+            "linear_section_slope": slope1,
+            "linear_section_intercept": intercept1,
+            "positive_section_slope": slope2,
+            "positive_section_intercept": intercept2,
+            "negative_section_slope": slope3,
+            "negative_section_intercept": intercept3,
+            "linear_section_range": [row[mask] for row, mask in zip(field, linear_mask)],
+            "positive_section_range": [row[mask] for row, mask in zip(field, positive_mask)],
+            "negative_section_range": [row[mask] for row, mask in zip(field, negative_mask)],
+        }
+    )
+
+    return fom_dict
+
+
+def moke_batch_fit(moke_group, treatment_dict, position_list=None):
+    """
+    Fit every position of a MOKE dataset, figures of merit are computed for the whole wafer at once.
+
+    @param moke_group: MOKE dataset group
+    @param treatment_dict: data treatment dictionary
+    @param position_list: names of the positions to fit, every position if None
+    @return: results dictionary {position: results}, as expected by moke_results_dict_to_hdf5
+    """
+    results_dict = {}
+    position_list, matrix_dict = moke_load_treated_matrix(moke_group, treatment_dict, position_list)
+    fom_dict = moke_batch_figures_of_merit(matrix_dict, treatment_dict)
+
+    for i, position in enumerate(position_list):
+        max_kerr_rotation = fom_dict["max_kerr_signal"][i]
+        coercivity_m0 = [fom_dict["coercivity_m0_positive"][i], fom_dict["coercivity_m0_negative"][i]]
+        coercivity_dmdh = [fom_dict["coercivity_dmdh_positive"][i], fom_dict["coercivity_dmdh_negative"][i]]
+        intercepts = [fom_dict["intercept_positive"][i], fom_dict["intercept_negative"][i]]
+        remanence = [fom_dict["remanence_positive"][i], fom_dict["remanence_negative"][i]]
+        fit_dict = {
+            "linear_section_intercept": float(fom_dict["linear_section_intercept"][i]),
+            "linear_section_slope": float(fom_dict["linear_section_slope"][i]),
+            "linear_section_range": fom_dict["linear_section_range"][i],
+            "positive_section_intercept": float(fom_dict["positive_section_intercept"][i]),
+            "positive_section_slope": float(fom_dict["positive_section_slope"][i]),
+            "positive_section_range": fom_dict["positive_section_range"][i],
+            "negative_section_intercept": float(fom_dict["negative_section_intercept"][i]),
+            "negative_section_slope": float(fom_dict["negative_section_slope"][i]),
+            "negative_section_range": fom_dict["negative_section_range"][i],
+        }
 
         results_dict[f"{position}"] = {
             "max_kerr_signal": max_kerr_rotation,
-            "reflectivity": reflectivity,
+            "reflectivity": fom_dict["reflectivity"][i],
             "coercivity_m0": {
                 "positive": coercivity_m0[0],
                 "negative": coercivity_m0[1],
@@ -472,10 +932,10 @@ def moke_batch_fit(moke_group, treatment_dict):
                 "mean": abs_mean(coercivity_dmdh),
             },
             "intercept_field": {
-                "positive": intercepts[0],
-                "negative": intercepts[1],
-                "mean": abs_mean(intercepts[:2]),
-                "fit_parameters": intercepts[2],
+                "positive": float(intercepts[0]),
+                "negative": float(intercepts[1]),
+                "mean": abs_mean(intercepts),
+                "fit_parameters": fit_dict,
             },
             "remanent_kerr_signal": {
                 "positive": remanence[0] / max_kerr_rotation,
@@ -487,51 +947,247 @@ def moke_batch_fit(moke_group, treatment_dict):
     return results_dict
 
 
+def moke_parse_sweep_values(text, value_type=float):
+    """
+    Read the values of a swept parameter from a comma separated string.
+
+    @param text: e.g. "0.9, 0.92667, 0.95", empty or None for no sweep
+    @param value_type: type of the values
+    @return: list of values, empty if no value is given
+    """
+    if text is None:
+        return []
+    try:
+        return [value_type(value) for value in str(text).replace(";", ",").split(",") if value.strip()]
+    except ValueError:
+        raise ValueError(f"Could not read the sweep values {text}, expected comma separated numbers")
+
+
+def moke_make_treatment_grid(treatment_dict, sweep_dict):
+    """
+    Every combination of the swept parameters, the other parameters are taken from treatment_dict.
+
+    @param treatment_dict: data treatment dictionary used for the parameters that are not swept
+    @param sweep_dict: dictionary {parameter: list of values}, e.g. {"coil_factor": [0.9, 0.95], "smoothing": [True, False]}
+    @return: list of data treatment dictionaries
+    """
+    sweep_dict = {key: list(values) for key, values in sweep_dict.items() if len(values) > 0}
+    for key in sweep_dict:
+        if key not in treatment_dict:
+            raise KeyError(f"{key} is not a data treatment parameter")
+
+    set_count = int(np.prod([len(values) for values in sweep_dict.values()]))
+    if set_count > MOKE_SWEEP_MAX_SETS:
+        raise ValueError(f"The sweep has {set_count} parameter sets, the maximum is {MOKE_SWEEP_MAX_SETS}")
+
+    return [
+        {**treatment_dict, **dict(zip(sweep_dict.keys(), values))}
+        for values in itertools.product(*sweep_dict.values())
+    ]
+
+
+def moke_treatment_label(treatment_dict, key_list):
+    """
+    Short description of a parameter set of a sweep, e.g. "coil_factor=0.9, smoothing=True".
+
+    @param treatment_dict: data treatment dictionary
+    @param key_list: swept parameters
+    @return: str label
+    """
+    if not key_list:
+        return "current treatment"
+    return ", ".join(f"{key}={treatment_dict[key]}" for key in key_list)
+
+
+def moke_sweep_metrics_from_figures(fom_dict):
+    """
+    Figures of merit shown on the sweep maps, computed like the means stored by moke_batch_fit.
+
+    @param fom_dict: dictionary from moke_batch_figures_of_merit
+    @return: 2D array (positions x MOKE_SWEEP_METRICS)
+    """
+    max_kerr_signal = fom_dict["max_kerr_signal"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        remanence_positive = fom_dict["remanence_positive"] / max_kerr_signal
+        remanence_negative = fom_dict["remanence_negative"] / max_kerr_signal
+    metric_dict = {
+        "max_kerr_signal": max_kerr_signal,
+        "reflectivity": fom_dict["reflectivity"],
+        "coercivity_m0": (np.abs(fom_dict["coercivity_m0_positive"]) + np.abs(fom_dict["coercivity_m0_negative"])) / 2,
+        "coercivity_dmdh": (
+            np.abs(fom_dict["coercivity_dmdh_positive"]) + np.abs(fom_dict["coercivity_dmdh_negative"])
+        ) / 2,
+        "intercept_field": (np.abs(fom_dict["intercept_positive"]) + np.abs(fom_dict["intercept_negative"])) / 2,
+        "remanent_kerr_signal": (np.abs(remanence_positive) + np.abs(remanence_negative)) / 2,
+    }
+    return np.stack([np.asarray(metric_dict[metric], dtype="float") for metric in MOKE_SWEEP_METRICS], axis=1)
+
+
+def moke_sweep_treatments(moke_group, treatment_list, position_list=None, index=0):
+    """
+    Evaluate several data treatments on every position in one pass. The traces are read once, the treatment
+    up to the smoothing is shared by the parameter sets that only differ by their smoothing, and the figures of
+    merit of each set are computed for the whole wafer at once.
+
+    @param moke_group: MOKE dataset group
+    @param treatment_list: list of data treatment dictionaries, from moke_make_treatment_grid
+    @param position_list: names of the positions, every position if None
+    @param index: shot number starting at 1, 0 for the mean of all shots
+    @return: (list of position names, 3D array (parameter sets x positions x MOKE_SWEEP_METRICS))
+    """
+    if position_list is None:
+        position_list = moke_list_positions(moke_group)
+
+    positions_group = get_positions_group(moke_group)
+    shot_list = [moke_read_shot_arrays(positions_group[position].get("measurement"), index) for position in position_list]
+    raw_length = max([len(shot_arrays["magnetization"]) + 1 for shot_arrays in shot_list], default=0)
+
+    results_array = np.full((len(treatment_list), len(position_list), len(MOKE_SWEEP_METRICS)), np.nan)
+    if not position_list:
+        return position_list, results_array
+
+    # Parameter sets sharing everything but the smoothing share the same unsmoothed traces
+    base_dict = defaultdict(list)
+    for i, treatment_dict in enumerate(treatment_list):
+        base_dict[moke_treatment_hash({**treatment_dict, "smoothing": False})].append(i)
+
+    for set_index_list in base_dict.values():
+        base_treatment = {**treatment_list[set_index_list[0]], "smoothing": False}
+        base_list = [moke_treat_measurement_arrays(shot_arrays, base_treatment)[0] for shot_arrays in shot_list]
+
+        for i in set_index_list:
+            treatment_dict = treatment_list[i]
+            options = moke_parse_treatment_options(treatment_dict)
+            treated_list = base_list
+            if options["smoothing"]:
+                try:
+                    treated_list = [
+                        {
+                            **columns,
+                            "magnetization": savgol_filter(
+                                columns["magnetization"], options["smoothing_range"], options["smoothing_polyorder"]
+                            ),
+                        }
+                        for columns in base_list
+                    ]
+                except ValueError:
+                    # Invalid smoothing window for these traces, the set is left to NaN
+                    continue
+
+            length = max(raw_length, max(len(columns["field"]) for columns in treated_list))
+            fom_dict = moke_batch_figures_of_merit(_stack_treated_columns(treated_list, length), treatment_dict)
+            results_array[i] = moke_sweep_metrics_from_figures(fom_dict)
+
+    return position_list, results_array
+
+
+def moke_get_sweep_labels(moke_group):
+    """
+    Labels of the parameter sets of the treatment sweep stored in a MOKE dataset.
+
+    @param moke_group: MOKE dataset group
+    @return: list of labels, empty if no sweep was made
+    """
+    sweep_group = moke_group.get("treatment_sweep")
+    if sweep_group is None:
+        return []
+    return [_attribute_to_str(label) for label in sweep_group["labels"][()]]
+
+
+def moke_make_sweep_dataframe_from_hdf5(moke_group, set_index):
+    """
+    Results of one parameter set of the stored treatment sweep, laid out like moke_make_results_dataframe_from_hdf5.
+    Only the requested set is read, the sweep results are chunked by parameter set.
+
+    @param moke_group: MOKE dataset group
+    @param set_index: index of the parameter set
+    @return: DataFrame with x_pos, y_pos, ignored and one column per metric
+    """
+    sweep_group = moke_group.get("treatment_sweep")
+    if sweep_group is None:
+        raise KeyError(f"No treatment sweep in {moke_group.name}")
+    results_dataset = sweep_group["results"]
+    if not 0 <= set_index < results_dataset.shape[0]:
+        raise KeyError(f"No parameter set {set_index} in the treatment sweep of {moke_group.name}")
+
+    position_list = [_attribute_to_str(position) for position in sweep_group["positions"][()]]
+    results_array = results_dataset[set_index]
+
+    # Positions of the wafer, in the order of the position table
+    coordinates_df = make_coordinates_dataframe(moke_group)
+    row_series = pd.Series(np.arange(len(position_list)), index=position_list)
+    position_index = coordinates_df.index[coordinates_df.index.isin(row_series.index)]
+    results_array = results_array[row_series.loc[position_index].to_numpy()]
+
+    sweep_df = coordinates_df.loc[position_index].reset_index(drop=True)
+    for i, (metric, unit) in enumerate(MOKE_SWEEP_METRICS.items()):
+        sweep_df[f"{metric}_({unit})"] = results_array[:, i]
+
+    return sweep_df
+
+
+def moke_get_sweep_metric_range(moke_group, metric):
+    """
+    Smallest and largest value of a metric over every parameter set of the stored sweep,
+    used to keep the same colorbar when flipping between parameter sets.
+
+    @param moke_group: MOKE dataset group
+    @param metric: metric name, with or without its unit
+    @return: (minimum, maximum), NaN if there is no value
+    """
+    metric = metric.split("_(")[0]
+    if metric not in MOKE_SWEEP_METRICS:
+        raise KeyError(f"Unknown sweep metric {metric}, expected one of {list(MOKE_SWEEP_METRICS)}")
+    values = moke_group["treatment_sweep/results"][:, :, list(MOKE_SWEEP_METRICS).index(metric)]
+    return _nan_reduce(np.nanmin, values), _nan_reduce(np.nanmax, values)
+
+
 def moke_make_results_dataframe_from_hdf5(moke_group):
     data_dict_list = []
     positions_group = get_positions_group(moke_group)
-    for position, position_group in positions_group.items():
+    # Coordinates of the spots inside the wafer, read from the position table
+    coordinates_df = make_coordinates_dataframe(moke_group)
 
-        if "scan_parameters" in position:
-            continue
-
-        instrument_group = position_group.get("instrument")
-        # Exclude spots outside the wafer
-        if (
-            np.abs(instrument_group["x_pos"][()])
-            + np.abs(instrument_group["y_pos"][()])
-            <= 60
-        ):
+    for position, x_pos, y_pos, ignored in coordinates_df.itertuples(name=None):
+        results_group = positions_group[position].get("results")
 
-            results_group = position_group.get("results")
+        data_dict = {
+            "x_pos (mm)": x_pos,
+            "y_pos (mm)": y_pos,
+            "ignored": ignored,
+        }
 
-            data_dict = {
-                "x_pos (mm)": instrument_group["x_pos"][()],
-                "y_pos (mm)": instrument_group["y_pos"][()],
-                "ignored": position_group.attrs["ignored"],
-            }
+        if results_group is not None:
+            for value, value_group in results_group.items():
+                if value == "parameters":
+                    continue
+                if isinstance(value_group, h5py.Group):
+                    value_group = value_group["mean"]
 
-            if results_group is not None:
-                for value, value_group in results_group.items():
-                    if value == "parameters":
-                        continue
-                    if isinstance(value_group, h5py.Group):
-                        value_group = value_group["mean"]
+                if "units" in value_group.attrs:
+                    units = value_group.attrs["units"]
+                else:
+                    units = "arb"
 
-                    if "units" in value_group.attrs:
-                        units = value_group.attrs["units"]
-                    else:
-                        units = "arb"
+                data_dict[f"{value}_({units})"] = value_group[()]
 
-                    data_dict[f"{value}_({units})"] = value_group[()]
+        # Shot to shot spread recorded by the writer, kept apart from the results that are rewritten by every fit
+        statistics_group = positions_group[position].get("measurement/shot_statistics")
+        if statistics_group is not None:
+            for value, value_node in statistics_group.items():
+                units = value_node.attrs.get("units", "arb")
+                data_dict[f"{value}_({units})"] = value_node[()]
 
-            data_dict_list.append(data_dict)
+        data_dict_list.append(data_dict)
 
     result_dataframe = pd.DataFrame(data_dict_list)
 
     return result_dataframe
 
 
+register_results_builder("moke_results", moke_make_results_dataframe_from_hdf5)
+
+
 def moke_plot_oscilloscope_from_dataframe(fig, df):
     pulse_shift_factor = df["pulse"].mean()
     magnetization_shift_factor = df["magnetization"].mean() - 0.5
@@ -714,40 +1370,106 @@ def moke_plot_intercept(fig, intercept_dict):
 
     return fig
 
-def moke_plot_loop_map(hdf5_file, options_dict, normalize=False):
-    results_dataframe = moke_make_results_dataframe_from_hdf5(hdf5_file)
-    instrument_dict = moke_get_instrument_dict_from_hdf5(hdf5_file)
+def moke_decimate_loop(field_array, magnetization_array, point_budget=MOKE_LOOP_MAP_POINTS):
+    """
+    Reduce a treated loop to at most point_budget points by averaging consecutive points, NaN points are dropped.
 
-    x_min, x_max = (
-        results_dataframe["x_pos (mm)"].min(),
-        results_dataframe["x_pos (mm)"].max(),
-    )
-    y_min, y_max = (
-        results_dataframe["y_pos (mm)"].min(),
-        results_dataframe["y_pos (mm)"].max(),
+    @param field_array: 1D array of field values
+    @param magnetization_array: 1D array of magnetization values
+    @param point_budget: maximum number of points
+    @return: (decimated field array, decimated magnetization array)
+    """
+    valid = ~np.isnan(field_array) & ~np.isnan(magnetization_array)
+    field_array = field_array[valid]
+    magnetization_array = magnetization_array[valid]
+    if len(field_array) <= point_budget:
+        return field_array, magnetization_array
+
+    edges = np.linspace(0, len(field_array), point_budget + 1).astype(int)[:-1]
+    counts = np.diff(np.append(edges, len(field_array)))
+    return (
+        np.add.reduceat(field_array, edges) / counts,
+        np.add.reduceat(magnetization_array, edges) / counts,
     )
 
-    x_dim, y_dim = int(instrument_dict["number_of_points_x"]), int(
-        instrument_dict["number_of_points_y"]
+
+def moke_plot_loop_map(moke_group, options_dict, normalize=False, point_budget=MOKE_LOOP_MAP_POINTS, index=1):
+    """
+    Plot the treated loop of every position of the wafer on a single pair of axes, each loop drawn in its own cell.
+    Loops are read and treated position by position (the stacked layout keeps the shots of one position together),
+    stacked into NaN padded arrays, decimated to point_budget points and joined with NaN separators into a single
+    WebGL trace.
+
+    @param moke_group: MOKE dataset group
+    @param options_dict: data treatment dictionary
+    @param normalize: if True, each loop fills its cell, otherwise every loop shares the largest Kerr signal scale
+    @param point_budget: maximum number of points per loop
+    @param index: shot number starting at 1, 0 for the mean of all shots
+    @return: plotly figure
+    """
+    coordinates_df = make_coordinates_dataframe(moke_group)
+    coordinates_df = coordinates_df[~coordinates_df["ignored"].astype(bool)]
+
+    position_list, matrix_dict = moke_load_treated_matrix(
+        moke_group, options_dict, position_list=list(coordinates_df.index), index=index
     )
+    field_matrix = matrix_dict["field"]
+    magnetization_matrix = matrix_dict["magnetization"]
+
+    # Cell of every position in the wafer grid
+    x_values, cols = np.unique(coordinates_df["x_pos (mm)"].to_numpy(dtype="float"), return_inverse=True)
+    y_values, rows = np.unique(coordinates_df["y_pos (mm)"].to_numpy(dtype="float"), return_inverse=True)
+    x_dim, y_dim = len(x_values), len(y_values)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        field_scale = np.nanmax(np.abs(field_matrix)) if field_matrix.size else np.nan
+        kerr_max = np.nanmax(magnetization_matrix, axis=1) if field_matrix.size else np.array([])
+        kerr_min = np.nanmin(magnetization_matrix, axis=1) if field_matrix.size else np.array([])
+        y_scale = np.nanmax((kerr_max + np.abs(kerr_min)) / 2) if field_matrix.size else np.nan
+
+    x_list = []
+    y_list = []
+    for i, position in enumerate(position_list):
+        field, magnetization = moke_decimate_loop(field_matrix[i], magnetization_matrix[i], point_budget)
+        if len(field) == 0:
+            continue
 
-    if x_dim == 1:
-        step_x = 1
-    else:
-        step_x = (np.abs(x_max) + np.abs(x_min)) / (x_dim - 1) + ((np.abs(x_max) + np.abs(x_min)) % (x_dim - 1) > 0)
+        if normalize:
+            span = kerr_max[i] - kerr_min[i]
+            magnetization = (magnetization - kerr_min[i]) / span * 2 - 1 if span > 0 else magnetization * 0
+        else:
+            magnetization = magnetization / y_scale
 
-    if y_dim == 1:
-        step_y = 1
-    else:
-        step_y = (np.abs(y_max) + np.abs(y_min)) / (y_dim - 1) + ((np.abs(y_max) + np.abs(y_min)) % (y_dim - 1) > 0)
+        # Loops fill 90% of their cell, the rest is left as a margin between cells
+        x_list.append(cols[i] + 0.5 + 0.45 * field / field_scale)
+        y_list.append(rows[i] + 0.5 + 0.45 * np.clip(magnetization, -1, 1))
+        x_list.append([np.nan])
+        y_list.append([np.nan])
 
-    fig = make_subplots(
-        rows=y_dim, cols=x_dim, horizontal_spacing=0.001, vertical_spacing=0.001
+    fig = go.Figure()
+    fig.add_trace(
+        go.Scattergl(
+            # Single precision is plenty for screen coordinates and halves the figure size
+            x=np.concatenate(x_list).astype("float32") if x_list else [],
+            y=np.concatenate(y_list).astype("float32") if y_list else [],
+            mode="lines",
+            line=dict(color="Black", width=1),
+            hoverinfo="skip",
+        )
     )
 
-    # Update layout to hide axis lines, grid, and ticks for each subplot
-    fig.update_xaxes(showgrid=False, zeroline=False, showticklabels=False)
-    fig.update_yaxes(showgrid=False, zeroline=False, showticklabels=False)
+    # Cell borders, labelled with the position coordinates
+    fig.update_xaxes(
+        range=[0, x_dim], tickvals=np.arange(x_dim) + 0.5, ticktext=[f"{x:g}" for x in x_values],
+        showgrid=False, zeroline=False, minor=dict(tickvals=np.arange(x_dim + 1), showgrid=True, gridcolor="lightgrey"),
+        title="x (mm)",
+    )
+    fig.update_yaxes(
+        range=[0, y_dim], tickvals=np.arange(y_dim) + 0.5, ticktext=[f"{y:g}" for y in y_values],
+        showgrid=False, zeroline=False, minor=dict(tickvals=np.arange(y_dim + 1), showgrid=True, gridcolor="lightgrey"),
+        title="y (mm)",
+    )
 
     # Update layout for aesthetics
     fig.update_layout(
@@ -758,38 +1480,4 @@ def moke_plot_loop_map(hdf5_file, options_dict, normalize=False):
         plot_bgcolor="white",
     )
 
-    for index, row in results_dataframe.iterrows():
-        if row["ignored"]:
-            continue
-
-        target_x = row["x_pos (mm)"]
-        target_y = row["y_pos (mm)"]
-
-        data = moke_get_measurement_from_hdf5(hdf5_file, target_x, target_y)
-        data = moke_treat_measurement_dataframe(data, options_dict)
-
-        fig_col = int((target_x // step_x + (x_dim + 1) // 2))
-        fig_row = int((-target_y // step_y + (y_dim + 1) // 2))
-
-        fig.add_trace(
-            go.Scatter(
-                x=data["field"],
-                y=data["magnetization"],
-                mode="lines",
-                line=dict(color="Black", width=1),
-            ),
-            row=fig_row,
-            col=fig_col,
-        )
-
-        if normalize:
-            fig.update_yaxes(
-                range=[data["magnetization"].min(), data["magnetization"].max()],
-                row=fig_row,
-                col=fig_col,
-            )
-        if not normalize:
-            y_max = results_dataframe["max_kerr_signal_(V)"].max()
-            fig.update_yaxes(range=[-y_max, y_max], row=fig_row, col=fig_col)
-
     return fig
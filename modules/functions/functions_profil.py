@@ -9,12 +9,9 @@ from ..functions.functions_shared import *
 def profil_conditions(hdf5_path, *args, **kwargs):
     if hdf5_path is None:
         return False
-    if not h5py.is_hdf5(hdf5_path):
+    dataset_list = get_catalog_datasets(hdf5_path, dataset_type="profil")
+    if len(dataset_list) == 0:
         return False
-    with h5py.File(hdf5_path, "r") as hdf5_file:
-        dataset_list = get_hdf5_datasets(hdf5_file, dataset_type="profil")
-        if len(dataset_list) == 0:
-            return False
     return True
 
 
@@ -183,34 +180,35 @@ def profil_make_results_dataframe_from_hdf5(profil_group):
     valid_results = ["measured_thickness"]
     data_dict_list = []
     positions_group = get_positions_group(profil_group)
+    # Coordinates of the spots inside the wafer, read from the position table
+    coordinates_df = make_coordinates_dataframe(profil_group)
 
-    for position, position_group in positions_group.items():
-        instrument_group = position_group.get("instrument")
-        # Exclude spots outside the wafer
-        if np.abs(instrument_group["x_pos"][()]) + np.abs(instrument_group["y_pos"][()]) <= 60:
+    for position, x_pos, y_pos, ignored in coordinates_df.itertuples(name=None):
+        results_group = positions_group[position].get("results")
 
-            results_group = position_group.get("results")
+        data_dict = {"x_pos (mm)": x_pos,
+                     "y_pos (mm)": y_pos,
+                     "ignored": ignored}
 
-            data_dict = {"x_pos (mm)": instrument_group["x_pos"][()],
-                         "y_pos (mm)": instrument_group["y_pos"][()],
-                         "ignored": position_group.attrs["ignored"]}
+        if results_group is not None:
+            for value, value_group in results_group.items():
+                if value in valid_results:
+                    if "units" in value_group.attrs:
+                        units = value_group.attrs["units"]
+                    else:
+                        units = "arb"
+                    data_dict[f"{value}_({units})"] = value_group[()]
 
-            if results_group is not None:
-                for value, value_group in results_group.items():
-                    if value in valid_results:
-                        if "units" in value_group.attrs:
-                            units = value_group.attrs["units"]
-                        else:
-                            units = "arb"
-                        data_dict[f"{value}_({units})"] = value_group[()]
-
-            data_dict_list.append(data_dict)
+        data_dict_list.append(data_dict)
 
     result_dataframe = pd.DataFrame(data_dict_list)
 
     return result_dataframe
 
 
+register_results_builder("profil_results", profil_make_results_dataframe_from_hdf5)
+
+
 def profil_plot_total_profile_from_dataframe(fig, df, fit_coefficients = None, position=(1,1)):
     # First plot for raw measurement and linear component
     fig.update_xaxes(title_text="Distance_(um)", row=1, col=1)
@@ -2,8 +2,12 @@ import functools
 import os.path
 import re
 import shutil
+import threading
+import uuid
+from collections import OrderedDict
 from pathlib import Path
 
+import h5py
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
@@ -12,6 +16,26 @@ from scipy.stats import linregress
 from io import StringIO
 import json
 
+# Snapping tolerance (mm) used to match clicked coordinates with stored positions
+POSITION_INDEX_TOLERANCE = 1e-2
+# Dataset subgroup holding the position table (name, x_pos, y_pos, index, ignored columns)
+POSITION_INDEX_GROUP = "position_index"
+
+# In-memory coordinate indexes, keyed by (file path, dataset group name, tolerance)
+_position_index_cache = {}
+
+# Number of results dataframes kept in memory by the server-side results store
+RESULTS_STORE_MAX_ENTRIES = 32
+
+# Server-side results store, the *_results_store components only hold the token of their dataframe
+_results_store = OrderedDict()
+_results_store_lock = threading.Lock()
+_results_store_config = {"max_entries": RESULTS_STORE_MAX_ENTRIES, "spill_dir": None}
+# Heatmap grids of the stored dataframes, keyed by token
+_results_grid_cache = {}
+# Functions rebuilding a results dataframe from its dataset group, called as builder(dataset_group, **kwargs)
+RESULTS_DATAFRAME_BUILDERS = {}
+
 
 # Decorator function to check conditions before executing callbacks, preventing errors
 def check_conditions(conditions_function, hdf5_path_index):
@@ -295,6 +319,33 @@ def calc_poly(coefficient_list, x_end, x_start=0, x_step=1):
     return result
 
 
+def make_heatmap_grid(df):
+    """
+    Map every row of a results dataframe to a (row, col) cell of the wafer grid, so that any column can be
+    scattered into a heatmap without pivoting the dataframe.
+
+    @param df: results dataframe with x_pos (mm) and y_pos (mm) columns
+    @return: dict with the sorted x and y grid values, and the rows and cols cell of each dataframe row
+    """
+    x_values, cols = np.unique(df["x_pos (mm)"].to_numpy(dtype="float"), return_inverse=True)
+    y_values, rows = np.unique(df["y_pos (mm)"].to_numpy(dtype="float"), return_inverse=True)
+
+    return {"x": x_values, "y": y_values, "rows": rows.ravel(), "cols": cols.ravel()}
+
+
+def scatter_to_heatmap_grid(grid, values):
+    """
+    Scatter one value per dataframe row into a 2D array shaped as the wafer grid, empty cells are NaN.
+
+    @param grid: dict generated by make_heatmap_grid
+    @param values: array of values, in the order of the dataframe rows
+    @return: 2D array of shape (len(y), len(x))
+    """
+    grid_data = np.full((len(grid["y"]), len(grid["x"])), np.nan)
+    grid_data[grid["rows"], grid["cols"]] = values
+    return grid_data
+
+
 def make_heatmap_from_dataframe(
     df,
     values=None,
@@ -306,41 +357,33 @@ def make_heatmap_from_dataframe(
     masking=False,
     colorscale="Plasma",
     scaling=1,
+    grid=None,
 ):
+    # The grid can be computed once per dataset and reused when switching between columns
+    if grid is None:
+        grid = make_heatmap_grid(df)
+
     if values is None:
-        df["default"] = df["x_pos (mm)"] + df["y_pos (mm)"]
-        values = "default"
+        value_array = df["x_pos (mm)"].to_numpy(dtype="float") + df["y_pos (mm)"].to_numpy(dtype="float")
         plot_title = "No heatmap selected, default values"
-
-    heatmap_data = df.pivot_table(
-        index="y_pos (mm)",
-        columns="x_pos (mm)",
-        values=values,
-    )
-
-    if "default" in df.columns:
-        df.drop("default", axis="columns", inplace=True)
+    else:
+        value_array = pd.to_numeric(df[values], errors="coerce").to_numpy(dtype="float")
 
     # If mask is set, hide points that have an ignore tag in the database
     if masking:
-        # Create a mask to hide ignored points
-        mask_data = df.pivot_table(
-            index="y_pos (mm)", columns="x_pos (mm)", values="ignored"
-        )
-        # Ignore points
-        mask = mask_data == False
+        value_array = np.where(df["ignored"].to_numpy(dtype="bool"), np.nan, value_array)
 
-        heatmap_data = heatmap_data.where(mask, np.nan)
+    heatmap_data = scatter_to_heatmap_grid(grid, value_array * scaling)
 
     if z_min is None:
-        z_min = np.nanmin(heatmap_data.values * scaling)
+        z_min = np.nanmin(heatmap_data)
     if z_max is None:
-        z_max = np.nanmax(heatmap_data.values * scaling)
+        z_max = np.nanmax(heatmap_data)
 
     heatmap = go.Heatmap(
-        x=heatmap_data.columns,
-        y=heatmap_data.index,
-        z=heatmap_data.values * scaling,
+        x=grid["x"],
+        y=grid["y"],
+        z=heatmap_data,
         colorscale=colorscale,
         # Set ticks for the colorbar
         colorbar=colorbar_layout(z_min, z_max, precision, title=colorbar_title),
@@ -362,16 +405,32 @@ def pairwise(list):
     return zip(a, a)
 
 
-def get_target_position_group(dataset_group, target_x, target_y):
+def get_target_position_group(dataset_group, target_x, target_y, tolerance=None):
+    """
+    Return the position group located at (target_x, target_y), using the coordinate index of the dataset.
+    Coordinates are snapped to the closest position within the index tolerance.
+
+    @param dataset_group: Dataset group containing the positions
+    @param target_x: x coordinate of the target position (mm)
+    @param target_y: y coordinate of the target position (mm)
+    @param tolerance: snapping tolerance (mm), defaults to POSITION_INDEX_TOLERANCE
+    @return: h5py.Group of the target position
+    """
+    if tolerance is None:
+        tolerance = POSITION_INDEX_TOLERANCE
+
     positions_group = get_positions_group(dataset_group)
-    for position, position_group in positions_group.items():
-        instrument_group = position_group.get("instrument")
-        if (
-            instrument_group["x_pos"][()] == target_x
-            and instrument_group["y_pos"][()] == target_y
-        ):
-            return position_group
-    raise KeyError(f"Failed to find position {(target_x, target_y)} in {dataset_group}/{positions_group}")
+    position_index = get_position_index(dataset_group, tolerance)
+    position = find_position_in_index(position_index, target_x, target_y)
+
+    # A group renamed since the table was written means the table is stale, scan the positions once
+    if position is not None and position not in positions_group:
+        position_index = get_position_index(dataset_group, tolerance, rebuild=True)
+        position = find_position_in_index(position_index, target_x, target_y)
+
+    if position is None or position not in positions_group:
+        raise KeyError(f"Failed to find position {(target_x, target_y)} in {dataset_group}/{positions_group}")
+    return positions_group[position]
 
 
 def abs_mean(value_list):
@@ -416,6 +475,17 @@ def linear_fit(df, x_col, y_col):
     print(f"R-squared: {result.rvalue**2}")
     return result
 
+def hdf5_file_stamp(hdf5_path):
+    """
+    Identify the state of a file on disk, used to invalidate everything cached from it.
+
+    @param hdf5_path: path to the HDF5 file
+    @return: tuple (inode, mtime in ns, size)
+    """
+    stat = os.stat(hdf5_path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
 def get_positions_group(dataset_group):
     """
     Function to maintain compatibility with older HDF5 files where positions where directly defined
@@ -427,4 +497,418 @@ def get_positions_group(dataset_group):
     if "positions" in dataset_group:
         return dataset_group["positions"]
     else:
-        return dataset_group
\ No newline at end of file
+        return dataset_group
+
+
+def format_position_index(index):
+    """Convert the index attribute of a position group (int, float, str or array) to a string"""
+    if isinstance(index, bytes):
+        return index.decode("utf-8")
+    if isinstance(index, np.ndarray):
+        return ",".join(str(elm) for elm in index.tolist())
+    return str(index)
+
+
+def scan_position_table(dataset_group):
+    """
+    Read the coordinates, index and ignored tag of every position group of a dataset. Groups without x_pos and y_pos
+    (alignment scans, legacy scan_parameters, furnace positions) are skipped.
+
+    @param dataset_group: Dataset group containing the positions
+    @return: dict of columns {"name", "x_pos", "y_pos", "index", "ignored"}
+    """
+    name_list = []
+    x_list = []
+    y_list = []
+    index_list = []
+    ignored_list = []
+
+    positions_group = get_positions_group(dataset_group)
+    for position, position_group in positions_group.items():
+        if not isinstance(position_group, h5py.Group):
+            continue
+        instrument_group = position_group.get("instrument")
+        if instrument_group is None or "x_pos" not in instrument_group or "y_pos" not in instrument_group:
+            continue
+
+        name_list.append(position)
+        x_list.append(float(instrument_group["x_pos"][()]))
+        y_list.append(float(instrument_group["y_pos"][()]))
+        index_list.append(format_position_index(position_group.attrs.get("index", "")))
+        ignored_list.append(bool(position_group.attrs.get("ignored", False)))
+
+    position_table = {
+        "name": name_list,
+        "x_pos": np.array(x_list, dtype=float),
+        "y_pos": np.array(y_list, dtype=float),
+        "index": index_list,
+        "ignored": np.array(ignored_list, dtype=bool),
+    }
+    return position_table
+
+
+def write_position_table(dataset_group, position_table=None):
+    """
+    Persist the position table of a dataset as contiguous columns in its position_index subgroup.
+    Only datasets using the positions subgroup layout get a table on file, to keep legacy groups untouched.
+
+    @param dataset_group: Dataset group containing the positions
+    @param position_table: dict generated by scan_position_table, scanned from the file if None
+    @return: True if the table has been written, False otherwise
+    """
+    if "positions" not in dataset_group or dataset_group.file.mode != "r+":
+        return False
+
+    if position_table is None:
+        position_table = scan_position_table(dataset_group)
+
+    if POSITION_INDEX_GROUP in dataset_group:
+        del dataset_group[POSITION_INDEX_GROUP]
+
+    table_group = dataset_group.create_group(POSITION_INDEX_GROUP)
+    table_group.attrs["HT_class"] = "HTindex"
+    table_group.attrs["n_positions"] = len(dataset_group["positions"])
+
+    table_group.create_dataset("name", data=position_table["name"], dtype=h5py.string_dtype())
+    x_node = table_group.create_dataset("x_pos", data=position_table["x_pos"], dtype="float")
+    y_node = table_group.create_dataset("y_pos", data=position_table["y_pos"], dtype="float")
+    table_group.create_dataset("index", data=position_table["index"], dtype=h5py.string_dtype())
+    table_group.create_dataset("ignored", data=position_table["ignored"], dtype="bool")
+    x_node.attrs["units"] = "mm"
+    y_node.attrs["units"] = "mm"
+
+    return True
+
+
+def read_position_table(dataset_group):
+    """
+    Read the position table persisted in a dataset group.
+
+    @param dataset_group: Dataset group containing the positions
+    @return: dict of columns {"name", "x_pos", "y_pos", "index", "ignored"}, None if there is no table or if it is stale
+    """
+    table_group = dataset_group.get(POSITION_INDEX_GROUP)
+    if table_group is None or "positions" not in dataset_group:
+        return None
+    if table_group.attrs.get("n_positions") != len(dataset_group["positions"]):
+        return None
+    if any(column not in table_group for column in ["name", "x_pos", "y_pos", "index", "ignored"]):
+        return None
+
+    position_table = {
+        "name": list(table_group["name"].asstr()[()]),
+        "x_pos": table_group["x_pos"][()],
+        "y_pos": table_group["y_pos"][()],
+        "index": list(table_group["index"].asstr()[()]),
+        "ignored": table_group["ignored"][()],
+    }
+    return position_table
+
+
+def get_position_table(dataset_group):
+    """
+    Return the position table of a dataset, from the file if it is up to date, otherwise by scanning
+    every position group. Nothing is written here, tables are persisted by the compilers and the library update.
+
+    @param dataset_group: Dataset group containing the positions
+    @return: dict of columns {"name", "x_pos", "y_pos", "index", "ignored"}
+    """
+    position_table = read_position_table(dataset_group)
+    if position_table is None:
+        position_table = scan_position_table(dataset_group)
+    return position_table
+
+
+def make_coordinates_dataframe(dataset_group, wafer_only=True):
+    """
+    Build the x_pos, y_pos and ignored columns shared by every results dataframe, from the position table.
+
+    @param dataset_group: Dataset group containing the positions
+    @param wafer_only: if True, exclude spots outside the wafer
+    @return: pandas.DataFrame indexed by position group name
+    """
+    position_table = get_position_table(dataset_group)
+
+    coordinates_df = pd.DataFrame(
+        {
+            "x_pos (mm)": position_table["x_pos"],
+            "y_pos (mm)": position_table["y_pos"],
+            "ignored": position_table["ignored"],
+        },
+        index=position_table["name"],
+    )
+
+    if wafer_only:
+        coordinates_df = coordinates_df.loc[
+            np.abs(coordinates_df["x_pos (mm)"]) + np.abs(coordinates_df["y_pos (mm)"]) <= 60
+        ]
+
+    return coordinates_df
+
+
+def toggle_position_ignored(dataset_group, position_group):
+    """
+    Flip the ignored tag of a position group and keep the ignored column of the position table in sync.
+
+    @param dataset_group: Dataset group containing the position
+    @param position_group: Position group to edit
+    @return: bool, new value of the ignored tag
+    """
+    ignored = not position_group.attrs["ignored"]
+    position_group.attrs["ignored"] = ignored
+
+    table_group = dataset_group.get(POSITION_INDEX_GROUP)
+    if table_group is not None and "ignored" in table_group:
+        position = position_group.name.split("/")[-1]
+        rows = np.flatnonzero(table_group["name"].asstr()[()] == position)
+        for row in rows:
+            table_group["ignored"][row] = ignored
+
+    return ignored
+
+
+def make_position_lookup(position_table, tolerance=POSITION_INDEX_TOLERANCE):
+    """
+    Bucket positions on a grid of step tolerance, so that a coordinate lookup only has to check the neighbouring cells.
+
+    @return: dict with the bucketed positions and the tolerance used to build them
+    """
+    buckets = {}
+    for name, x, y in zip(position_table["name"], position_table["x_pos"], position_table["y_pos"]):
+        cell = (int(np.round(x / tolerance)), int(np.round(y / tolerance)))
+        buckets.setdefault(cell, []).append((float(x), float(y), name))
+
+    return {"buckets": buckets, "tolerance": tolerance}
+
+
+def find_position_in_index(position_index, target_x, target_y):
+    """
+    Find the position closest to (target_x, target_y) within the index tolerance.
+
+    @param position_index: dict generated by make_position_lookup
+    @return: name of the position group, None if no position is close enough
+    """
+    tolerance = position_index["tolerance"]
+    buckets = position_index["buckets"]
+    target_x = float(target_x)
+    target_y = float(target_y)
+    cell_x = int(np.round(target_x / tolerance))
+    cell_y = int(np.round(target_y / tolerance))
+
+    closest_position = None
+    closest_distance = tolerance
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for x, y, name in buckets.get((cell_x + dx, cell_y + dy), []):
+                distance = max(abs(x - target_x), abs(y - target_y))
+                if distance <= closest_distance:
+                    closest_position = name
+                    closest_distance = distance
+
+    return closest_position
+
+
+def get_position_index(dataset_group, tolerance=POSITION_INDEX_TOLERANCE, rebuild=False):
+    """
+    Return the coordinate index of a dataset, from memory if the file did not change on disk, then from the position
+    table on file, and finally by scanning every position group. Lookups never write to the file.
+
+    @param dataset_group: Dataset group containing the positions
+    @param tolerance: snapping tolerance (mm)
+    @param rebuild: if True, ignore cached and persisted tables and scan the positions again
+    @return: dict generated by make_position_lookup
+    """
+    file_path = str(Path(dataset_group.file.filename).resolve())
+    try:
+        stamp = hdf5_file_stamp(file_path)
+    except OSError:
+        stamp = None
+    # Writes made through a handle still open are not on disk yet, the number of positions catches added ones
+    n_positions = len(get_positions_group(dataset_group))
+
+    cache_key = (file_path, dataset_group.name, tolerance)
+    cached = _position_index_cache.get(cache_key)
+    if not rebuild and cached is not None and stamp is not None:
+        if cached["stamp"] == stamp and cached["n_positions"] == n_positions:
+            return cached["index"]
+
+    position_table = None if rebuild else read_position_table(dataset_group)
+    if position_table is None:
+        position_table = scan_position_table(dataset_group)
+
+    position_index = make_position_lookup(position_table, tolerance=tolerance)
+    _position_index_cache[cache_key] = {
+        "stamp": stamp,
+        "n_positions": n_positions,
+        "index": position_index,
+    }
+
+    return position_index
+
+
+def configure_results_store(max_entries=None, spill_dir=None):
+    """
+    Set the size of the in-memory results store and the folder where evicted dataframes are spilled as Feather files.
+
+    @param max_entries: number of dataframes kept in memory, unchanged if None
+    @param spill_dir: folder for evicted dataframes, unchanged if None
+    @return: None
+    """
+    with _results_store_lock:
+        if max_entries is not None:
+            _results_store_config["max_entries"] = max(int(max_entries), 1)
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+            _results_store_config["spill_dir"] = spill_dir
+
+
+def register_results_builder(name, builder):
+    """
+    Register the function building a results dataframe, so that a token missing from the store of this process
+    (evicted, or created by another server worker) can be rebuilt from its dataset.
+
+    @param name: name of the builder, stored in the tokens
+    @param builder: function called as builder(dataset_group, **kwargs), returning a DataFrame or None
+    @return: None
+    """
+    RESULTS_DATAFRAME_BUILDERS[name] = builder
+
+
+def _read_results_token(token):
+    """Decode a token into its source, None for tokens without one"""
+    try:
+        source = json.loads(token)
+    except (TypeError, ValueError):
+        return None
+    return source if isinstance(source, dict) else None
+
+
+def _results_store_spill_path(token):
+    spill_dir = _results_store_config["spill_dir"]
+    if spill_dir is None:
+        return None
+    source = _read_results_token(token)
+    token_id = source["id"] if source is not None else token
+    return os.path.join(spill_dir, f"{token_id}.feather")
+
+
+def _results_store_insert(token, df):
+    _results_store[token] = df
+    while len(_results_store) > _results_store_config["max_entries"]:
+        evicted_token, evicted_df = _results_store.popitem(last=False)
+        _results_grid_cache.pop(evicted_token, None)
+        spill_path = _results_store_spill_path(evicted_token)
+        if spill_path is not None:
+            # Feather only accepts a default index, the original one is kept as the first column
+            evicted_df.reset_index().to_feather(spill_path)
+
+
+def put_results_dataframe(df, builder=None, hdf5_path=None, dataset_name=None, builder_kwargs=None):
+    """
+    Keep a results dataframe on the server and return the opaque token to put in a *_results_store component.
+    Tokens carrying the builder and the dataset of their dataframe can be rebuilt by any process.
+
+    @param df: results dataframe
+    @param builder: name of a builder registered with register_results_builder
+    @param hdf5_path: path of the HDF5 file holding the dataset
+    @param dataset_name: name of the dataset group
+    @param builder_kwargs: JSON serializable keyword arguments of the builder
+    @return: str token
+    """
+    token_id = uuid.uuid4().hex
+    if builder is None:
+        token = token_id
+    else:
+        token = json.dumps(
+            {
+                "id": token_id,
+                "builder": builder,
+                "hdf5_path": str(hdf5_path),
+                "dataset": dataset_name,
+                "kwargs": builder_kwargs or {},
+            },
+            sort_keys=True,
+        )
+    with _results_store_lock:
+        _results_store_insert(token, df)
+    return token
+
+
+def rebuild_results_dataframe(token):
+    """
+    Build the dataframe of a token again from its dataset.
+
+    @param token: str token generated by put_results_dataframe
+    @return: DataFrame, None if the token has no source or its dataset is gone
+    """
+    source = _read_results_token(token)
+    if source is None or source.get("builder") not in RESULTS_DATAFRAME_BUILDERS:
+        return None
+    if not os.path.isfile(source["hdf5_path"]):
+        return None
+
+    # Imported here, functions_hdf5 depends on this module
+    from modules.functions.functions_hdf5 import pooled_hdf5_file
+
+    builder = RESULTS_DATAFRAME_BUILDERS[source["builder"]]
+    with pooled_hdf5_file(source["hdf5_path"], "r") as hdf5_file:
+        dataset_group = hdf5_file.get(source["dataset"])
+        if dataset_group is None:
+            return None
+        return builder(dataset_group, **source["kwargs"])
+
+
+def get_results_dataframe(token):
+    """
+    Return a copy of the results dataframe of a token, from memory, from the spill folder, or rebuilt from its dataset.
+
+    @param token: str token generated by put_results_dataframe
+    @return: DataFrame, None if the token is unknown and cannot be rebuilt
+    """
+    if token is None:
+        return None
+    with _results_store_lock:
+        df = _results_store.get(token)
+        if df is not None:
+            _results_store.move_to_end(token)
+            # Callbacks may modify the dataframe they receive, the stored one is left untouched
+            return df.copy()
+
+        spill_path = _results_store_spill_path(token)
+        if spill_path is not None and os.path.isfile(spill_path):
+            df = pd.read_feather(spill_path)
+            df = df.set_index(df.columns[0])
+            if df.index.name == "index":
+                df.index.name = None
+            os.remove(spill_path)
+            _results_store_insert(token, df)
+            return df.copy()
+
+    # Evicted without spill or created by another worker, the dataset is read again outside the store lock
+    df = rebuild_results_dataframe(token)
+    if df is None:
+        return None
+    with _results_store_lock:
+        _results_store_insert(token, df)
+    return df.copy()
+
+
+def get_results_heatmap_grid(token):
+    """
+    Return the heatmap grid of a stored results dataframe, built once per token.
+
+    @param token: str token generated by put_results_dataframe
+    @return: dict generated by make_heatmap_grid, None if the token is unknown or has been dropped
+    """
+    grid = _results_grid_cache.get(token)
+    if grid is not None:
+        return grid
+
+    df = get_results_dataframe(token)
+    if df is None:
+        return None
+    grid = make_heatmap_grid(df)
+    with _results_store_lock:
+        if token in _results_store:
+            _results_grid_cache[token] = grid
+    return grid
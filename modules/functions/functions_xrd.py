@@ -3,61 +3,147 @@ Functions used in XRD interactive plot using Dash.
 Internal use for Institut Néel and within the MaMMoS project, to export and read big datasets produced at Institut Néel.
 """
 
+import contextlib
+import hashlib
+import io
+import os
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import wait, FIRST_COMPLETED
 from itertools import cycle
 
 import plotly.express as px
 from fabio import dtrekimage
 import pyFAI
+from pyFAI import units as pyfai_units
+from pyFAI.engines.CSR_engine import CsrIntegrator1d
+from scipy import sparse
 from scipy.signal import find_peaks
 
-from ..build.lib.hdf5_compilers.hdf5compile_base import rename_group
+from ..hdf5_compilers.hdf5compile_base import rename_group
+from ..functions.functions_axes import *
 from ..functions.functions_shared import *
 from ..functions.functions_hdf5 import *
 
 
-def xrd_conditions(hdf5_path, *args, **kwargs):
-    if hdf5_path is None:
-        return False
-    if not h5py.is_hdf5(hdf5_path):
-        return False
-    with h5py.File(hdf5_path, "r") as hdf5_file:
-        dataset_list = []
-        dataset_list = dataset_list + get_hdf5_datasets(hdf5_file, dataset_type="xrd")
-        dataset_list = dataset_list + get_hdf5_datasets(hdf5_file, dataset_type="xrd_wafer")
-        dataset_list = dataset_list + get_hdf5_datasets(hdf5_file, dataset_type="xrd_furnace")
-        if len(dataset_list) == 0:
-            return False
-    return True
+# Integration methods offered for the reintegration, "persisted_csr" and "batched_csr" use the sparse engines of
+# XRD_ENGINE_CACHE_FOLDER, the others are pyFAI methods that rebuild their engine in every session
+XRD_PYFAI_METHODS = {
+    "persisted_csr": None,
+    "batched_csr": None,
+    "no_csr_cython": "no_csr_cython",
+    "bbox_csr_cython": ("bbox", "csr", "cython"),
+    "bbox_lut_cython": ("bbox", "lut", "cython"),
+    "no_histogram_cython": ("no", "histogram", "cython"),
+}
+XRD_PYFAI_METHOD = "persisted_csr"
 
-def xrd_q_tth(q_list, energy):
-    constant = 1.2363 # hc/e in keV.nm
-    wavelength = constant / energy # in nm
-    to_theta = lambda q: np.arcsin(q * wavelength / (4 * np.pi))  # in rad
-    to_degree = lambda t: t * 180 / np.pi
+# Method integrating stacks of frames with a single sparse-dense product, see xrd_integrate_stack
+XRD_BATCHED_METHOD = "batched_csr"
 
-    tth_list = [
-        2 * to_degree(to_theta(q)) for q in q_list
-    ]
+# Number of frames integrated together by the batched method, each frame takes 8 bytes per pixel
+XRD_BATCH_FRAMES = 4
+
+# Number of pixels copied at a time when frames are transposed into a block, keeps the copy in cache
+XRD_BATCH_PIXEL_STEP = 16384
+
+# Sparse integration engines, one file per (geometry, image shape, number of points, unit), reused across sessions
+XRD_ENGINE_CACHE_FOLDER = os.path.join("calibrations", "pyfai_engines")
+
+# Number of engines kept in memory, each holds about two arrays of the detector size
+XRD_ENGINE_MEMORY_ENTRIES = 4
+
+_xrd_engine_memory = OrderedDict()
+_xrd_engine_memory_lock = threading.Lock()
+
+# Number of processes used to reintegrate the XRD images, every core if None
+XRD_REINTEGRATION_WORKERS = None
+
+# Number of images read ahead for each worker, bounds the memory used by images waiting to be integrated
+XRD_REINTEGRATION_READ_AHEAD = 4
+
+# Number of integrated patterns written each time the library is opened during a reintegration
+XRD_REINTEGRATION_WRITE_BATCH = 16
+
+# Progress of the running reintegrations, one JSON file per dataset so that every server process can read it
+XRD_REINTEGRATION_PROGRESS_FOLDER = os.path.join(tempfile.gettempdir(), "dahu_xrd_reintegration")
+
+# Azimuthal integrator of a reintegration worker process, loaded once from the PONI file, and its engine folder
+_xrd_worker_integrator = {}
+
+# Number of processes formatting and writing the exported files, every core if None
+XRD_EXPORT_WORKERS = None
+
+# Number format of the exported .xy files
+XRD_EXPORT_FORMAT = "%.10g"
+
+# Archive formats of the bulk export, with their file extension
+XRD_EXPORT_ARCHIVES = {"zip": ".zip", "tar": ".tar"}
+
+# Deflate level of the zip archives, the detector images barely compress and higher levels mostly cost time
+XRD_EXPORT_ZIP_LEVEL = 1
+
+# Table of the exported files, used by write_xrd_results_to_hdf5 to find the position of each refinement
+XRD_EXPORT_MANIFEST = "manifest.csv"
+
+# Measurement subgroup of the per position reductions of the detector frame, written by the compilers
+XRD_FRAME_REDUCTIONS_GROUP = "frame_reductions"
 
-    return tth_list
+# Percentiles of the detector frame recorded with the reductions
+XRD_FRAME_PERCENTILES = (50, 99, 99.9)
 
-def xrd_tth_q(tth_list, energy):
-    constant = 1.2363  # hc/e in keV.nm
-    wavelength = constant / energy  # in nm
-    to_rad = lambda t: t * np.pi / 180
-    to_q = lambda t: (4*np.pi)/wavelength * np.sin(t/2)
+# Integer frames get their percentiles from a histogram of this many bins above their minimum, larger values share
+# the last bin and np.percentile is only used when a percentile falls in it
+XRD_PERCENTILE_HISTOGRAM_BINS = 1 << 16
 
-    q_list = [to_q(to_rad(tth)) for tth in tth_list]
+# Peak count of the analysis mode: peaks of the first XRD_PEAK_RANGE of the integrated pattern above this prominence
+XRD_PEAK_PROMINENCE = 3.5
+XRD_PEAK_RANGE = 0.9
 
-    return q_list
+XRD_FRAME_REDUCTIONS_UNITS = {
+    "counts": "counts",
+    "max": "counts",
+    "saturation_fraction": "arb",
+    **{f"p{percentile:g}": "counts" for percentile in XRD_FRAME_PERCENTILES},
+    "peaks": "arb",
+}
 
+# Dataset level table of every peak of the integrated patterns, found with the same settings as the peak count
+XRD_PEAK_TABLE_GROUP = "peak_table"
+
+XRD_PEAK_TABLE_UNITS = {
+    "q": "nm^-1",
+    "tth": "deg",
+    "height": "counts",
+    "prominence": "counts",
+    "fwhm_q": "nm^-1",
+    "fwhm_tth": "deg",
+}
+
+# Reductions of raw NeXus files, which are never written to, kept for the last files read
+XRD_NEXUS_REDUCTIONS_CACHE_FILES = 4
+
+_xrd_nexus_reductions_cache = OrderedDict()
+_xrd_nexus_reductions_cache_lock = threading.Lock()
+
+
+def xrd_conditions(hdf5_path, *args, **kwargs):
+    if hdf5_path is None:
+        return False
+    dataset_list = get_catalog_datasets(hdf5_path, dataset_type=["xrd", "xrd_wafer", "xrd_furnace"])
+    if len(dataset_list) == 0:
+        return False
+    return True
 
 def xrd_get_integrated_from_hdf5(xrd_group, target_x, target_y):
     position_group = get_target_position_group(xrd_group, target_x, target_y)
     measurement_group = position_group.get("measurement")
 
     integrated_group = measurement_group.get("integrated")
-    q_array = integrated_group["q"][()]
+    q_array = xrd_read_axis(integrated_group["q"], "q")
     intensity_array = integrated_group["intensity"][()]
     counts_array = integrated_group["counts"][()]
 
@@ -94,7 +180,8 @@ def xrd_get_results_from_hdf5(xrd_group, target_x, target_y):
     results_group = position_group.get("results")
     if results_group is None:
         raise KeyError("results group not found in file")
-    data_dict = hdf5_group_to_dict(results_group)
+    # Lazy view, callers only read a few results and it must be used while the file is open
+    data_dict = hdf5_group_to_view(results_group)
     return data_dict
 
 
@@ -104,69 +191,67 @@ def xrd_make_results_dataframe_from_hdf5(xrd_group):
     data_dict_list = []
 
     positions_group = get_positions_group(xrd_group)
-    for position, position_group in positions_group.items():
-        if position == "alignment_scans":
-            continue
-        instrument_group = position_group.get("instrument")
-        # Exclude spots outside the wafer
-        if (
-            np.abs(instrument_group["x_pos"][()])
-            + np.abs(instrument_group["y_pos"][()])
-            <= 60
-        ):
-
-            data_dict = {
-                "x_pos (mm)": instrument_group["x_pos"][()],
-                "y_pos (mm)": instrument_group["y_pos"][()],
-                "ignored": position_group.attrs["ignored"],
-            }
-
-            # Check in phases for refined lattice parameters and weight fraction
-            phases_group = position_group.get("results/phases")
-            if phases_group is not None:
-                for phase, phase_group in phases_group.items():
-                    for value, value_group in phase_group.items():
-                        if value in OPTIONS_LIST:
-                            dataset = str(value_group[()].decode())
-                            if "units" in value_group.attrs:
-                                units = value_group.attrs["units"]
-                            else:
-                                units = "arb"
-
-                            # Check if refined parameter is not UNDEF
-                            value_str = dataset.split("+")[0]
-                            if value_str == "UNDEF":
-                                dataset = np.nan
-                            elif value_str == "ERROR":
-                                dataset = np.nan
-                                print(
-                                    f"Warning : Error in refined lattice parameter in {xrd_group} for phase {phase}"
-                                )
-                            else:
-                                dataset = float(value_str)
-
-                            data_dict[f"[{phase}]_{value}_({units})"] = dataset
-
-            data_dict_list.append(data_dict)
-
-            # Check in R_coefficients for Rwp
-            phases_group = position_group.get("results/r_coefficients")
-            if phases_group is not None:
-                for value, r_group in phases_group.items():
-                    if value == "Rwp":
-                        rwp = float(str(r_group[()]).split("%")[0].replace("b'", ""))
-                        dataset = rwp
-                        if "units" in r_group.attrs:
-                            units = r_group.attrs["units"]
+    # Coordinates of the spots inside the wafer, read from the position table
+    coordinates_df = make_coordinates_dataframe(xrd_group)
+
+    for position, x_pos, y_pos, ignored in coordinates_df.itertuples(name=None):
+        position_group = positions_group[position]
+
+        data_dict = {
+            "x_pos (mm)": x_pos,
+            "y_pos (mm)": y_pos,
+            "ignored": ignored,
+        }
+
+        # Check in phases for refined lattice parameters and weight fraction
+        phases_group = position_group.get("results/phases")
+        if phases_group is not None:
+            for phase, phase_group in phases_group.items():
+                for value, value_group in phase_group.items():
+                    if value in OPTIONS_LIST:
+                        dataset = str(value_group[()].decode())
+                        if "units" in value_group.attrs:
+                            units = value_group.attrs["units"]
+                        else:
+                            units = "arb"
+
+                        # Check if refined parameter is not UNDEF
+                        value_str = dataset.split("+")[0]
+                        if value_str == "UNDEF":
+                            dataset = np.nan
+                        elif value_str == "ERROR":
+                            dataset = np.nan
+                            print(
+                                f"Warning : Error in refined lattice parameter in {xrd_group} for phase {phase}"
+                            )
                         else:
-                            units = "%"
-                        data_dict[f"{value}_({units})"] = dataset
+                            dataset = float(value_str)
+
+                        data_dict[f"[{phase}]_{value}_({units})"] = dataset
+
+        data_dict_list.append(data_dict)
+
+        # Check in R_coefficients for Rwp
+        phases_group = position_group.get("results/r_coefficients")
+        if phases_group is not None:
+            for value, r_group in phases_group.items():
+                if value == "Rwp":
+                    rwp = float(str(r_group[()]).split("%")[0].replace("b'", ""))
+                    dataset = rwp
+                    if "units" in r_group.attrs:
+                        units = r_group.attrs["units"]
+                    else:
+                        units = "%"
+                    data_dict[f"{value}_({units})"] = dataset
 
     result_dataframe = pd.DataFrame(data_dict_list)
 
     return result_dataframe
 
 
+register_results_builder("xrd_results", xrd_make_results_dataframe_from_hdf5)
+
+
 def xrd_plot_integrated_from_dataframe(fig, df, name):
     fig.update_xaxes(title_text="q (nm-1)")
     fig.update_yaxes(title_text="Counts")
@@ -268,6 +353,20 @@ def xrd_plot_esrfimage_from_array(array, z_min, z_max):
     return fig
 
 
+def xrd_format_xy(x_array, y_array, number_format=XRD_EXPORT_FORMAT):
+    """
+    Two column text of an integrated pattern, formatted in a single operation instead of line by line.
+
+    @param x_array: abscissa array
+    @param y_array: ordinate array
+    @param number_format: printf style format of each number
+    @return: str, one tab separated line per point
+    """
+    columns = np.column_stack([np.ravel(x_array), np.ravel(y_array)])
+    line_format = f"{number_format}\t{number_format}\n"
+    return (line_format * len(columns)) % tuple(columns.ravel().tolist())
+
+
 def xrd_export_sum_spectrum(positions_group, export_path):
     counts_array = None
     tth_array = None
@@ -283,28 +382,26 @@ def xrd_export_sum_spectrum(positions_group, export_path):
             counts_array = counts_array + position_group["measurement/integrated/counts"][()]
 
     with open(export_path/"sum.xy", "w") as export_file:
-        for x, y in zip(tth_array, counts_array):
-            export_file.write(f"{x}\t{y}\n")
+        export_file.write(xrd_format_xy(tth_array, counts_array))
 
     return True
 
 
 def export_xrd_position_to_files(position_group, export_path, save_metadata = False, save_image=False):
     index = position_group.attrs["index"]
-    group_name = position_group.name
 
     image_path = (export_path / index).with_suffix(".img")
     file_path = (export_path / index).with_suffix(".xy")
 
-    instrument_group = position_group.get("instrument")
-    metadata_dict = hdf5_group_to_dict(instrument_group)
-
-    image_array = position_group["measurement/2Dimage"][()]
-    # Creating a new image with fabio
-    image_file = dtrekimage.DtrekImage()
-    image_file.data = image_array
+    if save_metadata:
+        instrument_group = position_group.get("instrument")
+        # ESRF instrument groups hold large positioner dumps, they are only read if the metadata is exported
+        metadata_dict = hdf5_group_to_view(instrument_group, cache=False)
 
     if save_image:
+        # Creating a new image with fabio
+        image_file = dtrekimage.DtrekImage()
+        image_file.data = position_group["measurement/2Dimage"][()]
         image_file.save(image_path)
 
     integrated_group = position_group.get("measurement/integrated")
@@ -316,39 +413,601 @@ def export_xrd_position_to_files(position_group, export_path, save_metadata = Fa
             for key, metadata in metadata_dict.items():
                 pass
                 # export_file.write(f"#{key}: {metadata}\n")
-        for x, y in zip(tth_array, counts_array):
-            export_file.write(f"{x}\t{y}\n")
+        export_file.write(xrd_format_xy(tth_array, counts_array))
 
     return True
 
 
-def xrd_make_analysis_dataframe_from_hdf5(xrd_group):
-    data_dict_list = []
+def xrd_export_file_names(index):
+    """
+    Names of the files exported for a position, the same as export_xrd_position_to_files.
+
+    @param index: index attribute of the position group
+    @return: (pattern file name, image file name)
+    """
+    return Path(str(index)).with_suffix(".xy").name, Path(str(index)).with_suffix(".img").name
+
+
+def _xrd_export_worker(folder, index, tth_array, counts_array, image_array):
+    """Write the files of one position in folder, returns their names"""
+    xy_name, image_name = xrd_export_file_names(index)
+    with open(os.path.join(folder, xy_name), "w") as export_file:
+        export_file.write(xrd_format_xy(tth_array, counts_array))
+    if image_array is None:
+        return [xy_name]
+
+    image_file = dtrekimage.DtrekImage()
+    image_file.data = image_array
+    image_file.write(os.path.join(folder, image_name))
+    return [xy_name, image_name]
+
+
+def _xrd_archive_add_file(archive_file, file_path, name):
+    if isinstance(archive_file, zipfile.ZipFile):
+        archive_file.write(file_path, arcname=name)
+    else:
+        archive_file.add(file_path, arcname=name)
+
+
+def _xrd_archive_add_text(archive_file, text, name):
+    data = text.encode("utf-8")
+    if isinstance(archive_file, zipfile.ZipFile):
+        archive_file.writestr(name, data)
+    else:
+        tar_info = tarfile.TarInfo(name)
+        tar_info.size = len(data)
+        tar_info.mtime = time.time()
+        archive_file.addfile(tar_info, io.BytesIO(data))
+
+
+def xrd_export_dataset(
+    hdf5_path,
+    dataset_name,
+    export_path,
+    archive=None,
+    save_image=False,
+    workers=XRD_EXPORT_WORKERS,
+    read_ahead=XRD_REINTEGRATION_READ_AHEAD,
+    progress_callback=None,
+):
+    """
+    Export every position of an XRD dataset for refinement: one .xy pattern (2θ, counts) per position, optionally the
+    detector image, the sum of all patterns and a manifest. Text formatting and file writing run on a pool of
+    processes, this process reads the library, keeping at most read_ahead positions per worker in flight. With an
+    archive, the files are moved into a single zip or tar file as soon as they are written.
+
+    The manifest (XRD_EXPORT_MANIFEST) has one row per position: position group name, index, pattern file, image
+    file, x_pos (mm), y_pos (mm) and ignored.
+
+    @param hdf5_path: path of the library
+    @param dataset_name: name of the XRD dataset group
+    @param export_path: folder of the exported files, or path of the archive when archive is set
+    @param archive: None to write a folder, or a key of XRD_EXPORT_ARCHIVES
+    @param save_image: if True, also export the detector images in d*TREK format
+    @param workers: number of processes, every core if None, 1 to export in the current process
+    @param read_ahead: number of positions in flight per worker
+    @param progress_callback: called as progress_callback(done, total) after each position
+    @return: dictionary {"positions", "seconds", "path"}
+    """
+    if archive is not None and archive not in XRD_EXPORT_ARCHIVES:
+        raise KeyError(f"Unknown archive format {archive}, expected one of {list(XRD_EXPORT_ARCHIVES)}")
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    export_path = Path(export_path)
+    if archive is not None and export_path.suffix != XRD_EXPORT_ARCHIVES[archive]:
+        export_path = export_path.with_name(export_path.name + XRD_EXPORT_ARCHIVES[archive])
+
+    start = time.perf_counter()
+    done = 0
+    manifest_rows = []
+    tth_sum, counts_sum = None, None
+
+    with contextlib.ExitStack() as stack:
+        hdf5_file = stack.enter_context(pooled_hdf5_file(hdf5_path, "r"))
+        xrd_group = hdf5_file[dataset_name]
+        positions_group = get_positions_group(xrd_group)
+        position_list = [
+            position
+            for position, position_group in positions_group.items()
+            if position != "alignment_scans" and "measurement/integrated" in position_group
+        ]
+        # Positions without coordinates get NaN in the manifest
+        coordinates_df = make_coordinates_dataframe(xrd_group, wafer_only=False).reindex(position_list)
+        coordinates_dict = coordinates_df.to_dict("index")
+        total = len(position_list)
+        workers = max(1, min(workers, total))
+
+        # The processes are spawned, they get the arrays of each position as arguments and never open the library
+        if workers > 1:
+            executor = stack.enter_context(start_hdf5_process_pool(workers))
+
+        if archive is None:
+            os.makedirs(export_path, exist_ok=True)
+            folder = str(export_path)
+            archive_file = None
+        else:
+            os.makedirs(export_path.parent, exist_ok=True)
+            # Files are written next to the archive, then moved into it
+            folder = stack.enter_context(tempfile.TemporaryDirectory(dir=export_path.parent))
+            if archive == "zip":
+                archive_file = stack.enter_context(
+                    zipfile.ZipFile(
+                        export_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=XRD_EXPORT_ZIP_LEVEL
+                    )
+                )
+            else:
+                archive_file = stack.enter_context(tarfile.open(export_path, "w"))
+
+        def read_position(position):
+            nonlocal tth_sum, counts_sum
+            position_group = positions_group[position]
+            index = position_group.attrs.get("index", position)
+            integrated_group = position_group["measurement/integrated"]
+            tth_array = integrated_group["tth"][()]
+            counts_array = integrated_group["counts"][()]
+            image_array = None
+            if save_image and "measurement/2Dimage" in position_group:
+                image_array = position_group["measurement/2Dimage"][()]
+
+            if tth_sum is None:
+                tth_sum, counts_sum = tth_array, np.array(counts_array, dtype="float64")
+            else:
+                counts_sum += counts_array
+
+            xy_name, image_name = xrd_export_file_names(index)
+            manifest_rows.append(
+                {
+                    "position": position,
+                    "index": index,
+                    "file": xy_name,
+                    "image_file": image_name if image_array is not None else "",
+                    **coordinates_dict[position],
+                }
+            )
+            return folder, index, tth_array, counts_array, image_array
+
+        def position_exported(name_list):
+            nonlocal done
+            if archive_file is not None:
+                for name in name_list:
+                    file_path = os.path.join(folder, name)
+                    _xrd_archive_add_file(archive_file, file_path, name)
+                    os.remove(file_path)
+            done += 1
+            if progress_callback is not None:
+                progress_callback(done, total)
+
+        if workers == 1:
+            for position in position_list:
+                position_exported(_xrd_export_worker(*read_position(position)))
+        else:
+            position_iterator = iter(position_list)
+
+            def submit_next():
+                position = next(position_iterator, None)
+                if position is None:
+                    return None
+                return executor.submit(_xrd_export_worker, *read_position(position))
+
+            pending = set()
+            for _ in range(workers * max(int(read_ahead), 1)):
+                future = submit_next()
+                if future is None:
+                    break
+                pending.add(future)
+
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    position_exported(future.result())
+                    next_future = submit_next()
+                    if next_future is not None:
+                        pending.add(next_future)
+
+        text_dict = {XRD_EXPORT_MANIFEST: pd.DataFrame(manifest_rows).to_csv(index=False)}
+        if tth_sum is not None:
+            text_dict["sum.xy"] = xrd_format_xy(tth_sum, counts_sum)
+        for name, text in text_dict.items():
+            if archive_file is None:
+                with open(os.path.join(folder, name), "w") as export_file:
+                    export_file.write(text)
+            else:
+                _xrd_archive_add_text(archive_file, text, name)
+
+    seconds = time.perf_counter() - start
+    return {"positions": done, "seconds": seconds, "path": export_path}
+
+
+def xrd_read_export_manifest(folder_path):
+    """
+    Position group names of the exported patterns, from the first manifest found in a folder and its subfolders.
+
+    @param folder_path: folder of refinement results holding a copy of XRD_EXPORT_MANIFEST
+    @return: dict {pattern file stem: position group name}, None if there is no manifest
+    """
+    manifest_list = [path for path in safe_rglob(Path(folder_path)) if path.name == XRD_EXPORT_MANIFEST]
+    if not manifest_list:
+        return None
+    manifest_df = pd.read_csv(manifest_list[0], dtype=str)
+    return {Path(file).stem: position for file, position in zip(manifest_df["file"], manifest_df["position"])}
+
+
+def xrd_count_peaks(integrated):
+    """
+    Number of peaks of an integrated pattern, as shown by the analysis mode.
+
+    @param integrated: counts (or intensity) array of the pattern
+    @return: int
+    """
+    integrated = np.asarray(integrated)
+    peaks, _ = find_peaks(integrated[:int(XRD_PEAK_RANGE * len(integrated))], prominence=XRD_PEAK_PROMINENCE)
+    return len(peaks)
+
+
+def xrd_integer_percentiles(image, percentiles):
+    """
+    Percentiles of an integer frame from the histogram of its values, same result as np.percentile (linear
+    interpolation) without sorting the frame.
+
+    @param image: integer array
+    @param percentiles: sequence of percentiles between 0 and 100
+    @return: float array of the percentiles
+    """
+    values = np.ravel(image)
+    low, high = int(np.min(values)), int(np.max(values))
+    top = min(low + XRD_PERCENTILE_HISTOGRAM_BINS - 1, high)
+    offsets = np.subtract(np.minimum(values, top) if top < high else values, low, dtype=np.intp)
+    cumulative = np.cumsum(np.bincount(offsets))
+
+    # Linear interpolation between the order statistics around each percentile
+    positions = (values.size - 1) * np.asarray(percentiles, dtype="float64") / 100
+    floor = np.floor(positions)
+    ranks = np.concatenate([floor, np.minimum(floor + 1, values.size - 1)]).astype(np.int64)
+    bins = np.searchsorted(cumulative, ranks, side="right")
+    if top < high and np.any(bins == len(cumulative) - 1):
+        return np.percentile(values, percentiles)
+
+    lower, upper = np.split((bins + low).astype("float64"), 2)
+    return lower + (positions - floor) * (upper - lower)
+
+
+def xrd_reduce_frame(image, saturation=None):
+    """
+    Scalar reductions of a detector frame: total counts, maximum, fraction of saturated pixels and percentiles.
+
+    @param image: detector frame
+    @param saturation: pixel value flagging a saturated pixel, the largest value of the dtype for integer frames if None
+    @return: dictionary with the keys of XRD_FRAME_REDUCTIONS_UNITS but "peaks"
+    """
+    image = np.asarray(image)
+    if saturation is None and image.dtype.kind in "iu":
+        saturation = np.iinfo(image.dtype).max
+
+    reductions_dict = {
+        "counts": np.sum(image),
+        "max": np.max(image),
+        "saturation_fraction": np.nan if saturation is None else np.count_nonzero(image >= saturation) / image.size,
+    }
+    if image.dtype.kind in "iu":
+        percentile_values = xrd_integer_percentiles(image, XRD_FRAME_PERCENTILES)
+    else:
+        percentile_values = np.percentile(image, XRD_FRAME_PERCENTILES)
+    for percentile, value in zip(XRD_FRAME_PERCENTILES, percentile_values):
+        reductions_dict[f"p{percentile:g}"] = value
+
+    return reductions_dict
+
+
+def xrd_write_frame_reductions(measurement_group, reductions_dict):
+    """
+    Write the reductions of a position as scalar datasets of the XRD_FRAME_REDUCTIONS_GROUP subgroup.
+
+    @param measurement_group: measurement group of the position
+    @param reductions_dict: dictionary from xrd_reduce_frame, with the "peaks" key
+    @return: None
+    """
+    if XRD_FRAME_REDUCTIONS_GROUP in measurement_group:
+        del measurement_group[XRD_FRAME_REDUCTIONS_GROUP]
+    reductions_group = measurement_group.create_group(XRD_FRAME_REDUCTIONS_GROUP)
+    for key, value in reductions_dict.items():
+        reductions_group[key] = value
+        reductions_group[key].attrs["units"] = XRD_FRAME_REDUCTIONS_UNITS[key]
+
+
+def xrd_read_frame_reductions(measurement_group):
+    """
+    Reductions recorded for a position.
+
+    @param measurement_group: measurement group of the position
+    @return: dictionary {reduction: value}, None if the position has none
+    """
+    reductions_group = measurement_group.get(XRD_FRAME_REDUCTIONS_GROUP)
+    if reductions_group is None:
+        return None
+    value_dict = {key: node[()] for key, node in reductions_group.items()}
+    # Same order as computed by xrd_reduce_position, HDF5 lists the datasets alphabetically
+    key_list = [key for key in XRD_FRAME_REDUCTIONS_UNITS if key in value_dict]
+    key_list += [key for key in value_dict if key not in XRD_FRAME_REDUCTIONS_UNITS]
+    return {key: value_dict[key] for key in key_list}
+
+
+def xrd_reduce_position(position_group, image=None):
+    """
+    Reductions of a position, from its detector frame and its integrated counts.
+
+    @param position_group: position group holding measurement/2Dimage and measurement/integrated/counts
+    @param image: detector frame when already read, read from the position if None
+    @return: dictionary with the keys of XRD_FRAME_REDUCTIONS_UNITS
+    """
+    measurement_group = position_group["measurement"]
+    if image is None:
+        image = measurement_group["2Dimage"][()]
+    reductions_dict = xrd_reduce_frame(image)
+    reductions_dict["peaks"] = xrd_count_peaks(measurement_group["integrated/counts"][()])
+    return reductions_dict
+
+
+def xrd_write_dataset_reductions(xrd_group):
+    """
+    Record the reductions of every position of a dataset that has a frame and an integrated pattern but no complete
+    reductions yet. Each frame is read once, positions with reductions are left untouched.
+
+    @param xrd_group: XRD dataset group, open for writing
+    @return: number of positions whose reductions were written
+    """
     positions_group = get_positions_group(xrd_group)
+    written = 0
+    for position, position_group in positions_group.items():
+        measurement_group = position_group.get("measurement")
+        if measurement_group is None or "2Dimage" not in measurement_group:
+            continue
+        if "integrated/counts" not in measurement_group:
+            continue
+        reductions_dict = xrd_read_frame_reductions(measurement_group)
+        if reductions_dict is not None and all(key in reductions_dict for key in XRD_FRAME_REDUCTIONS_UNITS):
+            continue
+        xrd_write_frame_reductions(measurement_group, xrd_reduce_position(position_group))
+        written += 1
+
+    return written
+
+
+def xrd_update_peak_reduction(position_group):
+    """
+    Refresh the peak count of a position after its pattern was integrated again. The frame is never read, positions
+    without reductions get them from xrd_write_dataset_reductions.
+
+    @param position_group: position group
+    @return: None
+    """
+    measurement_group = position_group["measurement"]
+    reductions_dict = xrd_read_frame_reductions(measurement_group)
+    if reductions_dict is None:
+        return
+    reductions_dict["peaks"] = xrd_count_peaks(measurement_group["integrated/counts"][()])
+    xrd_write_frame_reductions(measurement_group, reductions_dict)
+
+
+def xrd_find_pattern_peaks(counts, q_array, tth_array):
+    """
+    Peaks of an integrated pattern, the same ones as counted by xrd_count_peaks, with their height, prominence and full
+    width at half prominence. Widths are interpolated on both axes, so they do not depend on the sampling of the pattern.
+
+    @param counts: counts array of the pattern
+    @param q_array: q values of the pattern in nm^-1
+    @param tth_array: 2θ values of the pattern in deg
+    @return: dictionary of arrays with the keys of XRD_PEAK_TABLE_UNITS
+    """
+    counts = np.asarray(counts, dtype="float64")
+    peaks, properties = find_peaks(
+        counts[:int(XRD_PEAK_RANGE * len(counts))], prominence=XRD_PEAK_PROMINENCE, width=0, rel_height=0.5
+    )
+
+    sample_array = np.arange(len(counts))
+    edges = np.concatenate([properties["left_ips"], properties["right_ips"]])
+    q_edges = np.interp(edges, sample_array, q_array)
+    tth_edges = np.interp(edges, sample_array, tth_array)
+    n_peaks = len(peaks)
+
+    peaks_dict = {
+        "q": np.asarray(q_array, dtype="float64")[peaks],
+        "tth": np.asarray(tth_array, dtype="float64")[peaks],
+        "height": counts[peaks],
+        "prominence": properties["prominences"],
+        "fwhm_q": q_edges[n_peaks:] - q_edges[:n_peaks],
+        "fwhm_tth": tth_edges[n_peaks:] - tth_edges[:n_peaks],
+    }
+    return peaks_dict
+
+
+def xrd_detect_dataset_peaks(xrd_group):
+    """
+    Peak table of an XRD dataset: every peak of every integrated pattern, one row per peak. Each pattern is read once
+    and its peaks are appended to contiguous columns, alignment scans and positions without pattern are left out.
+
+    @param xrd_group: XRD dataset group
+    @return: dictionary of columns {"position", "index", "n_positions", and the keys of XRD_PEAK_TABLE_UNITS}
+    """
+    positions_group = get_positions_group(xrd_group)
+    position_list, index_list, row_counts = [], [], []
+    column_lists = {key: [] for key in XRD_PEAK_TABLE_UNITS}
+
     for position, position_group in positions_group.items():
         if position == "alignment_scans":
             continue
-        instrument_group = position_group.get("instrument")
-        measurement_group = position_group.get("measurement")
+        integrated_group = position_group.get("measurement/integrated")
+        if integrated_group is None or "counts" not in integrated_group or "tth" not in integrated_group:
+            continue
+
+        peaks_dict = xrd_find_pattern_peaks(
+            integrated_group["counts"][()],
+            xrd_read_axis(integrated_group["q"], "q"),
+            xrd_read_axis(integrated_group["tth"], "tth"),
+        )
+        position_list.append(position)
+        index_list.append(str(position_group.attrs.get("index", "")))
+        row_counts.append(len(peaks_dict["q"]))
+        for key, column_list in column_lists.items():
+            column_list.append(peaks_dict[key])
+
+    peak_table = {
+        "position": np.repeat(np.asarray(position_list, dtype=object), row_counts),
+        "index": np.repeat(np.asarray(index_list, dtype=object), row_counts),
+        "n_positions": len(position_list),
+    }
+    for key, column_list in column_lists.items():
+        peak_table[key] = np.concatenate(column_list) if column_list else np.empty(0)
+
+    return peak_table
+
 
-        counts = np.sum(measurement_group["2Dimage"][()])
-        integrated = measurement_group["integrated/counts"][()]
-        peaks, _ = find_peaks(integrated[:int(0.9*len(integrated))], prominence=3.5)
+def xrd_write_peak_table(xrd_group, peak_table=None):
+    """
+    Persist the peak table of a dataset as contiguous columns in its XRD_PEAK_TABLE_GROUP subgroup.
+
+    @param xrd_group: XRD dataset group
+    @param peak_table: dict generated by xrd_detect_dataset_peaks, detected from the file if None
+    @return: number of peaks in the table
+    """
+    if peak_table is None:
+        peak_table = xrd_detect_dataset_peaks(xrd_group)
+
+    if XRD_PEAK_TABLE_GROUP in xrd_group:
+        del xrd_group[XRD_PEAK_TABLE_GROUP]
+
+    table_group = xrd_group.create_group(XRD_PEAK_TABLE_GROUP)
+    table_group.attrs["HT_class"] = "HTpeaks"
+    table_group.attrs["n_positions"] = peak_table["n_positions"]
+    table_group.attrs["prominence"] = XRD_PEAK_PROMINENCE
+    table_group.attrs["range"] = XRD_PEAK_RANGE
+
+    table_group.create_dataset("position", data=peak_table["position"], dtype=h5py.string_dtype())
+    table_group.create_dataset("index", data=peak_table["index"], dtype=h5py.string_dtype())
+    for key, unit in XRD_PEAK_TABLE_UNITS.items():
+        node = table_group.create_dataset(key, data=peak_table[key], dtype="float")
+        node.attrs["units"] = unit
+
+    return len(peak_table["q"])
+
+
+def xrd_read_peak_table(xrd_group):
+    """
+    Read the peak table persisted in an XRD dataset group.
+
+    @param xrd_group: XRD dataset group
+    @return: DataFrame with one row per peak and the columns "position", "index" and the keys of XRD_PEAK_TABLE_UNITS,
+    None if there is no table or if it was found with other settings
+    """
+    table_group = xrd_group.get(XRD_PEAK_TABLE_GROUP)
+    if table_group is None:
+        return None
+    if table_group.attrs.get("prominence") != XRD_PEAK_PROMINENCE or table_group.attrs.get("range") != XRD_PEAK_RANGE:
+        return None
+    if any(column not in table_group for column in ["position", "index", *XRD_PEAK_TABLE_UNITS]):
+        return None
+
+    peak_df = pd.DataFrame(
+        {
+            "position": table_group["position"].asstr()[()],
+            "index": table_group["index"].asstr()[()],
+            **{key: table_group[key][()] for key in XRD_PEAK_TABLE_UNITS},
+        }
+    )
+    return peak_df
+
+
+def xrd_get_peak_table(xrd_group):
+    """
+    Return the peak table persisted in a dataset, never detected on read. Datasets without an up to date table get an
+    empty one until it is built by xrd_build_peak_table or update_xrd_hdf5.
+
+    @param xrd_group: XRD dataset group
+    @return: DataFrame as returned by xrd_read_peak_table, without rows if the dataset has no up to date table
+    """
+    peak_df = xrd_read_peak_table(xrd_group)
+    if peak_df is None:
+        peak_df = pd.DataFrame({column: [] for column in ["position", "index", *XRD_PEAK_TABLE_UNITS]})
+    return peak_df
+
+
+def xrd_build_peak_table(hdf5_path, dataset_name):
+    """
+    Detect the peaks of every integrated pattern of a dataset and store them as its peak table.
+
+    @param hdf5_path: path of the library
+    @param dataset_name: name of the XRD dataset group
+    @return: dictionary {"positions", "peaks", "seconds"}
+    """
+    start = time.perf_counter()
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
+        xrd_group = hdf5_file[dataset_name]
+        peak_table = xrd_detect_dataset_peaks(xrd_group)
+        n_peaks = xrd_write_peak_table(xrd_group, peak_table)
+        hdf5_file.flush()
+
+    return {"positions": peak_table["n_positions"], "peaks": n_peaks, "seconds": time.perf_counter() - start}
+
+
+def xrd_make_peak_columns(peak_df, position_list, q_min=None, q_max=None):
+    """
+    Strongest peak of every position within a q window, as heatmap columns.
+
+    @param peak_df: peak table from xrd_get_peak_table
+    @param position_list: names of the positions, in the order of the rows of the result
+    @param q_min: lower bound of the window in nm^-1, no bound if None
+    @param q_max: upper bound of the window in nm^-1, no bound if None
+    @return: DataFrame indexed like position_list, NaN for positions without peak in the window
+    """
+    window_df = peak_df
+    if q_min is not None:
+        window_df = window_df[window_df["q"] >= q_min]
+    if q_max is not None:
+        window_df = window_df[window_df["q"] <= q_max]
+
+    strongest_df = window_df.loc[window_df.groupby("position")["height"].idxmax()].set_index("position")
+    columns_df = pd.DataFrame(
+        {
+            f"peak_{key} ({unit})": strongest_df[key]
+            for key, unit in XRD_PEAK_TABLE_UNITS.items()
+        }
+    )
+    columns_df["peaks_in_window"] = window_df.groupby("position").size()
+    columns_df = columns_df.reindex(position_list)
+    columns_df["peaks_in_window"] = columns_df["peaks_in_window"].fillna(0)
+
+    return columns_df.reset_index(drop=True)
+
+
+def xrd_make_analysis_dataframe_from_hdf5(xrd_group, q_min=None, q_max=None):
+    data_dict_list = []
+    positions_group = get_positions_group(xrd_group)
+    coordinates_df = make_coordinates_dataframe(xrd_group, wafer_only=False)
+
+    for position, x_pos, y_pos, ignored in coordinates_df.itertuples(name=None):
+        # Only the recorded reductions are read, positions without them (libraries not updated yet) have empty columns
+        reductions_dict = xrd_read_frame_reductions(positions_group[position]["measurement"]) or {}
 
         data_dict = {
-            "x_pos (mm)": instrument_group["x_pos"][()],
-            "y_pos (mm)": instrument_group["y_pos"][()],
-            "ignored": position_group.attrs["ignored"],
-            "counts": counts,
-            "peaks": len(peaks),
+            "x_pos (mm)": x_pos,
+            "y_pos (mm)": y_pos,
+            "ignored": ignored,
+            **reductions_dict,
         }
 
         data_dict_list.append(data_dict)
     results_df = pd.DataFrame(data_dict_list)
 
+    # Peak maps come from the persisted peak table, the patterns are never read here
+    peak_columns_df = xrd_make_peak_columns(xrd_get_peak_table(xrd_group), coordinates_df.index, q_min, q_max)
+    results_df = pd.concat([results_df, peak_columns_df], axis=1)
+
     return results_df
 
 
+register_results_builder("xrd_analysis", xrd_make_analysis_dataframe_from_hdf5)
+
+
 def esrf_check_if_alignment(hdf5_group):
     """
     Check if a given group is an alignment scan or not
@@ -393,7 +1052,7 @@ def xrd_get_integrated_from_nexus(xrd_group, target_x, target_y):
     position_group = xrd_get_position_group_from_nexus(xrd_group, target_x, target_y)
     integrated_group = position_group.get("CdTe_integrate/integrated")
 
-    q_array = integrated_group["q"][()]
+    q_array = xrd_read_axis(integrated_group["q"], "q")
     intensity_array = integrated_group["intensity"][()]
 
     measurement_dataframe = pd.DataFrame(
@@ -405,26 +1064,53 @@ def xrd_get_integrated_from_nexus(xrd_group, target_x, target_y):
 
     return measurement_dataframe
 
-def xrd_make_analysis_dataframe_from_nexus(xrd_group):
-    data_dict_list = []
+def xrd_get_nexus_reductions(xrd_group):
+    """
+    Reductions of every position of a raw NeXus file, computed on the first call for a given version of the file.
+
+    @param xrd_group: root group of the NeXus file
+    @return: dict {position: dictionary with the keys of XRD_FRAME_REDUCTIONS_UNITS}
+    """
+    file_path = os.path.abspath(xrd_group.file.filename)
+    file_stat = os.stat(file_path)
+    key = (file_path, file_stat.st_mtime_ns, file_stat.st_size)
+    with _xrd_nexus_reductions_cache_lock:
+        reductions = _xrd_nexus_reductions_cache.get(key)
+        if reductions is not None:
+            _xrd_nexus_reductions_cache.move_to_end(key)
+            return reductions
+
+    reductions = {}
     for position, position_group in xrd_group.items():
         test, _ = esrf_check_if_alignment(position_group)
         if test:
             continue
-        positioners_group = position_group.get("instrument/positioners")
-        measurement_group = position_group.get("measurement")
-        integrated_group = position_group.get("CdTe_integrate/integrated")
+        reductions_dict = xrd_reduce_frame(position_group["measurement/CdTe"][0])
+        reductions_dict["peaks"] = xrd_count_peaks(position_group["CdTe_integrate/integrated/intensity"][()])
+        reductions[position] = reductions_dict
 
-        counts = np.sum(measurement_group["CdTe"][0])
-        integrated = integrated_group["intensity"][()]
-        peaks, _ = find_peaks(integrated[:int(0.9*len(integrated))], prominence=3.5)
+    with _xrd_nexus_reductions_cache_lock:
+        for cached_key in [cached_key for cached_key in _xrd_nexus_reductions_cache if cached_key[0] == file_path]:
+            del _xrd_nexus_reductions_cache[cached_key]
+        _xrd_nexus_reductions_cache[key] = reductions
+        while len(_xrd_nexus_reductions_cache) > XRD_NEXUS_REDUCTIONS_CACHE_FILES:
+            _xrd_nexus_reductions_cache.popitem(last=False)
+
+    return reductions
+
+
+def xrd_make_analysis_dataframe_from_nexus(xrd_group):
+    data_dict_list = []
+    reductions = xrd_get_nexus_reductions(xrd_group)
+    for position, reductions_dict in reductions.items():
+        position_group = xrd_group[position]
+        positioners_group = position_group.get("instrument/positioners")
 
         data_dict = {
             "x_pos (mm)": positioners_group["xsamp"][()],
             "y_pos (mm)": positioners_group["ysamp"][()],
             "ignored": position_group.attrs["ignored"],
-            "counts": counts,
-            "peaks": len(peaks),
+            **reductions_dict,
         }
 
         data_dict_list.append(data_dict)
@@ -433,22 +1119,341 @@ def xrd_make_analysis_dataframe_from_nexus(xrd_group):
     return results_df
 
 
-def xrd_pyfai_integrate1d(poni, image, points):
+register_results_builder("xrd_nexus_analysis", xrd_make_analysis_dataframe_from_nexus)
+
+
+def xrd_engine_key(poni, shape, points, unit="q_nm^-1"):
+    """
+    Fingerprint of a sparse integration engine: geometry and detector of the PONI, detector mask, image shape,
+    number of points, unit and pyFAI version.
+
+    @param poni: pyFAI AzimuthalIntegrator
+    @param shape: shape of the detector images
+    @param points: number of points of the integrated pattern
+    @param unit: radial unit
+    @return: str hexadecimal digest
+    """
+    key_dict = {
+        "geometry": poni.get_config(),
+        "shape": list(shape),
+        "points": int(points),
+        "unit": str(unit),
+        "pyfai": pyFAI.version,
+    }
+    key_hash = hashlib.sha1(json.dumps(key_dict, sort_keys=True, default=str).encode("utf-8"))
+    mask = poni.detector.mask
+    if mask is not None:
+        key_hash.update(np.ascontiguousarray(mask).tobytes())
+    return key_hash.hexdigest()
+
+
+def xrd_load_engine_arrays(poni, shape, points, unit="q_nm^-1", cache_folder=XRD_ENGINE_CACHE_FOLDER):
+    """
+    Sparse matrix of a geometry, without pixel splitting, read from the cache folder or built by pyFAI when missing.
+
+    @param poni: pyFAI AzimuthalIntegrator
+    @param shape: shape of the detector images
+    @param points: number of points of the integrated pattern
+    @param unit: radial unit
+    @param cache_folder: folder of the persisted engines, nothing is written if None
+    @return: ((data, indices, indptr) CSR arrays, bin centers array)
+    """
+    key = xrd_engine_key(poni, shape, points, unit)
+    file_path = None if cache_folder is None else os.path.join(cache_folder, f"{key}.npz")
+
+    if file_path is not None and os.path.isfile(file_path):
+        with np.load(file_path, allow_pickle=False) as engine_file:
+            lut = (engine_file["data"], engine_file["indices"], engine_file["indptr"])
+            bin_centers = engine_file["bin_centers"]
+        return lut, bin_centers
+
+    pyfai_engine = poni.setup_sparse_integrator(
+        tuple(shape),
+        int(points),
+        mask=poni.detector.mask,
+        unit=pyfai_units.to_unit(unit),
+        split="no",
+        algo="CSR",
+        empty=poni.empty,
+    )
+    lut = tuple(np.ascontiguousarray(array) for array in pyfai_engine.lut)
+    bin_centers = np.asarray(pyfai_engine.bin_centers)
+    if file_path is not None:
+        # Written to a temporary file first, other processes never see a partial engine
+        os.makedirs(cache_folder, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(suffix=".npz", dir=cache_folder)
+        with os.fdopen(file_descriptor, "wb") as temp_file:
+            np.savez(temp_file, data=lut[0], indices=lut[1], indptr=lut[2], bin_centers=bin_centers)
+        os.replace(temp_path, file_path)
+
+    return lut, bin_centers
+
+
+def _xrd_engine_memory_get(key):
+    with _xrd_engine_memory_lock:
+        engine = _xrd_engine_memory.get(key)
+        if engine is not None:
+            _xrd_engine_memory.move_to_end(key)
+        return engine
+
+
+def _xrd_engine_memory_put(key, engine):
+    with _xrd_engine_memory_lock:
+        _xrd_engine_memory[key] = engine
+        while len(_xrd_engine_memory) > XRD_ENGINE_MEMORY_ENTRIES:
+            _xrd_engine_memory.popitem(last=False)
+
+
+def xrd_clear_engine_memory():
+    """
+    Drop the engines kept in memory, the next integrations load them from the cache folder or build them again.
+
+    @return: None
+    """
+    with _xrd_engine_memory_lock:
+        _xrd_engine_memory.clear()
+
+
+def xrd_get_persisted_engine(poni, shape, points, unit="q_nm^-1", cache_folder=XRD_ENGINE_CACHE_FOLDER):
+    """
+    Sparse (CSR) integration engine of a geometry, without pixel splitting like the "no_csr_cython" method, built on
+    the public pyFAI CsrIntegrator1d. Engines are looked up in memory, then in the cache folder, and are only built by
+    pyFAI when missing.
+
+    @param poni: pyFAI AzimuthalIntegrator
+    @param shape: shape of the detector images
+    @param points: number of points of the integrated pattern
+    @param unit: radial unit
+    @param cache_folder: folder of the persisted engines, nothing is written if None
+    @return: pyFAI CsrIntegrator1d
+    """
+    key = xrd_engine_key(poni, shape, points, unit)
+    engine = _xrd_engine_memory_get(key)
+    if engine is not None:
+        return engine
+
+    lut, bin_centers = xrd_load_engine_arrays(poni, shape, points, unit, cache_folder)
+    engine = CsrIntegrator1d(
+        image_size=int(np.prod(shape)),
+        lut=lut,
+        empty=poni.empty,
+        unit=pyfai_units.to_unit(unit),
+        bin_centers=bin_centers,
+    )
+    _xrd_engine_memory_put(key, engine)
+
+    return engine
+
+
+def xrd_get_batched_engine(poni, shape, points, unit="q_nm^-1", cache_folder=XRD_ENGINE_CACHE_FOLDER):
+    """
+    Persisted sparse matrix of a geometry prepared for xrd_integrate_stack, with the solid angle normalization of every
+    bin, the same for all frames, computed once. Only the public outputs of pyFAI are used (the CSR arrays and bin
+    centers of setup_sparse_integrator, solidAngleArray, empty and the detector dummy), the products are done by scipy.
+
+    @param poni: pyFAI AzimuthalIntegrator
+    @param shape: shape of the detector images
+    @param points: number of points of the integrated pattern
+    @param unit: radial unit
+    @param cache_folder: folder of the persisted engines, nothing is written if None
+    @return: dictionary {"matrix", "normalization", "solid_angle", "radial", "empty", "dummy", "delta_dummy"}
+    """
+    key = (xrd_engine_key(poni, shape, points, unit), XRD_BATCHED_METHOD)
+    engine = _xrd_engine_memory_get(key)
+    if engine is not None:
+        return engine
+
+    lut, bin_centers = xrd_load_engine_arrays(poni, shape, points, unit, cache_folder)
+    image_size = int(np.prod(shape))
+    bin_matrix = sparse.csr_matrix((lut[0].astype("float64"), lut[1], lut[2]), shape=(len(lut[2]) - 1, image_size))
+    solid_angle = poni.solidAngleArray(tuple(shape)).ravel().astype("float64")
+
+    engine = {
+        "matrix": bin_matrix,
+        "normalization": bin_matrix @ solid_angle,
+        "solid_angle": solid_angle,
+        "radial": np.asarray(bin_centers) * pyfai_units.to_unit(unit).scale,
+        "empty": poni.empty,
+        "dummy": poni.detector.dummy,
+        "delta_dummy": poni.detector.delta_dummy,
+    }
+    _xrd_engine_memory_put(key, engine)
+
+    return engine
+
+
+def xrd_fill_frame_block(frames, frame_block, pixel_step=XRD_BATCH_PIXEL_STEP):
+    """
+    Copy a stack of frames into the columns of a (pixels, frames) block, the layout the sparse product reads without
+    making a copy. The transposition goes through pixel_step pixels at a time to stay in cache.
+
+    @param frames: array (frames, pixels) or (frames, rows, columns)
+    @param frame_block: float64 array (pixels, at least frames), filled in place
+    @param pixel_step: number of pixels copied at a time
+    @return: view of the filled columns of frame_block
+    """
+    frames = np.asarray(frames)
+    frames = frames.reshape(len(frames), -1)
+    frame_number, image_size = frames.shape
+    if frame_block.shape[0] != image_size or frame_block.shape[1] < frame_number:
+        raise ValueError(f"Block of shape {frame_block.shape} cannot hold {frame_number} frames of {image_size} pixels")
+
+    for start in range(0, image_size, pixel_step):
+        frame_block[start:start + pixel_step, :frame_number] = frames[:, start:start + pixel_step].T
+    return frame_block[:, :frame_number]
+
+
+def xrd_find_left_out_pixels(engine, frames):
+    """
+    Pixels that pyFAI leaves out of the integration of their frame: NaN pixels and pixels at the dummy value of the
+    detector. The minimum and maximum of each frame are checked first, most frames skip the pixel by pixel test.
+
+    @param engine: dictionary from xrd_get_batched_engine
+    @param frames: array (frames, pixels) or (frames, rows, columns)
+    @return: (pixel index array, frame index array)
+    """
+    dummy, delta_dummy = engine["dummy"], engine["delta_dummy"] or 0
+    pixel_index_list, frame_index_list = [], []
+    for frame_index, frame in enumerate(frames):
+        frame = np.ravel(frame)
+        low, high = np.min(frame), np.max(frame)
+        has_nan = frame.dtype.kind == "f" and np.isnan(low)
+        has_dummy = dummy is not None and low <= dummy + delta_dummy and high >= dummy - delta_dummy
+        if not has_nan and not has_dummy:
+            continue
+
+        left_out = np.zeros(frame.shape, dtype=bool)
+        if has_nan:
+            left_out |= np.isnan(frame)
+        if dummy is not None:
+            left_out |= np.abs(frame - float(dummy)) <= delta_dummy if delta_dummy else frame == dummy
+        pixel_index = np.flatnonzero(left_out)
+        pixel_index_list.append(pixel_index)
+        frame_index_list.append(np.full(len(pixel_index), frame_index))
+
+    if not pixel_index_list:
+        return np.empty(0, dtype=int), np.empty(0, dtype=int)
+    return np.concatenate(pixel_index_list), np.concatenate(frame_index_list)
+
+
+def xrd_integrate_frame_block(engine, frame_block, left_out=None):
+    """
+    Integrate the frames held in the columns of a block with one sparse-dense product, the total counts coming from
+    the same block. Left out pixels are set to zero in the block and their solid angle is removed from the
+    normalization of their frame only, total counts keep every pixel like np.sum(image).
+
+    @param engine: dictionary from xrd_get_batched_engine
+    @param frame_block: float64 array (pixels, frames), C contiguous, overwritten at the left out pixels
+    @param left_out: (pixel index array, frame index array) from xrd_find_left_out_pixels, None if there are none
+    @return: (intensity array (frames, points), total counts array (frames,))
+    """
+    frame_number = frame_block.shape[1]
+    left_out_sum = np.zeros(frame_number)
+    normalization = np.broadcast_to(engine["normalization"], (frame_number, len(engine["normalization"])))
+
+    if left_out is not None and len(left_out[0]):
+        pixel_index, frame_index = left_out
+        left_out_sum = np.bincount(frame_index, weights=frame_block[pixel_index, frame_index], minlength=frame_number)
+        frame_block[pixel_index, frame_index] = 0
+        left_out_solid_angle = sparse.csr_matrix(
+            (engine["solid_angle"][pixel_index], (pixel_index, frame_index)), shape=frame_block.shape
+        )
+        normalization = normalization - (engine["matrix"] @ left_out_solid_angle).T.toarray()
+
+    signal = (engine["matrix"] @ frame_block).T
+    totals = np.ones(frame_block.shape[0]) @ frame_block + left_out_sum
+
+    intensity = np.full(signal.shape, engine["empty"], dtype="float64")
+    filled = normalization > 0
+    intensity[filled] = signal[filled] / normalization[filled]
+
+    return intensity, totals
+
+
+def xrd_integrate_stack(
+    poni,
+    frames,
+    points,
+    unit="q_nm^-1",
+    cache_folder=XRD_ENGINE_CACHE_FOLDER,
+    batch_size=XRD_BATCH_FRAMES,
+):
+    """
+    Azimuthal integration of a stack of frames, same result as poni.integrate1d(method="no_csr_cython") on each frame.
+    Frames go through the sparse matrix batch_size at a time, bounding the memory to batch_size float64 frames.
+    Pixels of the detector mask are left out of every frame, NaN and dummy pixels out of their own frame.
+
+    @param poni: pyFAI AzimuthalIntegrator
+    @param frames: array (frames, rows, columns)
+    @param points: number of points of the integrated patterns
+    @param unit: radial unit
+    @param cache_folder: folder of the persisted engines
+    @param batch_size: number of frames per product
+    @return: (radial array, intensity array (frames, points), total counts array (frames,))
+    """
+    frames = np.asarray(frames)
+    engine = xrd_get_batched_engine(poni, frames.shape[1:], points, unit, cache_folder)
+
+    batch_size = max(1, min(int(batch_size), len(frames)))
+    frame_block = np.empty((int(np.prod(frames.shape[1:])), batch_size))
+    intensity_list, total_list = [], []
+    for start in range(0, len(frames), batch_size):
+        batch = frames[start:start + batch_size]
+        left_out = xrd_find_left_out_pixels(engine, batch)
+        filled_block = xrd_fill_frame_block(batch, frame_block)
+        intensity, totals = xrd_integrate_frame_block(engine, np.ascontiguousarray(filled_block), left_out)
+        intensity_list.append(intensity)
+        total_list.append(totals)
+
+    return engine["radial"], np.concatenate(intensity_list), np.concatenate(total_list)
+
+
+def xrd_integrate_with_persisted_engine(poni, image, points, unit="q_nm^-1", cache_folder=XRD_ENGINE_CACHE_FOLDER):
+    """
+    Azimuthal integration with a persisted engine, same result as poni.integrate1d(method="no_csr_cython").
+
+    @param poni: pyFAI AzimuthalIntegrator
+    @param image: 2D detector image
+    @param points: number of points of the integrated pattern
+    @param unit: radial unit
+    @param cache_folder: folder of the persisted engines
+    @return: (radial array, intensity array)
+    """
+    engine = xrd_get_persisted_engine(poni, image.shape, points, unit, cache_folder)
+    unit = pyfai_units.to_unit(unit)
+    integrated = engine.integrate_ng(
+        image,
+        dummy=poni.detector.dummy,
+        delta_dummy=poni.detector.delta_dummy,
+        solidangle=poni.solidAngleArray(image.shape),
+    )
+    return integrated.position * unit.scale, integrated.intensity
+
+
+def xrd_make_integrated_dict(poni, q, I, total, points, method):
+    """
+    Integrated pattern of one frame as written by xrd_write_integrated_to_hdf5, the intensity is normalized to 1 and
+    the counts to the total of the frame.
+
+    @param poni: pyFAI AzimuthalIntegrator
+    @param q: q array
+    @param I: intensity array
+    @param total: total counts of the frame
+    @param points: number of points of the integrated pattern
+    @param method: key of XRD_PYFAI_METHODS
+    @return: dictionary {"q", "tth", "I", "counts", "config", "version"}
+    """
     integrated_dict = {}
 
-    reintegrated = poni.integrate1d(image, points, method="no_csr_cython", unit='q_nm^-1')
-    q = reintegrated[0]
     tth = xrd_q_tth(q, energy=25)
 
-    I = reintegrated[1]
-
     I = I/np.sum(I)
-    counts = I * np.sum(image)
+    counts = I * total
 
     config = {
             "function": "integrate1d",
             "npt": str(points),
-            "method": "no_csr_cython",
+            "method": method,
             "detector": str(poni.detector.__class__.__name__),
             "distance": str(poni.dist),
             "wavelength": str(poni.wavelength),
@@ -469,10 +1474,33 @@ def xrd_pyfai_integrate1d(poni, image, points):
     return integrated_dict
 
 
-def xrd_pyfai_medfilt1d(poni, image, points, percentile=(0, 99.9)):
+def xrd_pyfai_integrate1d(poni, image, points, method=XRD_PYFAI_METHOD, cache_folder=XRD_ENGINE_CACHE_FOLDER):
+    if method not in XRD_PYFAI_METHODS:
+        raise KeyError(f"Unknown integration method {method}, expected one of {list(XRD_PYFAI_METHODS)}")
+
+    if method == XRD_BATCHED_METHOD:
+        q, I, totals = xrd_integrate_stack(poni, image[np.newaxis], points, unit="q_nm^-1", cache_folder=cache_folder)
+        return xrd_make_integrated_dict(poni, q, I[0], totals[0], points, method)
+
+    if XRD_PYFAI_METHODS[method] is None:
+        q, I = xrd_integrate_with_persisted_engine(poni, image, points, unit="q_nm^-1", cache_folder=cache_folder)
+    else:
+        reintegrated = poni.integrate1d(image, points, method=XRD_PYFAI_METHODS[method], unit='q_nm^-1')
+        q = reintegrated[0]
+        I = reintegrated[1]
+
+    return xrd_make_integrated_dict(poni, q, I, np.sum(image), points, method)
+
+
+def xrd_pyfai_medfilt1d(poni, image, points, percentile=(0, 99.9), method=XRD_PYFAI_METHOD):
     integrated_dict = {}
 
-    reintegrated = poni.medfilt1d_ng(image, points, method="no_csr_cython", percentile=percentile, unit='q_nm^-1')
+    if method not in XRD_PYFAI_METHODS:
+        raise KeyError(f"Unknown integration method {method}, expected one of {list(XRD_PYFAI_METHODS)}")
+    # The median filter runs inside pyFAI, persisted engines fall back to its own CSR engine
+    pyfai_method = XRD_PYFAI_METHODS[method] or "no_csr_cython"
+
+    reintegrated = poni.medfilt1d_ng(image, points, method=pyfai_method, percentile=percentile, unit='q_nm^-1')
     q = reintegrated[0]
     tth = xrd_q_tth(q, energy=25)
 
@@ -484,7 +1512,7 @@ def xrd_pyfai_medfilt1d(poni, image, points, percentile=(0, 99.9)):
     config = {
         "function": "medfilt1d_ng",
         "npt": str(points),
-        "method": "no_csr_cython",
+        "method": pyfai_method if isinstance(pyfai_method, str) else "_".join(pyfai_method),
         "percentile": str(percentile),
         "detector": str(poni.detector.__class__.__name__),
         "distance": str(poni.dist),
@@ -533,3 +1561,338 @@ def xrd_write_integrated_to_hdf5(position_group, reintegrated_dict, overwrite=Tr
 
     instrument_group.create_dataset("program", data="pyFAI")
     instrument_group.create_dataset("version", data=reintegrated_dict["version"])
+
+    xrd_update_peak_reduction(position_group)
+
+
+def xrd_pyfai_integrate_image(
+    poni, image, function_select, points, method=XRD_PYFAI_METHOD, cache_folder=XRD_ENGINE_CACHE_FOLDER
+):
+    """
+    Integrate one detector image with the selected pyFAI function.
+
+    @param poni: pyFAI AzimuthalIntegrator
+    @param image: 2D detector image
+    @param function_select: "integrate1d" or "medfilt1d"
+    @param points: number of points of the integrated pattern
+    @param method: key of XRD_PYFAI_METHODS
+    @param cache_folder: folder of the persisted engines
+    @return: dictionary from xrd_pyfai_integrate1d or xrd_pyfai_medfilt1d
+    """
+    if function_select == "integrate1d":
+        return xrd_pyfai_integrate1d(poni, image, points, method=method, cache_folder=cache_folder)
+    if function_select == "medfilt1d":
+        return xrd_pyfai_medfilt1d(poni, image, points, method=method)
+    raise ValueError(f"Unknown integration function {function_select}, expected integrate1d or medfilt1d")
+
+
+def _xrd_reintegration_worker_init(poni_path, cache_folder):
+    """Load the integrator once per worker process, the engine folder comes from the parent process"""
+    _xrd_worker_integrator["poni"] = pyFAI.load(str(poni_path))
+    _xrd_worker_integrator["cache_folder"] = cache_folder
+
+
+def _xrd_reintegration_worker(position, image, function_select, points, method):
+    """Integrate one image in a worker process"""
+    return position, xrd_pyfai_integrate_image(
+        _xrd_worker_integrator["poni"],
+        image,
+        function_select,
+        points,
+        method,
+        cache_folder=_xrd_worker_integrator["cache_folder"],
+    )
+
+
+def xrd_list_images_to_integrate(xrd_group):
+    """
+    Names of the positions of an XRD dataset holding a detector image, alignment scans excluded.
+
+    @param xrd_group: XRD dataset group
+    @return: list of position names
+    """
+    positions_group = get_positions_group(xrd_group)
+    return [
+        position
+        for position, position_group in positions_group.items()
+        if position != "alignment_scans" and "measurement/2Dimage" in position_group
+    ]
+
+
+def _xrd_read_images(hdf5_path, dataset_name, position_list, image_stack=None):
+    """
+    Read the detector images of some positions, the library is only open for the read.
+
+    @param hdf5_path: path of the library
+    @param dataset_name: name of the XRD dataset group
+    @param position_list: names of the positions
+    @param image_stack: array of shape (>= len(position_list),) + image shape filled in place, None to get a list
+    @return: image_stack, or list of 2D images
+    """
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        positions_group = get_positions_group(hdf5_file[dataset_name])
+        if image_stack is None:
+            return [positions_group[position]["measurement/2Dimage"][()] for position in position_list]
+
+        for index, position in enumerate(position_list):
+            image_dataset = positions_group[position]["measurement/2Dimage"]
+            if image_dataset.shape != image_stack.shape[1:]:
+                raise ValueError(
+                    f"Image of {position} has shape {image_dataset.shape}, expected {image_stack.shape[1:]}"
+                )
+            image_dataset.read_direct(image_stack, dest_sel=np.s_[index])
+    return image_stack
+
+
+def _xrd_write_integrated_batch(hdf5_path, dataset_name, reintegrated_list):
+    """
+    Write a batch of integrated patterns, the library is only open for the write.
+
+    @param hdf5_path: path of the library
+    @param dataset_name: name of the XRD dataset group
+    @param reintegrated_list: list of (position, dictionary from xrd_pyfai_integrate_image)
+    @return: None
+    """
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
+        positions_group = get_positions_group(hdf5_file[dataset_name])
+        for position, reintegrated_dict in reintegrated_list:
+            xrd_write_integrated_to_hdf5(positions_group[position], reintegrated_dict, overwrite=True)
+
+
+def _xrd_finish_reintegration(hdf5_path, dataset_name):
+    """Record the missing reductions and refresh the peak table once every pattern of the dataset is written"""
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
+        xrd_write_dataset_reductions(hdf5_file[dataset_name])
+        xrd_write_peak_table(hdf5_file[dataset_name])
+
+
+def xrd_reintegrate_dataset_batched(
+    hdf5_path,
+    dataset_name,
+    poni_path,
+    points,
+    batch_size=XRD_BATCH_FRAMES,
+    progress_callback=None,
+):
+    """
+    Reintegrate every image of an XRD dataset with the batched method, streaming batch_size images at a time through
+    the sparse matrix of the geometry: the memory used does not depend on the size of the dataset.
+    The library is opened for each batch, to read its images and then to write its patterns, never for the whole run.
+
+    @param hdf5_path: path of the library
+    @param dataset_name: name of the XRD dataset group
+    @param poni_path: path of the PONI file
+    @param points: number of points of the integrated patterns
+    @param batch_size: number of images per sparse-dense product
+    @param progress_callback: called as progress_callback(done, total, frames_per_second) after each batch
+    @return: dictionary {"frames", "seconds", "frames_per_second"}
+    """
+    start = time.perf_counter()
+    done = 0
+
+    def report():
+        if progress_callback is not None:
+            elapsed = time.perf_counter() - start
+            progress_callback(done, total, done / elapsed if elapsed > 0 else 0.0)
+
+    poni = pyFAI.load(str(poni_path))
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        xrd_group = hdf5_file[dataset_name]
+        position_list = xrd_list_images_to_integrate(xrd_group)
+        if position_list:
+            first_image = get_positions_group(xrd_group)[position_list[0]]["measurement/2Dimage"]
+            image_shape, image_dtype = first_image.shape, first_image.dtype
+    total = len(position_list)
+    report()
+
+    if total > 0:
+        engine = xrd_get_batched_engine(poni, image_shape, points, cache_folder=XRD_ENGINE_CACHE_FOLDER)
+
+        batch_size = max(1, min(int(batch_size), total))
+        # Images are read in their stored dtype, then transposed into the float64 block of the product
+        image_stack = np.empty((batch_size,) + tuple(image_shape), dtype=image_dtype)
+        frame_block = np.empty((int(np.prod(image_shape)), batch_size))
+
+        for batch_start in range(0, total, batch_size):
+            batch_positions = position_list[batch_start:batch_start + batch_size]
+            _xrd_read_images(hdf5_path, dataset_name, batch_positions, image_stack)
+
+            batch = image_stack[:len(batch_positions)]
+            left_out = xrd_find_left_out_pixels(engine, batch)
+            filled_block = xrd_fill_frame_block(batch, frame_block)
+            intensity, totals = xrd_integrate_frame_block(engine, np.ascontiguousarray(filled_block), left_out)
+
+            reintegrated_list = [
+                (
+                    position,
+                    xrd_make_integrated_dict(
+                        poni, engine["radial"], intensity[index], totals[index], points, XRD_BATCHED_METHOD
+                    ),
+                )
+                for index, position in enumerate(batch_positions)
+            ]
+            _xrd_write_integrated_batch(hdf5_path, dataset_name, reintegrated_list)
+            done += len(batch_positions)
+            report()
+
+        _xrd_finish_reintegration(hdf5_path, dataset_name)
+
+    seconds = time.perf_counter() - start
+    return {"frames": done, "seconds": seconds, "frames_per_second": done / seconds if seconds > 0 else 0.0}
+
+
+def xrd_reintegrate_dataset_parallel(
+    hdf5_path,
+    dataset_name,
+    poni_path,
+    function_select,
+    points,
+    method=XRD_PYFAI_METHOD,
+    workers=XRD_REINTEGRATION_WORKERS,
+    read_ahead=XRD_REINTEGRATION_READ_AHEAD,
+    write_batch=XRD_REINTEGRATION_WRITE_BATCH,
+    progress_callback=None,
+):
+    """
+    Reintegrate every image of an XRD dataset on a pool of processes, each with its own integrator loaded from
+    the PONI file. This process is the only one opening the library: it reads the images, keeping at most
+    read_ahead images per worker in flight, and writes the patterns with xrd_write_integrated_to_hdf5 by batches of
+    write_batch as they come back. The library is opened for each read and each write batch, so other readers are
+    only held back while a batch is written. The workers are spawned: they get the PONI path and the absolute path
+    of the engine folder through initargs and the images as arguments, progress is only recorded by this process.
+    The batched method goes to xrd_reintegrate_dataset_batched instead.
+
+    @param hdf5_path: path of the library
+    @param dataset_name: name of the XRD dataset group
+    @param poni_path: path of the PONI file
+    @param function_select: "integrate1d" or "medfilt1d"
+    @param points: number of points of the integrated patterns
+    @param method: key of XRD_PYFAI_METHODS
+    @param workers: number of processes, every core if None, 1 to integrate in the current process
+    @param read_ahead: number of images in flight per worker
+    @param write_batch: number of patterns written each time the library is opened
+    @param progress_callback: called as progress_callback(done, total, frames_per_second) after each write batch
+    @return: dictionary {"frames", "seconds", "frames_per_second"}
+    """
+    if function_select not in ["integrate1d", "medfilt1d"]:
+        raise ValueError(f"Unknown integration function {function_select}, expected integrate1d or medfilt1d")
+    # A batch already integrates several frames per product, it streams in this process without workers
+    if function_select == "integrate1d" and method == XRD_BATCHED_METHOD:
+        return xrd_reintegrate_dataset_batched(
+            hdf5_path, dataset_name, poni_path, points, progress_callback=progress_callback
+        )
+    if workers is None:
+        workers = os.cpu_count() or 1
+    write_batch = max(int(write_batch), 1)
+
+    start = time.perf_counter()
+    done = 0
+
+    def report():
+        if progress_callback is not None:
+            elapsed = time.perf_counter() - start
+            progress_callback(done, total, done / elapsed if elapsed > 0 else 0.0)
+
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        xrd_group = hdf5_file[dataset_name]
+        position_list = xrd_list_images_to_integrate(xrd_group)
+        if position_list:
+            image_shape = get_positions_group(xrd_group)[position_list[0]]["measurement/2Dimage"].shape
+    total = len(position_list)
+    workers = max(1, min(workers, total))
+    cache_folder = os.path.abspath(XRD_ENGINE_CACHE_FOLDER)
+    report()
+
+    if workers == 1:
+        poni = pyFAI.load(str(poni_path))
+        for batch_start in range(0, total, write_batch):
+            batch_positions = position_list[batch_start:batch_start + write_batch]
+            image_list = _xrd_read_images(hdf5_path, dataset_name, batch_positions)
+            reintegrated_list = [
+                (position, xrd_pyfai_integrate_image(poni, image, function_select, points, method, cache_folder))
+                for position, image in zip(batch_positions, image_list)
+            ]
+            _xrd_write_integrated_batch(hdf5_path, dataset_name, reintegrated_list)
+            done += len(batch_positions)
+            report()
+    else:
+        # The persisted engine is built here once, the workers load it from the cache folder
+        if function_select == "integrate1d" and XRD_PYFAI_METHODS.get(method, "") is None:
+            xrd_get_persisted_engine(pyFAI.load(str(poni_path)), image_shape, points, cache_folder=cache_folder)
+
+        position_iterator = iter(position_list)
+        with start_hdf5_process_pool(
+            workers, initializer=_xrd_reintegration_worker_init, initargs=(str(poni_path), cache_folder)
+        ) as executor:
+
+            def submit_next():
+                position = next(position_iterator, None)
+                if position is None:
+                    return None
+                image = _xrd_read_images(hdf5_path, dataset_name, [position])[0]
+                return executor.submit(
+                    _xrd_reintegration_worker, position, image, function_select, points, method
+                )
+
+            pending = set()
+            for _ in range(workers * max(int(read_ahead), 1)):
+                future = submit_next()
+                if future is None:
+                    break
+                pending.add(future)
+
+            reintegrated_list = []
+            while pending:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    reintegrated_list.append(future.result())
+                    next_future = submit_next()
+                    if next_future is not None:
+                        pending.add(next_future)
+
+                if len(reintegrated_list) >= write_batch or not pending:
+                    _xrd_write_integrated_batch(hdf5_path, dataset_name, reintegrated_list)
+                    done += len(reintegrated_list)
+                    reintegrated_list = []
+                    report()
+
+    if total > 0:
+        _xrd_finish_reintegration(hdf5_path, dataset_name)
+
+    seconds = time.perf_counter() - start
+    return {"frames": done, "seconds": seconds, "frames_per_second": done / seconds if seconds > 0 else 0.0}
+
+
+def _xrd_reintegration_progress_path(hdf5_path, dataset_name):
+    """Progress file of a dataset, the same in every process"""
+    key = json.dumps([str(Path(hdf5_path).resolve()), dataset_name])
+    return os.path.join(XRD_REINTEGRATION_PROGRESS_FOLDER, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+
+def xrd_set_reintegration_progress(hdf5_path, dataset_name, done, total, frames_per_second):
+    """
+    Record the progress of a reintegration, read by the progress bar of the XRD tab. The progress is written to a
+    file so that the server process polling it does not have to be the one running the reintegration.
+
+    @return: None
+    """
+    progress_path = _xrd_reintegration_progress_path(hdf5_path, dataset_name)
+    os.makedirs(XRD_REINTEGRATION_PROGRESS_FOLDER, exist_ok=True)
+    # Written next to the progress file then renamed, readers never see a partial file
+    temp_path = f"{progress_path}.{os.getpid()}.{threading.get_ident()}"
+    with open(temp_path, "w") as file:
+        json.dump({"done": done, "total": total, "frames_per_second": frames_per_second}, file)
+    os.replace(temp_path, progress_path)
+
+
+def xrd_get_reintegration_progress(hdf5_path, dataset_name):
+    """
+    Progress of the last reintegration of a dataset.
+
+    @return: dictionary {"done", "total", "frames_per_second"}, None if the dataset was never reintegrated
+    """
+    try:
+        with open(_xrd_reintegration_progress_path(hdf5_path, dataset_name)) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
@@ -51,7 +51,7 @@ def write_annealing_to_hdf5(hdf5_path, source_path, anneal_dict, dataset_name):
     if dataset_name is None:
         dataset_name = source_path.stem
     
-    with h5py.File(hdf5_path, "a") as hdf5_file:
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
         annealing_group = hdf5_file.create_group(f"sample/{dataset_name}")
         annealing_group.attrs["HT_type"] = "annealing"
         annealing_group.attrs["instrument"] = "JetFirst RTA"
@@ -74,7 +74,7 @@ def write_annealing_to_hdf5(hdf5_path, source_path, anneal_dict, dataset_name):
         
         
 def manual_annealing_to_hdf5(hdf5_path, anneal_dict, dataset_name):
-    with h5py.File(hdf5_path, "a") as hdf5_file:
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
         annealing_group = hdf5_file.create_group(f"sample/{dataset_name}")
         annealing_group.attrs["HT_type"] = "annealing"
         annealing_group.attrs["instrument"] = anneal_dict["instrument"]
@@ -4,6 +4,7 @@ import h5py
 from PIL import Image
 
 from ..functions.functions_hdf5 import *
+from ..hdf5_compilers.hdf5compile_policy import *
 
 LIBRARY_WRITER_VERSION = 0.1
 DATASET_WRITER_VERSION = 0.1
@@ -163,7 +164,7 @@ def write_image_to_hdf5(hdf5_path, source_path, comment, dataset_name):
 
     img = np.array(Image.open(source_path))
 
-    with h5py.File(hdf5_path, "a") as hdf5_file:
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
         if "pictures" not in hdf5_file.keys():
             pictures_group = hdf5_file.create_group("pictures")
             pictures_group.attrs["HT_type"] = "picture"
@@ -172,7 +173,7 @@ def write_image_to_hdf5(hdf5_path, source_path, comment, dataset_name):
             pictures_group = hdf5_file.get("pictures")
 
         picture_group = pictures_group.create_group(dataset_name, pictures_group)
-        picture_group.create_dataset("picture", data=img, compression="gzip")
+        create_policy_dataset(picture_group, "picture", img, "picture")
         picture_group.create_dataset("comment", data=str(comment))
 
     return None
@@ -187,7 +188,7 @@ def copy_datasets_to_hdf5(hdf5_path, source_path, dataset_list, copy_type):
         raise ValueError("Copy type must be either 'soft copy' or 'hard copy'.")
 
     with h5py.File(source_path, "r") as source_file:
-        with h5py.File(hdf5_path, "r+") as hdf5_file:
+        with pooled_hdf5_file(hdf5_path, "r+") as hdf5_file:
             for dataset in dataset_list:
                 if copy_type == "hard copy":
                     source_file.copy(dataset, hdf5_file, expand_soft=True)
@@ -2,12 +2,13 @@ from collections import defaultdict
 
 import h5py
 
+from modules.functions.functions_hdf5 import pooled_hdf5_file
 from modules.hdf5_compilers.hdf5compile_base import create_incremental_group, safe_create_new_subgroup
 
 
 def write_library_to_dataset_hdf5(library_path, dataset_path, copy_type="soft"):
     with h5py.File(library_path, "r") as library_file:
-        with h5py.File(dataset_path, "r+") as dataset_file:
+        with pooled_hdf5_file(dataset_path, "r+") as dataset_file:
             # Check provided filetypes
             if library_file.attrs["HT_type"] != "library":
                 raise TypeError("Provided Library file is not of type 'library')")
@@ -291,7 +291,7 @@ def write_edx_to_hdf5(hdf5_path, source_path, dataset_name=None):
     if dataset_name is None:
         dataset_name = source_path.stem
 
-    with h5py.File(hdf5_path, "a") as hdf5_file:
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
         edx_group = hdf5_file.create_group(f"{dataset_name}")
         edx_group.attrs["HT_type"] = "edx"
         edx_group.attrs["instrument"] = "Bruker Quantax Xflash-7"
@@ -334,13 +334,16 @@ def write_edx_to_hdf5(hdf5_path, source_path, dataset_name=None):
             data = position_group.create_group("measurement")
             data.attrs["NX_class"] = "HTdata"
 
-            counts = data.create_dataset(
-                "counts", (len(channels),), data=channels, dtype="int"
+            counts = create_policy_dataset(
+                data, "counts", channels, "spectrum", instrument="edx", dtype="int"
             )
-            energy = data.create_dataset(
-                "energy", (len(energy),), data=energy, dtype="float"
+            energy = create_policy_dataset(
+                data, "energy", energy, "axis", instrument="edx", dtype="float"
             )
             counts.attrs["units"] = "cps"
             energy.attrs["units"] = "keV"
 
+        # Columnar table of the positions, used for fast coordinate lookups
+        write_position_table(edx_group)
+
         return None
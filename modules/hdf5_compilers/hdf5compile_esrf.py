@@ -3,10 +3,13 @@ Functions for XRD parsing (Rigaku SmartLab and ESRF NeXuS)
 """
 
 from ..functions.functions_shared import *
-from ..functions.functions_xrd import xrd_q_tth
+from ..functions.functions_axes import xrd_q_tth, xrd_read_axis
+from ..functions.functions_xrd import (
+    xrd_count_peaks, xrd_read_export_manifest, xrd_reduce_frame, xrd_write_frame_reductions, xrd_write_peak_table
+)
 from ..hdf5_compilers.hdf5compile_base import *
 
-ESRF_WRITER_VERSION = "0.4"
+ESRF_WRITER_VERSION = "0.6"
 
 
 def return_cdte_source_path(dataset_group):
@@ -179,7 +182,7 @@ def write_esrf_to_hdf5(hdf5_path, source_path, dataset_name):
     if raw_h5_path is None:
         raise NameError("Couldn't locate RAW_DATA H5 file")
 
-    with h5py.File(hdf5_path, "a") as hdf5_file:
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
         with h5py.File(raw_h5_path, "a") as raw_source:
             if "nanodacse_loop" in raw_source["1.1/instrument"].keys():
                 mode = "furnace"
@@ -328,38 +331,48 @@ def write_esrf_to_hdf5(hdf5_path, source_path, dataset_name):
                 measurement_group = position_group.get("measurement")
                 integrated_group = measurement_group.get("integrated")
 
-                # Squeeze datasets that have weird shapes
-                hdf5_squeeze_dataset(hdf5_file, measurement_group["2Dimage"])
-                hdf5_squeeze_dataset(hdf5_file, measurement_group["falconx/falconx_det0"])
+                # Squeeze datasets that have weird shapes, copies keep the storage of the source files
+                # so they are written again following the dataset policy
+                rewrite_policy_dataset(measurement_group["2Dimage"], "detector_image", instrument="esrf", squeeze=True)
+                rewrite_policy_dataset(
+                    measurement_group["falconx/falconx_det0"], "spectrum", instrument="esrf", squeeze=True
+                )
 
                 # Sometimes unit is A^-1, sometimes it's nm^-1, who even knows anymore
                 if integrated_group is None:
                     continue
 
                 q_group = integrated_group["q"]
-                q_data = q_group[()]
-                if q_group.attrs["units"] == "A^-1":
-                    q_data = q_data * 10
+                q_data = xrd_read_axis(q_group, "q", "nm^-1")
+                if q_group.attrs.get("units") != "nm^-1":
                     q_group[()] = q_data
                     q_group.attrs["units"] = "nm^-1"
 
                 energy = float(position_group["instrument/energy/data"][()])
                 tth_data = xrd_q_tth(q_data, energy)
-                tth_group = integrated_group.create_dataset(
-                    "tth", (len(tth_data),), data=tth_data, dtype="float"
+                tth_group = create_policy_dataset(
+                    integrated_group, "tth", tth_data, "axis", instrument="esrf", dtype="float"
                 )
                 tth_group.attrs["units"] = "deg"
 
-                hdf5_squeeze_dataset(hdf5_file, integrated_group["intensity"])
+                rewrite_policy_dataset(integrated_group["intensity"], "spectrum", instrument="esrf", squeeze=True)
 
-                total_counts = np.sum(measurement_group["2Dimage"][()])
-                counts_data = integrated_group["intensity"][()] * total_counts
-                counts_group = integrated_group.create_dataset(
-                    "counts", data=counts_data, dtype="float"
+                # The frame is read once for the total counts and the other reductions
+                reductions_dict = xrd_reduce_frame(measurement_group["2Dimage"][()])
+                counts_data = integrated_group["intensity"][()] * reductions_dict["counts"]
+                counts_group = create_policy_dataset(
+                    integrated_group, "counts", counts_data, "spectrum", instrument="esrf", dtype="float"
                 )
+                reductions_dict["peaks"] = xrd_count_peaks(counts_data)
+                xrd_write_frame_reductions(measurement_group, reductions_dict)
             except KeyError as e:
                 raise KeyError(f"Position {position} encountered error {e}")
 
+        # Columnar table of the positions, used for fast coordinate lookups
+        write_position_table(esrf_group)
+        # Peaks of every integrated pattern, mapped by the XRD tab without reading the patterns
+        xrd_write_peak_table(esrf_group)
+
     return None
 
 
@@ -369,22 +382,29 @@ def write_xrd_results_to_hdf5(hdf5_path, results_folderpath, target_dataset):
     if isinstance(results_folderpath, str):
         results_folderpath = Path(results_folderpath)
 
-    with h5py.File(hdf5_path, "r+") as target:
+    with pooled_hdf5_file(hdf5_path, "r+") as target:
 
         if target_dataset not in target:
             raise NameError("Couldn't locate target dataset")
 
         target_group = target.get(target_dataset)
+        # Exports made with xrd_export_dataset name the position of every pattern file
+        manifest_dict = xrd_read_export_manifest(results_folderpath) or {}
 
         for lst_filepath in safe_rglob(results_folderpath, pattern="*.lst"):
             dia_filepath = lst_filepath.with_suffix(".dia")
             file_index = str(lst_filepath.stem).split("_")[-1]
             positions_group = get_positions_group(target_group)
+            manifest_position = manifest_dict.get(lst_filepath.stem, manifest_dict.get(file_index))
             for name, group in positions_group.items():
                 if name == "alignment_scans":
                     continue
                 else:
-                    if group.attrs["index"].split(".")[0] == file_index:
+                    if manifest_position is not None:
+                        position_match = name == manifest_position
+                    else:
+                        position_match = group.attrs["index"].split(".")[0] == file_index
+                    if position_match:
                         r_coeffs, global_params, phases = get_results_from_refinement(
                             lst_filepath
                         )
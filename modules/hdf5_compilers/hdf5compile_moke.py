@@ -2,19 +2,43 @@
 Functions for MOKE parsing
 """
 
+import math
+import os
+import uuid
+import warnings
+from contextlib import nullcontext
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
 import stringcase
 
 from ..functions.functions_moke import *
 from ..hdf5_compilers.hdf5compile_base import *
 
-MOKE_WRITER_VERSION = '0.4'
+MOKE_WRITER_VERSION = '0.6'
 
 POSITION_DECIMAL_ROUND_NUMBER = 3
 
+# Number of processes used to build the MOKE database, every core if None
+MOKE_FIT_WORKERS = None
+
+# Number of processes used to parse the MOKE text files, every core if None
+MOKE_PARSE_WORKERS = None
+
+# Below this number of positions the text files are parsed in the main process
+MOKE_PARSE_PARALLEL_MIN_POSITIONS = 16
+
 moke_dict = {
 
 }
 
+MOKE_CHANNEL_UNITS = {
+    "magnetization": "V",
+    "pulse": "V",
+    "reflectivity": "V",
+    "integrated_pulse": "V.s",
+}
+
 def moke_info_from_filename(file_path):
     """
     Returns the scan number from the given filepath.
@@ -115,6 +139,151 @@ def read_data_from_moke(file_path_list):
     return mag_data, pul_data, sum_data
 
 
+def read_moke_text_array(file_path):
+    """
+    Fast reader for the MOKE text files, same output as pd.read_table(file_path).iloc[:, :-1].values.
+    The layout is taken from the header and first data line, then the numbers are parsed by pyarrow and copied
+    column by column into a preallocated float array. Files that do not follow the usual layout
+    (one header line, tab separated numbers) are read with pandas instead.
+
+    @param file_path: path of a magnetization, pulse or sum file
+    @return: 2D float array of shape (samples, shots)
+    """
+    with open(file_path, "rb") as file:
+        header = file.readline()
+        first_line = file.readline()
+
+    fields = first_line.rstrip(b"\r\n").split(b"\t")
+    # pd.read_table uses the first column as index when the header is shorter than the data
+    if not first_line or len(header.rstrip(b"\r\n").split(b"\t")) != len(fields):
+        return read_moke_text_array_pandas(file_path)
+
+    # pd.read_table keeps every column but the last one, which is empty when lines end with a tab
+    nb_columns = len(fields) - 1
+    if nb_columns == 0:
+        return read_moke_text_array_pandas(file_path)
+
+    column_names = [f"f{i}" for i in range(nb_columns)]
+    try:
+        table = pa_csv.read_csv(
+            file_path,
+            read_options=pa_csv.ReadOptions(skip_rows=1, autogenerate_column_names=True),
+            parse_options=pa_csv.ParseOptions(delimiter="\t"),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=column_names, column_types={name: pa.float64() for name in column_names}
+            ),
+        )
+    except (ValueError, TypeError):
+        return read_moke_text_array_pandas(file_path)
+
+    array = np.empty((table.num_rows, nb_columns), dtype="float")
+    for i, name in enumerate(column_names):
+        array[:, i] = table.column(name).to_numpy()
+
+    return array
+
+
+def read_moke_text_array_pandas(file_path):
+    """
+    Reference reader of the MOKE text files, the trailing column is dropped.
+
+    @param file_path: path of a magnetization, pulse or sum file
+    @return: 2D array of shape (samples, shots)
+    """
+    table = pd.read_table(str(file_path))
+    return table.iloc[:, :-1].values
+
+
+def read_data_from_moke_fast(file_path_list):
+    """
+    Same as read_data_from_moke, using read_moke_text_array. The kind of file is taken from the file name.
+
+    @param file_path_list: paths of the magnetization, pulse and sum files of a p-number
+    @return: tuple (magnetization array, pulse array, sum array)
+    """
+    array_dict = {}
+    for file_path in file_path_list:
+        file_name = Path(file_path).name
+        for kind in ["magnetization", "pulse", "sum"]:
+            if kind in file_name:
+                array_dict[kind] = read_moke_text_array(file_path)
+
+    for kind in ["magnetization", "pulse", "sum"]:
+        if kind not in array_dict:
+            raise KeyError(f"No {kind} file among {[str(file_path) for file_path in file_path_list]}")
+
+    return array_dict["magnetization"], array_dict["pulse"], array_dict["sum"]
+
+
+def moke_scan_source_folder(source_path, pattern=r"^p(\d+)"):
+    """
+    Single pass over the source folder, collecting the info.txt file and the measurement files grouped by p-number.
+
+    @param source_path: folder containing the MOKE measurement
+    @param pattern: regex pattern to extract p-numbers from file names, see moke_make_path_dictionary
+    @return: tuple (info_path or None, dict {p-number: [file_path, ...]} sorted by p-number)
+    """
+    info_path = None
+    grouped_dict = defaultdict(list)
+    for file_path in safe_rglob(source_path):
+        file_name = file_path.name
+        if file_name == "info.txt":
+            info_path = file_path
+            continue
+        if file_path.suffix != ".txt":
+            continue
+        match = re.search(pattern, file_name)
+        if match:
+            grouped_dict[match.group(1)].append(file_path)
+
+    path_dict = {p_number: grouped_dict[p_number] for p_number in sorted(grouped_dict, key=int)}
+    return info_path, path_dict
+
+
+def moke_start_parse_pool(path_dict, workers=MOKE_PARSE_WORKERS):
+    """
+    Pool of processes parsing the text files, when there are enough positions to parse them in parallel.
+    The processes are spawned, see start_hdf5_process_pool, they only get the paths of the files to parse.
+
+    @param path_dict: dict {p-number: [file_path, ...]}, from moke_scan_source_folder
+    @param workers: number of processes, every core if None, 1 to parse in the main process
+    @return: ProcessPoolExecutor, None to parse in the main process
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(path_dict)))
+
+    if workers == 1 or len(path_dict) < MOKE_PARSE_PARALLEL_MIN_POSITIONS:
+        return None
+    return start_hdf5_process_pool(workers)
+
+
+def moke_iterate_position_data(path_dict, executor=None, batch_size=None):
+    """
+    Parse the text files of every p-number, in parallel when a pool is given.
+    Positions are parsed by batches so that only a few of them are held in memory while they are being written.
+
+    @param path_dict: dict {p-number: [file_path, ...]}, from moke_scan_source_folder
+    @param executor: pool from moke_start_parse_pool, None to parse in the main process
+    @param batch_size: number of positions parsed per batch, 4 per core if None
+    @return: generator of (p-number, file_path_list, (magnetization array, pulse array, sum array)), in p-number order
+    """
+    scan_number_list = list(path_dict.keys())
+
+    if executor is None:
+        for scan_number in scan_number_list:
+            yield scan_number, path_dict[scan_number], read_data_from_moke_fast(path_dict[scan_number])
+        return
+
+    if batch_size is None:
+        batch_size = 4 * (os.cpu_count() or 1)
+    for start in range(0, len(scan_number_list), batch_size):
+        batch = scan_number_list[start:start + batch_size]
+        file_path_lists = [path_dict[scan_number] for scan_number in batch]
+        for scan_number, data in zip(batch, executor.map(read_data_from_moke_fast, file_path_lists)):
+            yield scan_number, path_dict[scan_number], data
+
+
 def get_time_from_moke(datasize):
     """
     Generates a list of time values based on the given data size.
@@ -184,20 +353,16 @@ def write_moke_to_hdf5(hdf5_path, source_path, dataset_name = None, mode="a"):
     if dataset_name is None:
         dataset_name = source_path.stem
 
-    found_info = False
-    header_dict =  {}
-    for file_name in safe_rglob(source_path, pattern='info.txt'):
-        file_path = source_path / file_name
-        header_dict = read_header_from_moke(file_path)
-        found_info = True
+    # info.txt and the measurement files are found in a single pass over the folder
+    info_path, path_dict = moke_scan_source_folder(source_path)
 
     # Make sure that info.txt has been found
-    if not found_info:
+    if info_path is None:
         raise Exception("Could not find info.txt file. Check measurement.")
+    header_dict = read_header_from_moke(info_path)
 
-    path_dict = moke_make_path_dictionary(source_path)
-
-    with h5py.File(hdf5_path, mode) as hdf5_file:
+    parse_pool = moke_start_parse_pool(path_dict) or nullcontext()
+    with parse_pool as executor, pooled_hdf5_file(hdf5_path, mode) as hdf5_file:
         # Create the root group for the measurement
         moke_group = hdf5_file.create_group(f"{dataset_name}")
         # Initialize attributes for the group
@@ -208,10 +373,10 @@ def write_moke_to_hdf5(hdf5_path, source_path, dataset_name = None, mode="a"):
         initialize_dataset_group(moke_group)
         positions_group = moke_group.get("positions")
 
-        # For every position, write measurement to HDF5
-        for scan_number in path_dict.keys():
-            info_dict = moke_info_from_filename(path_dict[scan_number][0])
-            mag_array, pul_array, sum_array = read_data_from_moke(path_dict[scan_number])
+        # For every position, write measurement to HDF5. Text files are parsed in parallel while writing
+        for scan_number, file_path_list, data in moke_iterate_position_data(path_dict, executor):
+            info_dict = moke_info_from_filename(file_path_list[0])
+            mag_array, pul_array, sum_array = data
             time_dict = get_time_from_moke(len(mag_array))
             nb_acquisitions = len(mag_array[0])
 
@@ -234,72 +399,156 @@ def write_moke_to_hdf5(hdf5_path, source_path, dataset_name = None, mode="a"):
             # Measurement group for data
             measurement_group = position_group.create_group("measurement")
             measurement_group.attrs["HT_class"] = "HTmeasurement"
+            # Changes every time the measurement is written, used to skip unchanged positions when refitting
+            measurement_group.attrs["measurement_stamp"] = uuid.uuid4().hex
             time = [convertFloat(t) for t in time_dict]
-            time_node = measurement_group.create_dataset("time", data=time, dtype="float")
+            time_node = create_policy_dataset(measurement_group, "time", time, "axis", instrument="moke", dtype="float")
             time_node.attrs["units"] = "μs"
 
-            # Prepare arrays to generate mean
-            integrated_pulse_arrays = []
-            pulse_arrays = []
-            mag_arrays = []
-            sum_arrays = []
-
-            # Create shot groups in HDF5
+            # Shots are stored as one (samples x shots) array per channel, chunked by shot. They are written one
+            # shot at a time while the statistics are accumulated, nothing else scales with the number of shots
+            shot_nodes = {
+                channel: create_moke_shot_dataset(measurement_group, channel, (len(mag_array), nb_acquisitions))
+                for channel in MOKE_SHOT_CHANNELS
+            }
+            statistics_dict = moke_init_shot_statistics(len(mag_array))
             for i in range(nb_acquisitions):
-                shot_group = measurement_group.create_group(f"shot_{i+1}")
-                mag = mag_array[:,i]
-                mag_node = shot_group.create_dataset(
-                    f"magnetization_{i+1}", data=mag, dtype="float"
-                )
-                mag_arrays.append(mag)
-
-                pul = pul_array[:,i]
-                pul_node = shot_group.create_dataset(
-                    f"pulse_{i+1}", data=pul, dtype="float"
-                )
-                pulse_arrays.append(pul)
-                integrated_pulse = moke_integrate_pulse_array(pul)
-                integrated_pulse_node = shot_group.create_dataset(
-                    f"integrated_pulse_{i+1}", data=integrated_pulse, dtype="float"
-                )
-                integrated_pulse_arrays.append(integrated_pulse)
-
-                sum = sum_array[:,i]
-                sum_node = shot_group.create_dataset(
-                    f"reflectivity_{i+1}", data=sum, dtype="float"
-                )
-                sum_arrays.append(sum)
-
-                mag_node.attrs["units"] = "V"
-                pul_node.attrs["units"] = "V"
-                sum_node.attrs["units"] = "V"
-                integrated_pulse_node.attrs["units"] = "V.s"
-
-            # Add mean of measurements to HDF5
-            mean_integrated_pulse = np.mean(np.stack(integrated_pulse_arrays), axis=0)
-            mean_pulse = np.mean(np.stack(pulse_arrays), axis=0)
-            mean_magnetization = np.mean(np.stack(mag_arrays), axis=0)
-            mean_reflectivity = np.mean(np.stack(sum_arrays), axis=0)
-
-            shot_group = measurement_group.create_group("shot_mean")
-            integrated_pulse_mean_node = shot_group.create_dataset(
-                "integrated_pulse_mean", data=mean_integrated_pulse, dtype="float"
-            )
-            pulse_mean_node = shot_group.create_dataset(
-                "pulse_mean", data=mean_pulse, dtype="float"
-            )
-            mag_mean_node = shot_group.create_dataset(
-                "magnetization_mean", data=mean_magnetization, dtype="float"
+                shot_dict = {
+                    "magnetization": mag_array[:, i],
+                    "pulse": pul_array[:, i],
+                    "reflectivity": sum_array[:, i],
+                    "integrated_pulse": moke_integrate_pulse_array(pul_array[:, i]),
+                }
+                for channel in MOKE_SHOT_CHANNELS:
+                    shot_nodes[channel][:, i] = shot_dict[channel]
+                moke_update_shot_statistics(statistics_dict, shot_dict)
+
+            write_moke_shot_statistics(measurement_group, moke_finalize_shot_statistics(statistics_dict))
+
+        # Columnar table of the positions, used for fast coordinate lookups
+        write_position_table(moke_group)
+
+
+def write_moke_shot_dataset(measurement_group, channel, shot_array):
+    """
+    Write one channel of every shot of a position as a (samples x shots) dataset. The dataset policy chunks it
+    by shot so that reading a single shot only touches one chunk.
+
+    @param measurement_group: MOKE measurement group of a position
+    @param channel: channel name, one of MOKE_SHOT_CHANNELS
+    @param shot_array: 2D array of shape (samples, shots)
+    @return: the created dataset
+    """
+    shot_array = np.asarray(shot_array, dtype="float")
+    node = create_policy_dataset(measurement_group, channel, shot_array, "trace", instrument="moke", dtype="float")
+    node.attrs["units"] = MOKE_CHANNEL_UNITS[channel]
+    return node
+
+
+def create_moke_shot_dataset(measurement_group, channel, shape):
+    """
+    Create an empty (samples x shots) dataset for one channel, filled one shot at a time by the writer.
+
+    @param measurement_group: MOKE measurement group of a position
+    @param channel: channel name, one of MOKE_SHOT_CHANNELS
+    @param shape: (samples, shots)
+    @return: the created dataset
+    """
+    node = create_policy_dataset(
+        measurement_group, channel, None, "trace", instrument="moke", dtype="float", shape=shape
+    )
+    node.attrs["units"] = MOKE_CHANNEL_UNITS[channel]
+    return node
+
+
+def write_moke_shot_statistics(measurement_group, shot_statistics_dict, write_mean=True):
+    """
+    Write the mean and standard deviation of every channel over the shots, and the per position noise, SNR and drift.
+
+    @param measurement_group: MOKE measurement group of a position
+    @param shot_statistics_dict: dictionary from moke_finalize_shot_statistics
+    @param write_mean: if False, the existing shot_mean group is kept
+    @return: None
+    """
+    group_list = [("shot_mean", "mean"), ("shot_std", "std")] if write_mean else [("shot_std", "std")]
+    for group_name, suffix in group_list:
+        if group_name in measurement_group:
+            del measurement_group[group_name]
+        shot_group = measurement_group.create_group(group_name)
+        for channel in MOKE_SHOT_CHANNELS:
+            # Settings follow the channel, the mean of the integrated pulse keeps its precision
+            node = create_policy_dataset(
+                shot_group, f"{channel}_{suffix}", shot_statistics_dict[suffix][channel], "trace",
+                instrument="moke", dtype="float", settings_name=channel
             )
-            sum_mean_node = shot_group.create_dataset(
-                "reflectivity_mean", data=mean_reflectivity, dtype="float"
+            node.attrs["units"] = MOKE_CHANNEL_UNITS[channel]
+
+    if "shot_statistics" in measurement_group:
+        del measurement_group["shot_statistics"]
+    statistics_group = measurement_group.create_group("shot_statistics")
+    for key, value in shot_statistics_dict["metrics"].items():
+        statistics_group[key] = value
+        statistics_group[key].attrs["units"] = MOKE_SHOT_STATISTICS_UNITS[key]
+
+
+def update_moke_hdf5(moke_group):
+    """
+    Function to update an old version of a MOKE group to specs of newer versions.
+
+    @param moke_group:
+    @return: True if group has been updated, False if group was already up to date
+    """
+    source_version = moke_group.attrs.get("moke_writer", "0.1")
+
+    if source_version == MOKE_WRITER_VERSION:
+        return False
+
+    source_version = float(source_version)
+
+    if source_version < 0.5:
+        # Version 0.5 stacks the shot_N groups into one (samples x shots) dataset per channel
+        positions_group = get_positions_group(moke_group)
+        for position, position_group in positions_group.items():
+            if "scan_parameters" in position:
+                continue
+            measurement_group = position_group.get("measurement")
+            if measurement_group is None or moke_is_stacked_measurement(measurement_group):
+                continue
+
+            nb_shots = moke_get_shot_count(measurement_group)
+            if nb_shots == 0:
+                continue
+            shot_list = [moke_read_shot_arrays(measurement_group, i + 1) for i in range(nb_shots)]
+            for channel in MOKE_SHOT_CHANNELS:
+                shot_array = np.stack([shot[channel] for shot in shot_list], axis=1)
+                write_moke_shot_dataset(measurement_group, channel, shot_array)
+            for i in range(nb_shots):
+                del measurement_group[f"shot_{i+1}"]
+
+    if source_version < 0.6:
+        # Version 0.6 records the shot to shot spread, read back one shot at a time from the stacked datasets
+        positions_group = get_positions_group(moke_group)
+        for position, position_group in positions_group.items():
+            if "scan_parameters" in position:
+                continue
+            measurement_group = position_group.get("measurement")
+            if measurement_group is None or not moke_is_stacked_measurement(measurement_group):
+                continue
+
+            nb_samples, nb_shots = measurement_group["magnetization"].shape
+            statistics_dict = moke_init_shot_statistics(nb_samples)
+            for i in range(nb_shots):
+                shot_dict = {channel: measurement_group[channel][:, i] for channel in MOKE_SHOT_CHANNELS}
+                moke_update_shot_statistics(statistics_dict, shot_dict)
+            # The stored shots can have a lower precision than the parsed ones, the recorded means are kept
+            write_moke_shot_statistics(
+                measurement_group, moke_finalize_shot_statistics(statistics_dict), write_mean=False
             )
 
-            pulse_mean_node.attrs["units"] = "V"
-            mag_mean_node.attrs["units"] = "V"
-            sum_mean_node.attrs["units"] = "V"
-            integrated_pulse_mean_node.attrs["units"] = "V.s"
+    # Update the version tag to the current version
+    moke_group.attrs["moke_writer"] = MOKE_WRITER_VERSION
 
+    return True
 
 
 def moke_results_dict_to_hdf5(moke_group, results_dict, treatment_dict=None):
@@ -318,6 +567,9 @@ def moke_results_dict_to_hdf5(moke_group, results_dict, treatment_dict=None):
                 del position_group["results"]
 
             results_group = position_group.create_group("results")
+            # Used by incremental fits to skip positions with the same treatment and measurement
+            results_group.attrs["treatment_hash"] = moke_treatment_hash(treatment_dict)
+            results_group.attrs["measurement_stamp"] = moke_get_measurement_stamp(position_group)
             parameters_group = results_group.create_group("parameters")
             for key, value in treatment_dict.items():
                 current_group = parameters_group.create_dataset(key, data=value)
@@ -336,4 +588,123 @@ def moke_results_dict_to_hdf5(moke_group, results_dict, treatment_dict=None):
                             subsubgroup.attrs["units"] = "T"
 
 
-    return True
\ No newline at end of file
+    return True
+
+def moke_sweep_to_hdf5(moke_group, treatment_list, position_list, results_array, key_list=None):
+    """
+    Write a treatment sweep to the MOKE dataset, replacing the previous one. Results are stored as a single
+    (parameter sets x positions x metrics) array, chunked by parameter set so that one map reads one chunk.
+
+    @param moke_group: MOKE dataset group
+    @param treatment_list: list of data treatment dictionaries
+    @param position_list: names of the positions
+    @param results_array: 3D array from moke_sweep_treatments
+    @param key_list: swept parameters, used for the labels of the parameter sets
+    @return: the sweep group
+    """
+    if key_list is None:
+        key_list = []
+
+    if "treatment_sweep" in moke_group:
+        del moke_group["treatment_sweep"]
+    sweep_group = moke_group.create_group("treatment_sweep")
+    sweep_group.attrs["HT_class"] = "HTsweep"
+    sweep_group.attrs["swept_parameters"] = json.dumps(list(key_list))
+
+    string_dtype = h5py.string_dtype()
+    sweep_group.create_dataset("positions", data=np.array(position_list, dtype=object), dtype=string_dtype)
+    sweep_group.create_dataset("metrics", data=np.array(list(MOKE_SWEEP_METRICS), dtype=object), dtype=string_dtype)
+    labels = [moke_treatment_label(treatment_dict, key_list) for treatment_dict in treatment_list]
+    sweep_group.create_dataset("labels", data=np.array(labels, dtype=object), dtype=string_dtype)
+    treatments = [json.dumps(treatment_dict, sort_keys=True) for treatment_dict in treatment_list]
+    sweep_group.create_dataset("treatments", data=np.array(treatments, dtype=object), dtype=string_dtype)
+
+    chunks = (1,) + results_array.shape[1:] if results_array.size > 0 else None
+    results_node = sweep_group.create_dataset("results", data=results_array, dtype="float", chunks=chunks)
+    results_node.attrs["units"] = json.dumps(MOKE_SWEEP_METRICS)
+
+    return sweep_group
+
+
+def moke_build_treatment_sweep(hdf5_path, dataset_name, treatment_dict, sweep_dict):
+    """
+    Evaluate every combination of the swept parameters on every position and store the results in the library.
+
+    @param hdf5_path: path of the library
+    @param dataset_name: name of the MOKE dataset group
+    @param treatment_dict: data treatment dictionary used for the parameters that are not swept
+    @param sweep_dict: dictionary {parameter: list of values}
+    @return: list of the labels of the parameter sets
+    """
+    treatment_list = moke_make_treatment_grid(treatment_dict, sweep_dict)
+    key_list = [key for key, values in sweep_dict.items() if len(values) > 0]
+
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        position_list, results_array = moke_sweep_treatments(hdf5_file[dataset_name], treatment_list)
+
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
+        moke_sweep_to_hdf5(hdf5_file[dataset_name], treatment_list, position_list, results_array, key_list)
+
+    return [moke_treatment_label(treatment, key_list) for treatment in treatment_list]
+
+
+def _moke_batch_fit_worker(hdf5_path, dataset_name, position_list, treatment_dict):
+    """Fit a slice of positions in a worker process, the library is opened read-only"""
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        return moke_batch_fit(hdf5_file[dataset_name], treatment_dict, position_list)
+
+
+def moke_build_database(
+    hdf5_path, dataset_name, treatment_dict, workers=MOKE_FIT_WORKERS, chunk_size=None, incremental=False
+):
+    """
+    Fit every position of a MOKE dataset and write the results to the library.
+    Positions are split in contiguous slices fitted by a pool of processes, each opening the library read-only.
+    Results are collected in slice order, so the output does not depend on the number of workers,
+    then written by this process once the workers have released the file (HDF5 file locking forbids
+    writing while other processes have it open).
+
+    @param hdf5_path: path of the library
+    @param dataset_name: name of the MOKE dataset group
+    @param treatment_dict: data treatment dictionary
+    @param workers: number of processes, every core if None, 1 to fit in the current process
+    @param chunk_size: number of positions per slice, sized for about 4 slices per worker if None
+    @param incremental: if True, only fit positions that are new, changed or fitted with another treatment
+    @return: (results dictionary {position: results} of the fitted positions, list of skipped positions)
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        if incremental:
+            position_list, skipped_list = moke_select_positions_to_fit(hdf5_file[dataset_name], treatment_dict)
+        else:
+            position_list, skipped_list = moke_list_positions(hdf5_file[dataset_name]), []
+
+        if not position_list:
+            return {}, skipped_list
+        if workers <= 1 or len(position_list) < 2:
+            results_dict = moke_batch_fit(hdf5_file[dataset_name], treatment_dict, position_list)
+            workers = 1
+
+    if workers > 1:
+        if chunk_size is None:
+            chunk_size = max(math.ceil(len(position_list) / (4 * workers)), 1)
+        chunk_list = [position_list[i: i + chunk_size] for i in range(0, len(position_list), chunk_size)]
+
+        results_dict = {}
+        with start_hdf5_process_pool(min(workers, len(chunk_list))) as executor:
+            # map yields the slices in submission order whatever the order in which they finish
+            for chunk_results in executor.map(
+                _moke_batch_fit_worker,
+                [str(hdf5_path)] * len(chunk_list),
+                [dataset_name] * len(chunk_list),
+                chunk_list,
+                [treatment_dict] * len(chunk_list),
+            ):
+                results_dict.update(chunk_results)
+
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
+        moke_results_dict_to_hdf5(hdf5_file[dataset_name], results_dict, treatment_dict)
+
+    return results_dict, skipped_list
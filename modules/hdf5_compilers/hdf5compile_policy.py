@@ -0,0 +1,222 @@
+"""
+Dataset creation policies shared by every hdf5compile_* writer.
+
+A policy maps a dataset role to its storage settings (chunk shape, compression filter, shuffle, fletcher32 and dtype).
+Settings are looked up from the most specific key to the least specific one:
+"instrument/role/name", then "instrument/role", then "role". The name is the dataset name, or the channel of derived
+datasets such as the shot means of a MOKE channel. Roles used by the writers are:
+    - detector_image : 2D detector frames (XRD 2Dimage, ESRF stacks)
+    - spectrum : 1D signals (EDX counts, integrated diffractograms, height profiles)
+    - trace : oscilloscope traces (MOKE magnetization, pulse and reflectivity shots)
+    - axis : abscissa arrays (energy, 2θ, q, time, distance)
+    - picture : photos of the samples
+"""
+
+import h5py
+import numpy as np
+
+# Storage keeping h5py defaults (contiguous, uncompressed, dtype chosen by the writer) for every role but pictures
+LEGACY_DATASET_POLICY = {
+    "picture": {"compression": "gzip"},
+}
+
+# Light gzip compression of the bulky roles, read speed stays close to uncompressed storage. Only standard HDF5 filters
+# are used, so libraries still open in HDFView, MATLAB and the HDF5 tools. Datasets keep the dtype chosen by their writer
+BALANCED_DATASET_POLICY = {
+    "detector_image": {
+        "chunks": "frame", "compression": "gzip", "compression_opts": 1, "shuffle": True, "fletcher32": True
+    },
+    "spectrum": {"chunks": True, "compression": "gzip", "compression_opts": 1, "shuffle": True},
+    "trace": {"chunks": True, "compression": "gzip", "compression_opts": 1, "shuffle": True},
+    "moke/trace": {"chunks": "column", "compression": "gzip", "compression_opts": 1, "shuffle": True},
+    "picture": {"compression": "gzip"},
+}
+
+# Same layout with the LZF filter, faster to write and read than gzip. LZF ships with h5py only: the libraries can no
+# longer be opened by HDFView, MATLAB or the C/Fortran HDF5 tools, so this policy has to be selected explicitly
+FAST_DATASET_POLICY = {
+    "detector_image": {"chunks": "frame", "compression": "lzf", "shuffle": True, "fletcher32": True},
+    "spectrum": {"chunks": True, "compression": "lzf", "shuffle": True},
+    "trace": {"chunks": True, "compression": "lzf", "shuffle": True},
+    "moke/trace": {"chunks": "column", "compression": "lzf", "shuffle": True},
+    "picture": {"compression": "gzip"},
+}
+
+# Smallest files, for archived libraries that are rarely read. Traces are stored in single precision
+COMPACT_DATASET_POLICY = {
+    "detector_image": {
+        "chunks": "frame", "compression": "gzip", "compression_opts": 6, "shuffle": True, "fletcher32": True
+    },
+    "spectrum": {"chunks": True, "compression": "gzip", "compression_opts": 4, "shuffle": True},
+    "trace": {"chunks": True, "compression": "gzip", "compression_opts": 4, "shuffle": True, "dtype": "float32"},
+    "moke/trace": {
+        "chunks": "column", "compression": "gzip", "compression_opts": 4, "shuffle": True, "dtype": "float32"
+    },
+    # The integrated pulse is a cumulative sum, it keeps double precision
+    "moke/trace/integrated_pulse": {
+        "chunks": "column", "compression": "gzip", "compression_opts": 4, "shuffle": True, "dtype": "float64"
+    },
+    "axis": {"chunks": True, "compression": "gzip", "compression_opts": 4, "shuffle": True},
+    "picture": {"compression": "gzip", "compression_opts": 6},
+}
+
+DATASET_POLICIES = {
+    "legacy": LEGACY_DATASET_POLICY,
+    "balanced": BALANCED_DATASET_POLICY,
+    "fast": FAST_DATASET_POLICY,
+    "compact": COMPACT_DATASET_POLICY,
+}
+
+# Policy used by the writers
+HDF5_DATASET_POLICY = "balanced"
+
+_active_dataset_policy = {"name": HDF5_DATASET_POLICY}
+
+
+def set_dataset_policy(policy_name):
+    """
+    Select the policy used by the writers.
+
+    @param policy_name: key of DATASET_POLICIES
+    @return: None
+    """
+    if policy_name not in DATASET_POLICIES:
+        raise KeyError(f"Unknown dataset policy {policy_name}, expected one of {list(DATASET_POLICIES)}")
+    _active_dataset_policy["name"] = policy_name
+
+
+def get_dataset_settings(role, instrument=None, name=None, policy=None):
+    """
+    Return the storage settings of a dataset role, from the most specific key of the policy.
+
+    @param role: dataset role (detector_image, spectrum, trace, axis, picture)
+    @param instrument: HT_type of the dataset group, e.g. "moke"
+    @param name: name of the dataset
+    @param policy: policy name or policy dictionary, the active policy if None
+    @return: dict of settings, empty for h5py defaults
+    """
+    if policy is None:
+        policy = _active_dataset_policy["name"]
+    if isinstance(policy, str):
+        policy = DATASET_POLICIES[policy]
+
+    for key in [f"{instrument}/{role}/{name}", f"{instrument}/{role}", role]:
+        if key in policy:
+            return dict(policy[key])
+    return {}
+
+
+def make_chunk_shape(chunks, shape):
+    """
+    Resolve the chunks setting of a policy for a given dataset shape.
+
+    @param chunks: None, True, a tuple, "frame" (one chunk per 2D frame) or "column" (one chunk per column)
+    @param shape: shape of the dataset
+    @return: value for the chunks argument of create_dataset
+    """
+    if chunks == "frame":
+        if len(shape) < 2:
+            return True
+        return (1,) * (len(shape) - 2) + tuple(shape[-2:])
+    if chunks == "column":
+        if len(shape) != 2:
+            return True
+        return shape[0], 1
+    return chunks
+
+
+def get_dataset_kwargs(data, role, instrument=None, name=None, dtype=None, policy=None):
+    """
+    Build the create_dataset keyword arguments of a dataset following the policy.
+
+    @param data: data to be written
+    @param role: dataset role
+    @param instrument: HT_type of the dataset group
+    @param name: name of the dataset
+    @param dtype: dtype chosen by the writer, replaced if the policy sets one
+    @param policy: policy name or policy dictionary, the active policy if None
+    @return: dict of keyword arguments
+    """
+    settings = get_dataset_settings(role, instrument=instrument, name=name, policy=policy)
+    shape = np.shape(data)
+
+    kwargs = {}
+    if dtype is not None:
+        kwargs["dtype"] = dtype
+    # Only floating point data changes precision, integer counts are kept as they are
+    if "dtype" in settings:
+        writer_dtype = np.dtype(dtype) if dtype is not None else np.asarray(data).dtype
+        if writer_dtype.kind == "f":
+            kwargs["dtype"] = settings["dtype"]
+
+    # Scalars, strings and empty arrays cannot be chunked
+    if len(shape) == 0 or 0 in shape or np.asarray(data).dtype.kind in "OSU":
+        return kwargs
+
+    chunks = make_chunk_shape(settings.get("chunks"), shape)
+    if chunks is not None:
+        kwargs["chunks"] = chunks
+    for key in ["compression", "compression_opts", "shuffle", "fletcher32"]:
+        if settings.get(key) is not None:
+            kwargs[key] = settings[key]
+
+    return kwargs
+
+
+def create_policy_dataset(
+    group, name, data, role, instrument=None, dtype=None, policy=None, shape=None, settings_name=None
+):
+    """
+    Create a dataset with the storage settings of its role.
+
+    @param group: parent group
+    @param name: name of the dataset
+    @param data: data to be written, None to create an empty dataset of the given shape filled later by the writer
+    @param role: dataset role (detector_image, spectrum, trace, axis, picture)
+    @param instrument: HT_type of the dataset group, e.g. "moke"
+    @param dtype: dtype chosen by the writer
+    @param policy: policy name or policy dictionary, the active policy if None
+    @param shape: shape of the empty dataset, only used when data is None
+    @param settings_name: name looked up in the policy, the dataset name if None
+    @return: the created dataset
+    """
+    if settings_name is None:
+        settings_name = name
+    if data is None:
+        # Zero-copy stand-in carrying the shape and dtype used to resolve the settings
+        template = np.broadcast_to(np.zeros((), dtype=dtype if dtype is not None else "float"), shape)
+        kwargs = get_dataset_kwargs(
+            template, role, instrument=instrument, name=settings_name, dtype=dtype, policy=policy
+        )
+        kwargs.setdefault("dtype", template.dtype)
+        return group.create_dataset(name, shape=shape, **kwargs)
+
+    kwargs = get_dataset_kwargs(data, role, instrument=instrument, name=settings_name, dtype=dtype, policy=policy)
+    return group.create_dataset(name, data=data, **kwargs)
+
+
+def rewrite_policy_dataset(dataset, role, instrument=None, squeeze=False, policy=None):
+    """
+    Write an existing dataset again with the storage settings of its role, keeping its attributes.
+    Used on datasets copied from external files, which keep the storage of their source.
+
+    @param dataset: dataset to be rewritten
+    @param role: dataset role
+    @param instrument: HT_type of the dataset group
+    @param squeeze: if True, also remove the dimensions of length one
+    @param policy: policy name or policy dictionary, the active policy if None
+    @return: the new dataset
+    """
+    parent = dataset.parent
+    name = dataset.name.split("/")[-1]
+    attrs_dict = dict(dataset.attrs)
+    data = dataset[()]
+    if squeeze:
+        data = np.squeeze(data)
+
+    del parent[name]
+    new_dataset = create_policy_dataset(parent, name, data, role, instrument=instrument, policy=policy)
+    for key, value in attrs_dict.items():
+        new_dataset.attrs[key] = value
+
+    return new_dataset
@@ -67,7 +67,7 @@ def write_dektak_to_hdf5(hdf5_path, source_path, dataset_name=None, mode="a"):
     if dataset_name is None:
         dataset_name = source_path.stem
 
-    with h5py.File(hdf5_path, mode) as hdf5_file:
+    with pooled_hdf5_file(hdf5_path, mode) as hdf5_file:
         # Create the root group for the measurement
         profil_group = hdf5_file.create_group(f"{dataset_name}")
         profil_group.attrs["HT_type"] = "profil"
@@ -112,14 +112,18 @@ def write_dektak_to_hdf5(hdf5_path, source_path, dataset_name=None, mode="a"):
             data = position_group.create_group("measurement")
             data.attrs["NX_class"] = "HTmeasurement"
             for col in asc2d_dataframe.columns:
-                node = data.create_dataset(
-                    col, data=np.array(asc2d_dataframe[col]), dtype="float"
+                node = create_policy_dataset(
+                    data, col, np.array(asc2d_dataframe[col]), "axis" if col == "distance" else "spectrum",
+                    instrument="profil", dtype="float"
                 )
                 if col == "profile":
                     node.attrs["unit"] = "nm"
                 elif col == "distance":
                     node.attrs["unit"] = "μm"
 
+        # Columnar table of the positions, used for fast coordinate lookups
+        write_position_table(profil_group)
+
     return None
 
 
@@ -31,7 +31,7 @@ def write_squid_to_hdf5(hdf5_path, source_path, info_dict, dataset_name=None, mo
 
     instrument_df, measurement_df = read_instrument_and_measurement_from_squid(source_path)
 
-    with h5py.File(hdf5_path, mode) as hdf5_file:
+    with pooled_hdf5_file(hdf5_path, mode) as hdf5_file:
         # Create the root group for the measurement
         if "squid" not in hdf5_file.keys():
             squid_group = hdf5_file.create_group("squid")
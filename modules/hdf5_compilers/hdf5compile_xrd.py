@@ -5,11 +5,13 @@ Functions for XRD parsing (Rigaku SmartLab and ESRF NeXuS)
 import fabio
 import h5py
 
+from ..functions.functions_axes import *
 from ..functions.functions_shared import *
 from ..functions.functions_xrd import *
 from ..hdf5_compilers.hdf5compile_base import *
+from ..hdf5_compilers.hdf5compile_esrf import ESRF_WRITER_VERSION
 
-SMARTLAB_WRITER_VERSION = "0.2"
+SMARTLAB_WRITER_VERSION = "0.4"
 
 
 def get_scan_numbers(filename):
@@ -191,7 +193,7 @@ def write_smartlab_to_hdf5(hdf5_path, source_path, dataset_name):
     if dataset_name is None:
         dataset_name = source_path.stem
 
-    with h5py.File(hdf5_path, "a") as hdf5_file:
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
         xrd_group = hdf5_file.create_group(dataset_name)
         xrd_group.attrs["HT_type"] = "xrd"
         xrd_group.attrs["instrument"] = "Rigaku Smartlab"
@@ -248,17 +250,17 @@ def write_smartlab_to_hdf5(hdf5_path, source_path, dataset_name):
             q_data = xrd_tth_q(tth_data, energy=8.04)
             intensity_data = [i / np.sum(counts_data) for i in counts_data]
 
-            tth_group = integrated_group.create_dataset(
-                "tth", (len(tth_data),), data=tth_data, dtype="float"
+            tth_group = create_policy_dataset(
+                integrated_group, "tth", tth_data, "axis", instrument="xrd", dtype="float"
             )
-            q_group = integrated_group.create_dataset(
-                "q", (len(tth_data),), data=q_data, dtype="float"
+            q_group = create_policy_dataset(
+                integrated_group, "q", q_data, "axis", instrument="xrd", dtype="float"
             )
-            counts_group = integrated_group.create_dataset(
-                "counts", (len(counts_data),), data=counts_data, dtype="float"
+            counts_group = create_policy_dataset(
+                integrated_group, "counts", counts_data, "spectrum", instrument="xrd", dtype="float"
             )
-            intensity_group = integrated_group.create_dataset(
-                "intensity", (len(counts_data),), data=intensity_data, dtype="float"
+            intensity_group = create_policy_dataset(
+                integrated_group, "intensity", intensity_data, "spectrum", instrument="xrd", dtype="float"
             )
 
             tth_group.attrs["units"] = "deg"
@@ -267,6 +269,44 @@ def write_smartlab_to_hdf5(hdf5_path, source_path, dataset_name):
             intensity_group.attrs["units"] = "a.u."
 
             # Image group
-            measurement_group.create_dataset("2Dimage", img_data.shape, data=img_data)
+            create_policy_dataset(measurement_group, "2Dimage", img_data, "detector_image", instrument="xrd")
+
+            reductions_dict = xrd_reduce_frame(img_data)
+            reductions_dict["peaks"] = xrd_count_peaks(counts_data)
+            xrd_write_frame_reductions(measurement_group, reductions_dict)
+
+        # Columnar table of the positions, used for fast coordinate lookups
+        write_position_table(xrd_group)
+        # Peaks of every integrated pattern, mapped by the XRD tab without reading the patterns
+        xrd_write_peak_table(xrd_group)
 
     return None
+
+
+def update_xrd_hdf5(xrd_group):
+    """
+    Function to update an old version of an XRD group (SmartLab or ESRF) to specs of newer versions.
+
+    @param xrd_group: XRD dataset group
+    @return: True if group has been updated, False if group was already up to date
+    """
+    if "esrf_writer" in xrd_group.attrs:
+        writer_key, writer_version, reductions_version = "esrf_writer", ESRF_WRITER_VERSION, 0.5
+    else:
+        writer_key, writer_version, reductions_version = "smartlab_writer", SMARTLAB_WRITER_VERSION, 0.3
+
+    updated = False
+    source_version = xrd_group.attrs.get(writer_key, "0.1")
+    if source_version != writer_version:
+        if float(source_version) < reductions_version:
+            # Frame reductions are recorded at compile time, older libraries get them from their stored frames
+            xrd_write_dataset_reductions(xrd_group)
+        xrd_group.attrs[writer_key] = writer_version
+        updated = True
+
+    # Peak tables missing or found with other peak settings are detected again, they are never detected on read
+    if xrd_read_peak_table(xrd_group) is None:
+        xrd_write_peak_table(xrd_group)
+        updated = True
+
+    return updated
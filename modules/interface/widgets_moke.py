@@ -222,6 +222,86 @@ def moke_loop_map_options():
 
     return card
 
+def moke_sweep_options():
+    card = dbc.Card([
+        dbc.CardHeader("Treatment sweep"),
+        dbc.CardBody([
+            html.Label("Values are comma separated, other parameters are taken from the Main tab"),
+            dbc.Row([
+                dbc.Col([
+                    html.Label("Coil Factors (T/100V)"),
+                    dbc.Input(
+                        id="moke_sweep_coil_factor",
+                        type="text",
+                        placeholder="e.g. 0.9, 0.92667, 0.95",
+                    ),
+                ]),
+                dbc.Col([
+                    html.Label("Smoothing Polyorders"),
+                    dbc.Input(
+                        id="moke_sweep_smoothing_polyorder",
+                        type="text",
+                        placeholder="e.g. 1, 2",
+                    ),
+                ]),
+                dbc.Col([
+                    html.Label("Smoothing Ranges"),
+                    dbc.Input(
+                        id="moke_sweep_smoothing_range",
+                        type="text",
+                        placeholder="e.g. 10, 20, 40",
+                    ),
+                ]),
+            ]),
+            html.Label("Treatment flags compared on and off"),
+            dbc.Checklist(
+                id="moke_sweep_flags",
+                options=[
+                    {"label": "Smoothing", "value": "smoothing"},
+                    {"label": "Correct offset", "value": "correct_offset"},
+                    {"label": "Low field filter", "value": "filter_zero"},
+                    {"label": "Connect loops", "value": "connect_loops"},
+                    {"label": "Shift loops", "value": "shift_loops"},
+                ],
+                value=[],
+                inline=True,
+            ),
+            dbc.Button(
+                id="moke_sweep_button",
+                children="Run sweep!",
+                n_clicks=0,
+                color="success",
+            ),
+            html.H5(id="moke_sweep_text_box"),
+            html.Label("Parameter set"),
+            dbc.Select(
+                id="moke_sweep_set_select",
+                options=[],
+                placeholder="Select parameter set",
+            ),
+            html.Label("Currently plotting:"),
+            dbc.Select(
+                id="moke_sweep_metric_select",
+                options=[],
+                placeholder="Select property",
+            ),
+        ]),
+        dbc.CardFooter([])
+    ], className="h-100 w-100")
+
+    return card
+
+def moke_sweep_heatmap():
+    card = dbc.Card([
+        dbc.CardHeader(),
+        dbc.CardBody([
+            dcc.Graph(id="moke_sweep_heatmap")
+        ]),
+        dbc.CardFooter([])
+    ], className="h-100 w-100")
+
+    return card
+
 def moke_stores():
     stores = html.Div(
         children=[
@@ -288,6 +368,23 @@ def make_moke_tab(upload_folder_root):
                                         ]
                                     )
                                 ]
+                            ),
+                            dbc.Tab(
+                                id="moke_sweep",
+                                label="Treatment sweep",
+                                children=[
+                                    dcc.Loading(
+                                        id="loading_sweep_moke",
+                                        type="default",
+                                        delay_show=500,
+                                        children=[
+                                            dbc.Row([
+                                                dbc.Col(moke_sweep_options(), width=4, className="d-flex flex-column"),
+                                                dbc.Col(moke_sweep_heatmap(), width=8, className="d-flex flex-column"),
+                                            ], className="mb-4 d-flex align-items-stretch")
+                                        ]
+                                    )
+                                ]
                             )
                         ]
                     )
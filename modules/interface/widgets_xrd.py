@@ -28,6 +28,27 @@ def xrd_top_left_card():
                         )
                     )
                 ]),
+                dbc.Row([
+                    html.Label("Peak window (nm^-1)"),
+                    dbc.Col(
+                        dbc.Input(
+                            id="xrd_peak_q_min",
+                            type="number",
+                            placeholder="q min",
+                            value=None,
+                            debounce=True,
+                        ),
+                    ),
+                    dbc.Col(
+                        dbc.Input(
+                            id="xrd_peak_q_max",
+                            type="number",
+                            placeholder="q max",
+                            value=None,
+                            debounce=True,
+                        ),
+                    ),
+                ]),
                 dbc.Row([
                     html.Label("Colorbar bounds"),
                     dbc.Input(
@@ -97,6 +118,15 @@ def xrd_top_middle_card():
             ])
         ]),
         dbc.CardFooter([
+            dbc.Select(
+                id="xrd_export_format",
+                options=[
+                    {"label": "Folder", "value": "folder"},
+                    {"label": "Zip archive", "value": "zip"},
+                    {"label": "Tar archive", "value": "tar"},
+                ],
+                value="folder",
+            ),
             dbc.Button(id="xrd_export_button", children="Export for fitting", n_clicks=0),
             dbc.Button(id="xrd_pyfai_button", children="Re-integrate", n_clicks=0),
         ])
@@ -212,6 +242,21 @@ def widget_xrd_integrate_modal():
                             options=["integrate1d", "medfilt1d"]
                         )
                     ]),
+                    dbc.Col([
+                        html.Label("Method"),
+                        dbc.Select(
+                            id="pyfai_method_select",
+                            options=[
+                                "persisted_csr",
+                                "batched_csr",
+                                "no_csr_cython",
+                                "bbox_csr_cython",
+                                "bbox_lut_cython",
+                                "no_histogram_cython",
+                            ],
+                            value="persisted_csr",
+                        )
+                    ]),
                 ]),
                 dbc.Row([
                     dbc.Col(children=[
@@ -221,6 +266,13 @@ def widget_xrd_integrate_modal():
                             type="number"
                         ),
                     ])
+                ]),
+                dbc.Row([
+                    dbc.Col(children=[
+                        html.Label("Progress"),
+                        dbc.Progress(id="pyfai_progress", value=0, label=""),
+                        dcc.Interval(id="pyfai_progress_interval", interval=1000, disabled=True),
+                    ])
                 ])
             ]),
             dbc.ModalFooter([
@@ -0,0 +1,111 @@
+"""
+Tests of the conversions between q, 2θ and d-spacing against their textbook formulas.
+"""
+import h5py
+import numpy as np
+import pytest
+
+from modules.functions.functions_axes import (
+    XRD_HC_KEV_NM,
+    xrd_convert_axis,
+    xrd_convert_units,
+    xrd_q_tth,
+    xrd_read_axis,
+    xrd_tth_q,
+    xrd_wavelength,
+)
+
+ENERGY = 8.04
+TTH_ARRAY = np.linspace(10, 120, 50)
+
+
+def reference_q(tth, energy=ENERGY):
+    """q in nm^-1 of 2θ in deg, q = 4π sin(θ) / λ"""
+    return 4 * np.pi * np.sin(np.radians(tth) / 2) / (XRD_HC_KEV_NM / energy)
+
+
+def test_wavelength():
+    assert xrd_wavelength(ENERGY) == pytest.approx(XRD_HC_KEV_NM / ENERGY)
+    for energy in [None, 0, -1]:
+        with pytest.raises(ValueError):
+            xrd_wavelength(energy)
+
+
+def test_tth_to_q():
+    np.testing.assert_allclose(xrd_tth_q(TTH_ARRAY, ENERGY), reference_q(TTH_ARRAY), rtol=1e-12)
+
+
+def test_q_to_tth():
+    np.testing.assert_allclose(xrd_q_tth(reference_q(TTH_ARRAY), ENERGY), TTH_ARRAY, rtol=1e-12)
+
+
+def test_q_to_d():
+    q_array = reference_q(TTH_ARRAY)
+    np.testing.assert_allclose(xrd_convert_axis(q_array, "q", "d"), 2 * np.pi / q_array, rtol=1e-12)
+    np.testing.assert_allclose(xrd_convert_axis(2 * np.pi / q_array, "d", "q"), q_array, rtol=1e-12)
+
+
+def test_tth_to_d_bragg():
+    # Bragg's law, λ = 2 d sin(θ)
+    d_array = xrd_convert_axis(TTH_ARRAY, "tth", "d", energy=ENERGY)
+    np.testing.assert_allclose(
+        2 * d_array * np.sin(np.radians(TTH_ARRAY) / 2), xrd_wavelength(ENERGY), rtol=1e-12
+    )
+    np.testing.assert_allclose(xrd_convert_axis(d_array, "d", "tth", energy=ENERGY), TTH_ARRAY, rtol=1e-12)
+
+
+@pytest.mark.parametrize(
+    "from_axis, from_unit, to_axis, to_unit",
+    [
+        ("tth", "rad", "q", "A^-1"),
+        ("q", "A^-1", "d", "A"),
+        ("d", "A", "tth", "rad"),
+        ("q", "nm-1", "tth", "deg"),
+    ],
+)
+def test_conversion_units(from_axis, from_unit, to_axis, to_unit):
+    reference_dict = {
+        "tth": TTH_ARRAY,
+        "q": reference_q(TTH_ARRAY),
+        "d": 2 * np.pi / reference_q(TTH_ARRAY),
+    }
+    scale_dict = {"rad": np.pi / 180, "A^-1": 0.1, "A": 10.0, "nm-1": 1.0, "deg": 1.0}
+
+    values = reference_dict[from_axis] * scale_dict[from_unit]
+    result = xrd_convert_axis(values, from_axis, to_axis, energy=ENERGY, from_unit=from_unit, to_unit=to_unit)
+    np.testing.assert_allclose(result, reference_dict[to_axis] * scale_dict[to_unit], rtol=1e-12)
+
+
+def test_conversion_in_place():
+    values = TTH_ARRAY.copy()
+    result = xrd_convert_axis(values, "tth", "q", energy=ENERGY, out=values)
+    assert result is values
+    np.testing.assert_allclose(values, reference_q(TTH_ARRAY), rtol=1e-12)
+
+
+def test_same_unit_is_not_copied():
+    assert xrd_convert_units(TTH_ARRAY, "tth", "deg", "deg") is TTH_ARRAY
+    assert xrd_convert_axis(TTH_ARRAY, "tth", "tth") is TTH_ARRAY
+
+
+def test_unknown_axis_or_unit():
+    with pytest.raises(KeyError):
+        xrd_convert_axis(TTH_ARRAY, "tth", "energy", energy=ENERGY)
+    with pytest.raises(KeyError):
+        xrd_convert_units(TTH_ARRAY, "tth", "deg", "grad")
+
+
+def test_tth_conversion_needs_energy():
+    with pytest.raises(ValueError):
+        xrd_convert_axis(TTH_ARRAY, "tth", "q")
+
+
+def test_read_axis_units(tmp_path):
+    q_array = reference_q(TTH_ARRAY)
+    with h5py.File(tmp_path / "axis.hdf5", "w") as hdf5_file:
+        hdf5_file["q_angstrom"] = q_array / 10
+        hdf5_file["q_angstrom"].attrs["units"] = "A^-1"
+        hdf5_file["q_default"] = q_array
+
+        np.testing.assert_allclose(xrd_read_axis(hdf5_file["q_angstrom"], "q"), q_array, rtol=1e-12)
+        np.testing.assert_allclose(xrd_read_axis(hdf5_file["q_default"], "q", "A^-1"), q_array / 10, rtol=1e-12)
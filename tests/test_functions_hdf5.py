@@ -0,0 +1,132 @@
+"""
+Tests of the pooled HDF5 handles shared by the Dash callbacks: concurrent readers, writers routed around them and
+handles reopened when the file changes on disk.
+"""
+import os
+import threading
+
+import h5py
+import numpy as np
+import pytest
+
+from modules.functions.functions_hdf5 import pooled_hdf5_file, release_pooled_hdf5_file
+
+TIMEOUT = 10
+
+
+@pytest.fixture
+def hdf5_path(tmp_path):
+    hdf5_path = tmp_path / "library.hdf5"
+    with h5py.File(hdf5_path, "w") as hdf5_file:
+        hdf5_file["data"] = np.arange(10)
+    yield hdf5_path
+    release_pooled_hdf5_file(hdf5_path)
+
+
+def run_thread(target):
+    """Start target in a thread, exceptions are kept to be raised by the caller"""
+    error_list = []
+
+    def run():
+        try:
+            target()
+        except Exception as error:
+            error_list.append(error)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, error_list
+
+
+def test_concurrent_readers_share_the_handle(hdf5_path):
+    barrier = threading.Barrier(2, timeout=TIMEOUT)
+    handle_list = []
+
+    def read():
+        with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+            # Both readers are inside the file at the same time
+            barrier.wait()
+            handle_list.append(hdf5_file)
+            np.testing.assert_array_equal(hdf5_file["data"][()], np.arange(10))
+
+    thread, error_list = run_thread(read)
+    read()
+    thread.join(TIMEOUT)
+
+    assert error_list == []
+    assert handle_list[0] is handle_list[1]
+    # The handle stays open between reads
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        assert hdf5_file is handle_list[0]
+
+
+def test_writer_waits_for_readers(hdf5_path):
+    event_list = []
+    writer_waiting = threading.Event()
+
+    def write():
+        writer_waiting.set()
+        with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
+            event_list.append("write")
+            hdf5_file["data"][0] = -1
+
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        thread, error_list = run_thread(write)
+        writer_waiting.wait(TIMEOUT)
+        thread.join(0.2)
+        assert thread.is_alive()
+        event_list.append("read")
+        assert hdf5_file["data"][0] == 0
+    thread.join(TIMEOUT)
+
+    assert error_list == []
+    assert event_list == ["read", "write"]
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        assert hdf5_file["data"][0] == -1
+
+
+def test_nested_access_uses_the_write_handle(hdf5_path):
+    with pooled_hdf5_file(hdf5_path, "a") as write_file:
+        write_file["new"] = np.ones(3)
+        with pooled_hdf5_file(hdf5_path, "r") as read_file:
+            assert read_file is write_file
+            assert "new" in read_file
+        with pooled_hdf5_file(hdf5_path, "r+") as nested_file:
+            assert nested_file is write_file
+
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        assert hdf5_file.mode == "r"
+        np.testing.assert_array_equal(hdf5_file["new"][()], np.ones(3))
+
+
+def test_write_inside_read_of_same_thread(hdf5_path):
+    with pooled_hdf5_file(hdf5_path, "r"):
+        with pytest.raises(RuntimeError):
+            with pooled_hdf5_file(hdf5_path, "a"):
+                pass
+    # The refused writer left the file usable
+    with pooled_hdf5_file(hdf5_path, "a") as hdf5_file:
+        assert hdf5_file.mode == "r+"
+
+
+def test_handle_reopened_when_file_changes(hdf5_path, tmp_path):
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        first_handle = hdf5_file
+        assert "other" not in hdf5_file
+
+    # Another program replaces the library while the pooled handle is idle
+    new_path = tmp_path / "new.hdf5"
+    with h5py.File(new_path, "w") as hdf5_file:
+        hdf5_file["other"] = np.zeros(2)
+    os.replace(new_path, hdf5_path)
+
+    with pooled_hdf5_file(hdf5_path, "r") as hdf5_file:
+        assert hdf5_file is not first_handle
+        assert "other" in hdf5_file
+        assert not first_handle.id.valid
+
+
+def test_unsupported_mode(hdf5_path):
+    with pytest.raises(ValueError):
+        with pooled_hdf5_file(hdf5_path, "w"):
+            pass
@@ -0,0 +1,357 @@
+"""
+Equivalence tests of the array based MOKE data treatment and of the batched figures of merit against the original
+row by row and position by position implementations, and of the streamed shot statistics against NumPy.
+"""
+import itertools
+
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.signal import savgol_filter
+
+from modules.functions.functions_moke import (
+    MOKE_SHOT_CHANNELS,
+    abs_mean,
+    get_positions_group,
+    moke_batch_fit,
+    moke_calc_derivative_coercivity,
+    moke_calc_max_kerr_rotation,
+    moke_calc_mzero_coercivity,
+    moke_calc_reflectivity,
+    moke_calc_remanence,
+    moke_finalize_shot_statistics,
+    moke_fit_intercept,
+    moke_init_shot_statistics,
+    moke_read_shot_arrays,
+    moke_treat_measurement_dataframe,
+    moke_update_shot_statistics,
+)
+
+TREATMENT_OPTIONS = ["smoothing", "correct_offset", "filter_zero", "connect_loops", "shift_loops"]
+
+
+def make_treatment_dict(**options):
+    """Data treatment dictionary as built by callbacks_moke.store_data_treatment, every option off by default"""
+    treatment_dict = {
+        "coil_factor": 0.92667,
+        "smoothing": False,
+        "smoothing_polyorder": 1,
+        "smoothing_range": 10,
+        "correct_offset": False,
+        "filter_zero": False,
+        "connect_loops": False,
+        "pulse_voltage": 432,
+        "shift_loops": False,
+    }
+    treatment_dict.update(options)
+    return treatment_dict
+
+
+def make_synthetic_shot(length=2000, coercivity=0.3, offset=0.002, seed=0):
+    """
+    Synthetic mean shot of a hysteresis loop,
+    the first pulse sweeps the field 0 → +X → 0 and the second one 0 → -X → 0.
+
+    @return: dictionary {channel: 1D array}
+    """
+    rng = np.random.default_rng(seed)
+    half = length // 2
+    integrated_pulse = np.concatenate(
+        [-1.1 * np.sin(np.linspace(0, np.pi, half)), 0.9 * np.sin(np.linspace(0, np.pi, length - half))]
+    )
+    field = -integrated_pulse
+    branch = np.where(np.arange(length) < half, coercivity, -coercivity)
+    magnetization = 0.01 * np.tanh(4 * (field + branch)) + offset + rng.normal(0, 2e-4, length)
+    return {
+        "magnetization": magnetization,
+        "pulse": np.gradient(integrated_pulse),
+        "reflectivity": 1.5 + rng.normal(0, 1e-3, length),
+        "integrated_pulse": integrated_pulse,
+    }
+
+
+def moke_treat_measurement_dataframe_reference(measurement_df, options_dict):
+    """
+    Row by row pandas implementation of the data treatment, as it was before moke_treat_measurement_arrays.
+    """
+    coil_factor = float(options_dict["coil_factor"])
+    pulse_voltage = float(options_dict["pulse_voltage"])
+    smoothing = options_dict["smoothing"]
+    smoothing_polyorder = int(options_dict["smoothing_polyorder"])
+    smoothing_range = int(options_dict["smoothing_range"])
+    correct_offset = options_dict["correct_offset"]
+    filter_zero = options_dict["filter_zero"]
+    connect_loops = options_dict["connect_loops"]
+    shift_loops = options_dict["shift_loops"]
+
+    # Set field using coil parameters
+    midpoint = len(measurement_df) // 2
+    max_field = pulse_voltage * coil_factor / 100
+
+    measurement_df.loc[:midpoint, "field"] = measurement_df.loc[
+        :midpoint, "integrated_pulse"
+    ].apply(lambda x: -x * max_field / np.abs(measurement_df["integrated_pulse"].min()))
+    measurement_df.loc[midpoint:, "field"] = measurement_df.loc[
+        midpoint:, "integrated_pulse"
+    ].apply(lambda x: -x * max_field / np.abs(measurement_df["integrated_pulse"].max()))
+
+    # Vertically center the loop
+    if correct_offset:
+        magnetization_offset = measurement_df["magnetization"].mean()
+        measurement_df.loc[:, "magnetization"] = measurement_df.loc[
+            :, "magnetization"
+        ].apply(lambda x: x - magnetization_offset)
+
+    # Shift loops
+    if shift_loops:
+        measurement_df = measurement_df[measurement_df["field"].notna()].copy()
+
+        midpoint = len(measurement_df) // 2
+        first_pulse = measurement_df.iloc[:midpoint]  # 0 → -X → 0
+        second_pulse = measurement_df.iloc[midpoint:]  # 0 → +X → 0
+
+        average_shift = (
+            second_pulse["magnetization"][:300].mean()
+            - first_pulse["magnetization"][700:].mean()
+        )
+
+        measurement_df.loc[midpoint:, "magnetization"] = measurement_df.loc[
+            midpoint:, "magnetization"
+        ].apply(lambda x: x - average_shift / 2)
+
+        measurement_df.loc[:midpoint, "magnetization"] = measurement_df.loc[
+            :midpoint, "magnetization"
+        ].apply(lambda x: x + average_shift / 2)
+
+    # Remove oddities around H=0 by forcing points in the positive(negative) loop to be over(under) a threshold
+    if filter_zero:
+        length = len(measurement_df)
+        measurement_df = measurement_df[measurement_df["field"].notna()].copy()
+
+        measurement_df.loc[: length // 2, "field"] = measurement_df.loc[
+            : length // 2, "field"
+        ].where(measurement_df["field"] > 1e-2)
+        measurement_df.loc[length // 2 :, "field"] = measurement_df.loc[
+            length // 2 :, "field"
+        ].where(measurement_df["field"] < -1e-2)
+
+    if connect_loops:
+        measurement_df = measurement_df[measurement_df["field"].notna()]
+
+        midpoint = len(measurement_df) // 2
+        first_pulse = measurement_df.iloc[:midpoint]  # 0 → -X → 0
+        second_pulse = measurement_df.iloc[midpoint:]  # 0 → +X → 0
+
+        # Rearrange: +X → 0 → -X → 0 → +X (start from end of second pulse), then duplicate the first point
+        reordered = pd.concat([second_pulse, first_pulse], ignore_index=True)
+        if len(reordered) >= 1:
+            reordered = pd.concat([reordered, reordered.iloc[:1]], ignore_index=True)
+
+        measurement_df = reordered
+
+    # Smoothing
+    if smoothing:
+        measurement_df.loc[:, "magnetization"] = savgol_filter(
+            measurement_df["magnetization"], smoothing_range, smoothing_polyorder
+        )
+
+    return measurement_df
+
+
+def assert_same_treatment(reference_df, treated_df):
+    assert list(treated_df.columns) == list(reference_df.columns)
+    assert np.array_equal(treated_df.index.to_numpy(), reference_df.index.to_numpy())
+    np.testing.assert_allclose(
+        treated_df.to_numpy(dtype="float"), reference_df.to_numpy(dtype="float"), rtol=1e-12, atol=1e-12
+    )
+
+
+@pytest.mark.parametrize("enabled", list(itertools.product([False, True], repeat=len(TREATMENT_OPTIONS))))
+def test_treatment_matches_reference(enabled):
+    treatment_dict = make_treatment_dict(**dict(zip(TREATMENT_OPTIONS, enabled)))
+    measurement_df = pd.DataFrame(make_synthetic_shot())
+
+    reference_df = moke_treat_measurement_dataframe_reference(measurement_df.copy(), treatment_dict)
+    treated_df = moke_treat_measurement_dataframe(measurement_df.copy(), treatment_dict)
+
+    assert_same_treatment(reference_df, treated_df)
+
+
+@pytest.mark.parametrize("length", [11, 2001])
+def test_treatment_matches_reference_odd_length(length):
+    treatment_dict = make_treatment_dict(correct_offset=True, filter_zero=True, connect_loops=True, shift_loops=True)
+    measurement_df = pd.DataFrame(make_synthetic_shot(length=length, seed=1))
+
+    reference_df = moke_treat_measurement_dataframe_reference(measurement_df.copy(), treatment_dict)
+    treated_df = moke_treat_measurement_dataframe(measurement_df.copy(), treatment_dict)
+
+    assert_same_treatment(reference_df, treated_df)
+
+
+def test_treatment_rejects_incomplete_dictionary():
+    measurement_df = pd.DataFrame(make_synthetic_shot(length=20))
+    with pytest.raises(KeyError):
+        moke_treat_measurement_dataframe(measurement_df, {"coil_factor": 1.0})
+
+
+def moke_batch_fit_reference(moke_group, treatment_dict):
+    """
+    Position by position implementation of moke_batch_fit, as it was before moke_batch_figures_of_merit.
+    """
+    results_dict = {}
+    positions_group = get_positions_group(moke_group)
+    for position, position_group in positions_group.items():
+        if "scan_parameters" in position:
+            continue
+
+        measurement_group = position_group.get("measurement")
+        measurement_dataframe = pd.DataFrame(moke_read_shot_arrays(measurement_group, 0))
+        measurement_dataframe = moke_treat_measurement_dataframe(measurement_dataframe, treatment_dict)
+
+        max_kerr_rotation = moke_calc_max_kerr_rotation(measurement_dataframe)
+        reflectivity = moke_calc_reflectivity(measurement_dataframe)
+        coercivity_m0 = list(moke_calc_mzero_coercivity(measurement_dataframe))
+        coercivity_dmdh = list(moke_calc_derivative_coercivity(measurement_dataframe))
+        intercepts = list(moke_fit_intercept(measurement_dataframe, treatment_dict))
+        remanence = list(moke_calc_remanence(measurement_dataframe))
+
+        results_dict[f"{position}"] = {
+            "max_kerr_signal": max_kerr_rotation,
+            "reflectivity": reflectivity,
+            "coercivity_m0": {
+                "positive": coercivity_m0[0],
+                "negative": coercivity_m0[1],
+                "mean": abs_mean(coercivity_m0),
+            },
+            "coercivity_dmdh": {
+                "positive": coercivity_dmdh[0],
+                "negative": coercivity_dmdh[1],
+                "mean": abs_mean(coercivity_dmdh),
+            },
+            "intercept_field": {
+                "positive": intercepts[0],
+                "negative": intercepts[1],
+                "mean": abs_mean(intercepts[:2]),
+                "fit_parameters": intercepts[2],
+            },
+            "remanent_kerr_signal": {
+                "positive": remanence[0] / max_kerr_rotation,
+                "negative": remanence[1] / max_kerr_rotation,
+                "mean": abs_mean([remanence[0] / max_kerr_rotation, remanence[1] / max_kerr_rotation]),
+            },
+        }
+
+    return results_dict
+
+
+def assert_same_results(reference, batched, path="results"):
+    if isinstance(reference, dict):
+        assert set(batched) == set(reference), path
+        for key in reference:
+            assert_same_results(reference[key], batched[key], f"{path}/{key}")
+    else:
+        np.testing.assert_allclose(
+            np.asarray(batched, dtype="float"), np.asarray(reference, dtype="float"), rtol=1e-9, atol=1e-12,
+            err_msg=path,
+        )
+
+
+@pytest.fixture
+def moke_group(tmp_path):
+    """Small MOKE dataset group, one mean shot per position, the last position has no loop"""
+    parameters = [(0.3, 0.002, 0.01), (0.5, -0.001, 0.02), (0.1, 0.0, 0.005), (0.4, 0.0, 0.0005)]
+    with h5py.File(tmp_path / "moke.hdf5", "w") as hdf5_file:
+        positions_group = hdf5_file.create_group("moke/positions")
+        for i, (coercivity, offset, amplitude) in enumerate(parameters):
+            shot = make_synthetic_shot(coercivity=coercivity, offset=offset, seed=i)
+            shot["magnetization"] = shot["magnetization"] * amplitude / 0.01
+            mean_shot_group = positions_group.create_group(f"({i}.0,{-i}.0)/measurement/shot_mean")
+            for channel in MOKE_SHOT_CHANNELS:
+                mean_shot_group.create_dataset(f"{channel}_mean", data=shot[channel])
+        positions_group.create_group("scan_parameters")
+        yield hdf5_file["moke"]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"correct_offset": True, "smoothing": True},
+        {"correct_offset": True, "filter_zero": True, "connect_loops": True},
+    ],
+)
+def test_batch_fit_matches_reference(moke_group, options):
+    treatment_dict = make_treatment_dict(**options)
+
+    reference_dict = moke_batch_fit_reference(moke_group, treatment_dict)
+    batched_dict = moke_batch_fit(moke_group, treatment_dict)
+
+    assert list(batched_dict) == list(reference_dict)
+    assert_same_results(reference_dict, batched_dict)
+
+
+def test_batch_fit_position_subset(moke_group):
+    treatment_dict = make_treatment_dict(correct_offset=True)
+    position_list = ["(2.0,-2.0)", "(0.0,0.0)"]
+
+    reference_dict = moke_batch_fit_reference(moke_group, treatment_dict)
+    batched_dict = moke_batch_fit(moke_group, treatment_dict, position_list)
+
+    assert list(batched_dict) == position_list
+    assert_same_results({position: reference_dict[position] for position in position_list}, batched_dict)
+
+
+def make_shot_stack(nb_shots, length=500, seed=0):
+    """Stacked shots, dictionary {channel: 2D array (shots x samples)} with a drift of the magnetization"""
+    rng = np.random.default_rng(seed)
+    shot = make_synthetic_shot(length=length, seed=seed)
+    drift = 1e-4 * np.arange(nb_shots)[:, None]
+    shot_stack = {
+        channel: values[None, :] + rng.normal(0, 1e-3, (nb_shots, length)) for channel, values in shot.items()
+    }
+    shot_stack["magnetization"] += drift
+    return shot_stack
+
+
+def stream_shot_statistics(shot_stack):
+    nb_shots, length = shot_stack["magnetization"].shape
+    statistics_dict = moke_init_shot_statistics(length)
+    for i in range(nb_shots):
+        moke_update_shot_statistics(statistics_dict, {channel: values[i] for channel, values in shot_stack.items()})
+    return moke_finalize_shot_statistics(statistics_dict)
+
+
+@pytest.mark.parametrize("nb_shots", [2, 10, 100])
+def test_shot_statistics_match_numpy(nb_shots):
+    shot_stack = make_shot_stack(nb_shots)
+    statistics = stream_shot_statistics(shot_stack)
+
+    for channel, values in shot_stack.items():
+        np.testing.assert_allclose(statistics["mean"][channel], np.mean(values, axis=0), rtol=1e-10, atol=1e-15)
+        np.testing.assert_allclose(statistics["std"][channel], np.std(values, axis=0, ddof=1), rtol=1e-8, atol=1e-15)
+
+    metrics = statistics["metrics"]
+    magnetization_std = np.std(shot_stack["magnetization"], axis=0, ddof=1)
+    magnetization_mean = np.mean(shot_stack["magnetization"], axis=0)
+    assert metrics["magnetization_noise"] == pytest.approx(np.mean(magnetization_std))
+    assert metrics["reflectivity_noise"] == pytest.approx(np.mean(np.std(shot_stack["reflectivity"], axis=0, ddof=1)))
+    assert metrics["snr"] == pytest.approx(np.ptp(magnetization_mean) / 2 / np.mean(magnetization_std))
+    assert metrics["magnetization_drift"] == pytest.approx(
+        np.polyfit(np.arange(nb_shots), np.mean(shot_stack["magnetization"], axis=1), 1)[0]
+    )
+
+
+def test_shot_statistics_large_offset():
+    # The running update does not lose precision on a large constant level, as the sum of squares would
+    shot_stack = {channel: values + 1e6 for channel, values in make_shot_stack(20).items()}
+    statistics = stream_shot_statistics(shot_stack)
+    for channel, values in shot_stack.items():
+        np.testing.assert_allclose(statistics["std"][channel], np.std(values, axis=0, ddof=1), rtol=1e-5)
+
+
+def test_shot_statistics_single_shot():
+    statistics = stream_shot_statistics(make_shot_stack(1))
+    assert np.all(np.isnan(statistics["std"]["magnetization"]))
+    assert np.isnan(statistics["metrics"]["magnetization_drift"])
+    assert np.isnan(statistics["metrics"]["snr"])
@@ -0,0 +1,223 @@
+"""
+Tests of the position table persisted in the dataset groups, of the coordinate lookups built from it and of the
+server-side results store.
+"""
+import os
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+
+from modules.functions import functions_shared
+from modules.functions.functions_hdf5 import release_pooled_hdf5_file
+from modules.functions.functions_shared import (
+    POSITION_INDEX_GROUP,
+    get_position_index,
+    get_position_table,
+    get_results_dataframe,
+    get_target_position_group,
+    make_coordinates_dataframe,
+    put_results_dataframe,
+    read_position_table,
+    register_results_builder,
+    scan_position_table,
+    write_position_table,
+)
+
+COORDINATE_LIST = [(-20.0, -20.0), (-20.0, 0.0), (0.0, 0.0), (0.0, 5.0), (12.5, -7.5)]
+
+
+def add_position(positions_group, x_pos, y_pos, index, ignored=False):
+    position_group = positions_group.create_group(f"({x_pos},{y_pos})")
+    position_group.attrs["index"] = index
+    position_group.attrs["ignored"] = ignored
+    instrument_group = position_group.create_group("instrument")
+    instrument_group["x_pos"] = x_pos
+    instrument_group["y_pos"] = y_pos
+    return position_group
+
+
+@pytest.fixture
+def hdf5_path(tmp_path):
+    """Library with a single dataset and a few positions, the last one ignored, and an alignment scan"""
+    hdf5_path = tmp_path / "library.hdf5"
+    with h5py.File(hdf5_path, "w") as hdf5_file:
+        positions_group = hdf5_file.create_group("edx/positions")
+        for i, (x_pos, y_pos) in enumerate(COORDINATE_LIST):
+            add_position(positions_group, x_pos, y_pos, i + 1, ignored=i == len(COORDINATE_LIST) - 1)
+        positions_group.create_group("alignment_scans")
+    return hdf5_path
+
+
+def test_scan_position_table(hdf5_path):
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        position_table = scan_position_table(hdf5_file["edx"])
+
+    assert position_table["name"] == [f"({x},{y})" for x, y in COORDINATE_LIST]
+    np.testing.assert_array_equal(position_table["x_pos"], [x for x, _ in COORDINATE_LIST])
+    np.testing.assert_array_equal(position_table["y_pos"], [y for _, y in COORDINATE_LIST])
+    assert position_table["index"] == [str(i + 1) for i in range(len(COORDINATE_LIST))]
+    np.testing.assert_array_equal(position_table["ignored"], [False, False, False, False, True])
+
+
+def test_position_table_round_trip(hdf5_path):
+    with h5py.File(hdf5_path, "a") as hdf5_file:
+        position_table = scan_position_table(hdf5_file["edx"])
+        assert write_position_table(hdf5_file["edx"])
+
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        read_table = read_position_table(hdf5_file["edx"])
+
+    assert read_table["name"] == position_table["name"]
+    assert read_table["index"] == position_table["index"]
+    for column in ["x_pos", "y_pos", "ignored"]:
+        np.testing.assert_array_equal(read_table[column], position_table[column])
+
+
+def test_position_table_is_not_written_read_only(hdf5_path):
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        assert not write_position_table(hdf5_file["edx"])
+        assert read_position_table(hdf5_file["edx"]) is None
+
+
+def test_get_position_table_does_not_write(hdf5_path):
+    with h5py.File(hdf5_path, "a") as hdf5_file:
+        position_table = get_position_table(hdf5_file["edx"])
+        assert read_position_table(hdf5_file["edx"]) is None
+        write_position_table(hdf5_file["edx"])
+        assert get_position_table(hdf5_file["edx"])["name"] == position_table["name"]
+
+
+def test_stale_position_table_is_ignored(hdf5_path):
+    with h5py.File(hdf5_path, "a") as hdf5_file:
+        write_position_table(hdf5_file["edx"])
+        add_position(hdf5_file["edx/positions"], 30.0, 30.0, 99)
+        assert read_position_table(hdf5_file["edx"]) is None
+
+
+@pytest.mark.parametrize(
+    "target, expected",
+    [
+        ((0.0, 5.0), "(0.0,5.0)"),
+        ((0.004, 4.996), "(0.0,5.0)"),
+        ((12.509, -7.491), "(12.5,-7.5)"),
+        ((-20.0, -0.01), "(-20.0,0.0)"),
+    ],
+)
+def test_target_position_within_tolerance(hdf5_path, target, expected):
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        position_group = get_target_position_group(hdf5_file["edx"], *target)
+        assert position_group.name == f"/edx/positions/{expected}"
+
+
+@pytest.mark.parametrize("target", [(0.0, 5.02), (0.011, 0.0), (50.0, 50.0)])
+def test_target_position_outside_tolerance(hdf5_path, target):
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        with pytest.raises(KeyError):
+            get_target_position_group(hdf5_file["edx"], *target)
+
+
+def test_target_position_custom_tolerance(hdf5_path):
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        position_group = get_target_position_group(hdf5_file["edx"], 0.4, 4.7, tolerance=0.5)
+        assert position_group.name == "/edx/positions/(0.0,5.0)"
+
+
+def test_target_position_closest(hdf5_path):
+    # Two positions 5 mm apart, the closest one within the tolerance wins
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        position_group = get_target_position_group(hdf5_file["edx"], 0.0, 3.0, tolerance=4.0)
+        assert position_group.name == "/edx/positions/(0.0,5.0)"
+
+
+def test_position_lookup_never_writes(hdf5_path):
+    with h5py.File(hdf5_path, "a") as hdf5_file:
+        get_target_position_group(hdf5_file["edx"], 0.0, 0.0)
+        assert POSITION_INDEX_GROUP not in hdf5_file["edx"]
+
+
+def test_position_index_follows_added_positions(hdf5_path):
+    with h5py.File(hdf5_path, "a") as hdf5_file:
+        get_position_index(hdf5_file["edx"])
+        add_position(hdf5_file["edx/positions"], 30.0, 30.0, 99)
+        position_group = get_target_position_group(hdf5_file["edx"], 30.0, 30.0)
+        assert position_group.name == "/edx/positions/(30.0,30.0)"
+
+
+@pytest.fixture
+def results_store(tmp_path, monkeypatch):
+    """Empty results store of two entries spilling to the temporary folder, with a builder counting its calls"""
+    monkeypatch.setattr(functions_shared, "_results_store", OrderedDict())
+    monkeypatch.setattr(functions_shared, "_results_grid_cache", {})
+    monkeypatch.setitem(functions_shared._results_store_config, "max_entries", 2)
+    monkeypatch.setitem(functions_shared._results_store_config, "spill_dir", str(tmp_path / "spill"))
+    os.makedirs(tmp_path / "spill")
+    monkeypatch.setattr(functions_shared, "RESULTS_DATAFRAME_BUILDERS", {})
+
+    call_list = []
+
+    def build_coordinates(dataset_group, wafer_only=True):
+        call_list.append(wafer_only)
+        return make_coordinates_dataframe(dataset_group, wafer_only=wafer_only)
+
+    register_results_builder("coordinates", build_coordinates)
+    return call_list
+
+
+def make_results_df(seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        {"x_pos (mm)": rng.normal(size=4), "ignored": [False, True, False, False], "label": list("abcd")},
+        index=[f"({i}.0,0.0)" for i in range(4)],
+    )
+
+
+def test_results_store_returns_copies(results_store):
+    df = make_results_df(0)
+    token = put_results_dataframe(df)
+    read_df = get_results_dataframe(token)
+    read_df["x_pos (mm)"] = 0.0
+    pd.testing.assert_frame_equal(get_results_dataframe(token), df)
+    assert get_results_dataframe("unknown") is None
+    assert get_results_dataframe(None) is None
+
+
+def test_results_store_spills_evicted_dataframes(results_store, tmp_path):
+    df_list = [make_results_df(seed) for seed in range(3)]
+    token_list = [put_results_dataframe(df) for df in df_list]
+
+    # The oldest dataframe left the memory for a Feather file, index and dtypes included
+    assert os.listdir(tmp_path / "spill") == [f"{token_list[0]}.feather"]
+    pd.testing.assert_frame_equal(get_results_dataframe(token_list[0]), df_list[0])
+    # Reading it back moves it to memory and evicts the next oldest one
+    assert os.listdir(tmp_path / "spill") == [f"{token_list[1]}.feather"]
+    for token, df in zip(token_list, df_list):
+        pd.testing.assert_frame_equal(get_results_dataframe(token), df)
+    assert results_store == []
+
+
+def test_results_store_rebuilds_tokens(results_store, hdf5_path, monkeypatch):
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        df = make_coordinates_dataframe(hdf5_file["edx"], wafer_only=False)
+    token = put_results_dataframe(
+        df, builder="coordinates", hdf5_path=hdf5_path, dataset_name="edx", builder_kwargs={"wafer_only": False}
+    )
+
+    # Token of a dataframe evicted without spill or stored by another server worker
+    monkeypatch.setitem(functions_shared._results_store_config, "spill_dir", None)
+    functions_shared._results_store.clear()
+    pd.testing.assert_frame_equal(get_results_dataframe(token), df)
+    assert results_store == [False]
+    # The rebuilt dataframe is kept in the store
+    pd.testing.assert_frame_equal(get_results_dataframe(token), df)
+    assert results_store == [False]
+    release_pooled_hdf5_file(hdf5_path)
+
+    functions_shared._results_store.clear()
+    missing_token = token.replace('"edx"', '"missing"')
+    assert get_results_dataframe(missing_token) is None
+    release_pooled_hdf5_file(hdf5_path)
+    os.remove(hdf5_path)
+    assert get_results_dataframe(token) is None
@@ -0,0 +1,484 @@
+"""
+Tests of the XRD frame percentiles against np.percentile, of the frame reductions and peak table persisted in the
+dataset groups and of the reintegration and bulk export of a dataset on pools of spawned processes.
+"""
+import os
+import tarfile
+import zipfile
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pandas as pd
+import pyFAI
+import pytest
+
+from modules.functions import functions_xrd
+from modules.functions.functions_xrd import (
+    XRD_EXPORT_ARCHIVES,
+    XRD_EXPORT_MANIFEST,
+    XRD_FRAME_REDUCTIONS_GROUP,
+    XRD_FRAME_REDUCTIONS_UNITS,
+    XRD_PEAK_TABLE_GROUP,
+    XRD_PEAK_TABLE_UNITS,
+    xrd_detect_dataset_peaks,
+    xrd_engine_key,
+    xrd_export_dataset,
+    xrd_find_pattern_peaks,
+    xrd_get_peak_table,
+    xrd_get_reintegration_progress,
+    xrd_integer_percentiles,
+    xrd_integrate_stack,
+    xrd_integrate_with_persisted_engine,
+    xrd_make_analysis_dataframe_from_hdf5,
+    xrd_read_export_manifest,
+    xrd_read_frame_reductions,
+    xrd_read_peak_table,
+    xrd_reintegrate_dataset_parallel,
+    xrd_set_reintegration_progress,
+    xrd_write_dataset_reductions,
+    xrd_write_peak_table,
+)
+from modules.hdf5_compilers.hdf5compile_xrd import update_xrd_hdf5
+
+PERCENTILES = [0, 0.1, 25, 50, 99, 99.9, 100]
+
+
+@pytest.mark.parametrize("dtype", ["uint8", "uint16", "int32", "int64"])
+def test_integer_percentiles_match_numpy(dtype):
+    rng = np.random.default_rng(0)
+    image = rng.poisson(5, (217, 103)).astype(dtype)
+    image[::17, ::13] = np.iinfo(dtype).max if dtype in ["uint8", "uint16"] else 60000
+    np.testing.assert_allclose(xrd_integer_percentiles(image, PERCENTILES), np.percentile(image, PERCENTILES))
+
+
+def test_integer_percentiles_negative_values():
+    image = np.random.default_rng(1).integers(-500, 500, (64, 64))
+    np.testing.assert_allclose(xrd_integer_percentiles(image, PERCENTILES), np.percentile(image, PERCENTILES))
+
+
+def test_integer_percentiles_constant_and_single_pixel():
+    np.testing.assert_allclose(xrd_integer_percentiles(np.full((8, 8), 7), PERCENTILES), 7)
+    np.testing.assert_allclose(xrd_integer_percentiles(np.array([[3]]), PERCENTILES), 3)
+
+
+def test_integer_percentiles_beyond_histogram(monkeypatch):
+    # Values spread over more bins than the histogram has are clipped, percentiles landing there fall back to numpy
+    monkeypatch.setattr(functions_xrd, "XRD_PERCENTILE_HISTOGRAM_BINS", 64)
+    image = np.random.default_rng(2).poisson(20, (100, 100))
+    image[0, :50] = np.arange(1000, 1050)
+    np.testing.assert_allclose(xrd_integer_percentiles(image, PERCENTILES), np.percentile(image, PERCENTILES))
+
+
+def make_pattern(peak_list, points=1000):
+    """Integrated pattern with Gaussian peaks (q center in nm^-1, height, sigma in nm^-1) on a flat background"""
+    q_array = np.linspace(10, 60, points)
+    tth_array = np.linspace(12, 75, points)
+    counts = np.full(points, 10.0)
+    for center, height, sigma in peak_list:
+        counts += height * np.exp(-((q_array - center) ** 2) / (2 * sigma**2))
+    return counts, q_array, tth_array
+
+
+PEAK_LISTS = [
+    [(20.0, 100.0, 0.2), (30.0, 50.0, 0.3)],
+    [(25.0, 80.0, 0.25)],
+    [],
+    [(15.0, 40.0, 0.2), (35.0, 200.0, 0.4), (40.0, 20.0, 0.2)],
+]
+
+
+def test_find_pattern_peaks():
+    peak_list = PEAK_LISTS[0]
+    counts, q_array, tth_array = make_pattern(peak_list)
+    peaks_dict = xrd_find_pattern_peaks(counts, q_array, tth_array)
+
+    assert set(peaks_dict) == set(XRD_PEAK_TABLE_UNITS)
+    np.testing.assert_allclose(peaks_dict["q"], [center for center, _, _ in peak_list], atol=0.05)
+    np.testing.assert_allclose(peaks_dict["prominence"], [height for _, height, _ in peak_list], rtol=1e-2)
+    # Full width at half maximum of a Gaussian
+    np.testing.assert_allclose(
+        peaks_dict["fwhm_q"], [2 * np.sqrt(2 * np.log(2)) * sigma for _, _, sigma in peak_list], rtol=2e-2
+    )
+
+
+@pytest.fixture
+def hdf5_path(tmp_path):
+    """XRD dataset with integrated patterns, a position without pattern and an alignment scan"""
+    hdf5_path = tmp_path / "library.hdf5"
+    with h5py.File(hdf5_path, "w") as hdf5_file:
+        positions_group = hdf5_file.create_group("xrd/positions")
+        for i, peak_list in enumerate(PEAK_LISTS):
+            position_group = positions_group.create_group(f"({i}.0,0.0)")
+            position_group.attrs["index"] = i + 1
+            counts, q_array, tth_array = make_pattern(peak_list)
+            integrated_group = position_group.create_group("measurement/integrated")
+            integrated_group["counts"] = counts
+            integrated_group["q"] = q_array
+            integrated_group["tth"] = tth_array
+        positions_group.create_group("(9.0,9.0)/measurement")
+        positions_group.create_group("alignment_scans")
+    return hdf5_path
+
+
+def test_peak_table_round_trip(hdf5_path):
+    with h5py.File(hdf5_path, "a") as hdf5_file:
+        peak_table = xrd_detect_dataset_peaks(hdf5_file["xrd"])
+        assert xrd_write_peak_table(hdf5_file["xrd"]) == sum(len(peak_list) for peak_list in PEAK_LISTS)
+
+    assert peak_table["n_positions"] == len(PEAK_LISTS)
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        assert hdf5_file[f"xrd/{XRD_PEAK_TABLE_GROUP}/q"].attrs["units"] == "nm^-1"
+        peak_df = xrd_read_peak_table(hdf5_file["xrd"])
+
+    assert list(peak_df["position"]) == list(peak_table["position"])
+    assert list(peak_df["index"]) == [str(index) for index in peak_table["index"]]
+    for key in XRD_PEAK_TABLE_UNITS:
+        np.testing.assert_array_equal(peak_df[key].to_numpy(), peak_table[key])
+    peak_counts = [len(peak_list) for peak_list in PEAK_LISTS if peak_list]
+    assert list(peak_df.groupby("position", sort=False).size()) == peak_counts
+
+
+def test_peak_table_other_settings_is_ignored(hdf5_path, monkeypatch):
+    with h5py.File(hdf5_path, "a") as hdf5_file:
+        xrd_write_peak_table(hdf5_file["xrd"])
+    monkeypatch.setattr(functions_xrd, "XRD_PEAK_PROMINENCE", 10.0)
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        assert xrd_read_peak_table(hdf5_file["xrd"]) is None
+
+
+def test_get_peak_table_is_read_only(hdf5_path, monkeypatch):
+    with h5py.File(hdf5_path, "a") as hdf5_file:
+        peak_df = xrd_get_peak_table(hdf5_file["xrd"])
+        assert peak_df.empty and list(peak_df.columns) == ["position", "index", *XRD_PEAK_TABLE_UNITS]
+        assert XRD_PEAK_TABLE_GROUP not in hdf5_file["xrd"]
+
+        # The table is built once by the update
+        assert update_xrd_hdf5(hdf5_file["xrd"])
+        assert not update_xrd_hdf5(hdf5_file["xrd"])
+        peak_table = xrd_detect_dataset_peaks(hdf5_file["xrd"])
+
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        peak_df = xrd_get_peak_table(hdf5_file["xrd"])
+    assert list(peak_df["position"]) == list(peak_table["position"])
+    np.testing.assert_array_equal(peak_df["q"].to_numpy(), peak_table["q"])
+
+    # A table found with other settings is only detected again by the update
+    monkeypatch.setattr(functions_xrd, "XRD_PEAK_PROMINENCE", 10.0)
+    with h5py.File(hdf5_path, "a") as hdf5_file:
+        assert xrd_get_peak_table(hdf5_file["xrd"]).empty
+        assert update_xrd_hdf5(hdf5_file["xrd"])
+        assert hdf5_file[f"xrd/{XRD_PEAK_TABLE_GROUP}"].attrs["prominence"] == 10.0
+
+
+IMAGE_SHAPE = (48, 40)
+NB_IMAGES = 5
+POINTS = 30
+
+
+@pytest.fixture(scope="module")
+def poni_path(tmp_path_factory):
+    """PONI file of a small detector"""
+    from pyFAI.detectors import Detector
+    from pyFAI.integrator.azimuthal import AzimuthalIntegrator
+
+    poni_path = tmp_path_factory.mktemp("poni") / "geometry.poni"
+    detector = Detector(pixel1=1e-4, pixel2=1e-4, max_shape=IMAGE_SHAPE)
+    poni = AzimuthalIntegrator(dist=0.03, poni1=0.0024, poni2=0.002, rot1=0.05, detector=detector, wavelength=1.54e-10)
+    poni.save(str(poni_path))
+    return poni_path
+
+
+def make_images(nb_images=NB_IMAGES, seed=0):
+    """Integer detector images with a ring of a different radius on each image"""
+    rng = np.random.default_rng(seed)
+    rows, columns = np.indices(IMAGE_SHAPE)
+    radius = np.hypot(rows - 24, columns - 20)
+    return np.stack(
+        [
+            (rng.poisson(20, IMAGE_SHAPE) + 500 * np.exp(-((radius - 8 - 2 * i) ** 2) / 4)).astype("uint32")
+            for i in range(nb_images)
+        ]
+    )
+
+
+@pytest.fixture
+def image_library_path(tmp_path, monkeypatch):
+    """XRD dataset with a detector image per position, engines and progress are kept in the temporary folder"""
+    monkeypatch.setattr(functions_xrd, "XRD_ENGINE_CACHE_FOLDER", str(tmp_path / "engines"))
+    monkeypatch.setattr(functions_xrd, "XRD_REINTEGRATION_PROGRESS_FOLDER", str(tmp_path / "progress"))
+    functions_xrd.xrd_clear_engine_memory()
+
+    hdf5_path = tmp_path / "images.hdf5"
+    with h5py.File(hdf5_path, "w") as hdf5_file:
+        positions_group = hdf5_file.create_group("xrd/positions")
+        for i, image in enumerate(make_images()):
+            position_group = positions_group.create_group(f"({i}.0,{-i}.0)")
+            position_group.attrs["index"] = i + 1
+            position_group.attrs["ignored"] = False
+            instrument_group = position_group.create_group("instrument")
+            instrument_group["x_pos"] = float(i)
+            instrument_group["y_pos"] = float(-i)
+            position_group.create_group("measurement")["2Dimage"] = image
+        positions_group.create_group("alignment_scans")
+    return hdf5_path
+
+
+def read_integrated(hdf5_path):
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        positions_group = hdf5_file["xrd/positions"]
+        return {
+            position: {key: positions_group[position][f"measurement/integrated/{key}"][()] for key in ["q", "counts"]}
+            for position in positions_group
+            if position != "alignment_scans"
+        }
+
+
+def assert_same_integrated(reference_dict, integrated_dict, rtol=1e-10):
+    assert list(integrated_dict) == list(reference_dict)
+    for position, reference in reference_dict.items():
+        for key, array in reference.items():
+            np.testing.assert_allclose(integrated_dict[position][key], array, rtol=rtol, err_msg=f"{position} {key}")
+
+
+@pytest.mark.parametrize("method", ["no_csr_cython", "persisted_csr"])
+def test_reintegration_on_process_pool(image_library_path, poni_path, method):
+    progress_list = []
+
+    def progress_callback(done, total, frames_per_second):
+        progress_list.append((done, total))
+        xrd_set_reintegration_progress(image_library_path, "xrd", done, total, frames_per_second)
+
+    summary = xrd_reintegrate_dataset_parallel(
+        image_library_path, "xrd", poni_path, "integrate1d", POINTS, method=method, workers=1
+    )
+    serial_dict = read_integrated(image_library_path)
+    pooled_summary = xrd_reintegrate_dataset_parallel(
+        image_library_path, "xrd", poni_path, "integrate1d", POINTS, method=method, workers=2, write_batch=2,
+        progress_callback=progress_callback,
+    )
+
+    assert summary["frames"] == pooled_summary["frames"] == NB_IMAGES
+    assert_same_integrated(serial_dict, read_integrated(image_library_path))
+    assert progress_list[0] == (0, NB_IMAGES) and progress_list[-1] == (NB_IMAGES, NB_IMAGES)
+    assert xrd_get_reintegration_progress(image_library_path, "xrd")["done"] == NB_IMAGES
+
+
+@pytest.fixture
+def integrated_library_path(image_library_path, poni_path):
+    xrd_reintegrate_dataset_parallel(
+        image_library_path, "xrd", poni_path, "integrate1d", POINTS, method="no_csr_cython", workers=1
+    )
+    return image_library_path
+
+
+def forbid_frame_reductions(monkeypatch):
+    def reduce_position(position_group, image=None):
+        raise AssertionError(f"frame of {position_group.name} read on the read path")
+
+    monkeypatch.setattr(functions_xrd, "xrd_reduce_position", reduce_position)
+
+
+def test_reintegration_records_reductions(integrated_library_path, monkeypatch):
+    with h5py.File(integrated_library_path, "r") as hdf5_file:
+        positions_group = hdf5_file["xrd/positions"]
+        reductions_list = [
+            xrd_read_frame_reductions(positions_group[position]["measurement"])
+            for position in positions_group
+            if position != "alignment_scans"
+        ]
+    assert all(list(reductions_dict) == list(XRD_FRAME_REDUCTIONS_UNITS) for reductions_dict in reductions_list)
+
+    # Analysis maps only read the recorded reductions, never the frames
+    forbid_frame_reductions(monkeypatch)
+    with h5py.File(integrated_library_path, "r") as hdf5_file:
+        analysis_df = xrd_make_analysis_dataframe_from_hdf5(hdf5_file["xrd"])
+    assert len(analysis_df) == NB_IMAGES
+    for index, reductions_dict in enumerate(reductions_list):
+        for key, value in reductions_dict.items():
+            assert analysis_df[key][index] == value
+
+
+def test_update_records_missing_reductions(integrated_library_path, monkeypatch):
+    with h5py.File(integrated_library_path, "a") as hdf5_file:
+        positions_group = hdf5_file["xrd/positions"]
+        for position in positions_group:
+            if position != "alignment_scans":
+                del positions_group[position]["measurement"][XRD_FRAME_REDUCTIONS_GROUP]
+
+    with monkeypatch.context() as read_patch, h5py.File(integrated_library_path, "r") as hdf5_file:
+        forbid_frame_reductions(read_patch)
+        analysis_df = xrd_make_analysis_dataframe_from_hdf5(hdf5_file["xrd"])
+    assert not set(XRD_FRAME_REDUCTIONS_UNITS) & set(analysis_df.columns)
+
+    with h5py.File(integrated_library_path, "a") as hdf5_file:
+        assert update_xrd_hdf5(hdf5_file["xrd"])
+        # Positions with reductions are not reduced again
+        assert xrd_write_dataset_reductions(hdf5_file["xrd"]) == 0
+
+    with h5py.File(integrated_library_path, "r") as hdf5_file:
+        analysis_df = xrd_make_analysis_dataframe_from_hdf5(hdf5_file["xrd"])
+    assert analysis_df[list(XRD_FRAME_REDUCTIONS_UNITS)].notna().all().all()
+
+
+def read_export_folder(folder_path):
+    return {path.name: path.read_bytes() for path in sorted(Path(folder_path).iterdir())}
+
+
+def test_export_on_process_pool(integrated_library_path, tmp_path):
+    summary = xrd_export_dataset(integrated_library_path, "xrd", tmp_path / "serial", save_image=True, workers=1)
+    pooled_summary = xrd_export_dataset(
+        integrated_library_path, "xrd", tmp_path / "pooled", save_image=True, workers=2, read_ahead=1
+    )
+
+    assert summary["positions"] == pooled_summary["positions"] == NB_IMAGES
+    serial_files = read_export_folder(tmp_path / "serial")
+    assert read_export_folder(tmp_path / "pooled") == serial_files
+    assert set(serial_files) == (
+        {f"{i}.xy" for i in range(1, NB_IMAGES + 1)}
+        | {f"{i}.img" for i in range(1, NB_IMAGES + 1)}
+        | {XRD_EXPORT_MANIFEST, "sum.xy"}
+    )
+
+    integrated_dict = read_integrated(integrated_library_path)
+    exported = np.loadtxt(tmp_path / "serial" / "3.xy")
+    with h5py.File(integrated_library_path, "r") as hdf5_file:
+        np.testing.assert_allclose(exported[:, 0], hdf5_file["xrd/positions/(2.0,-2.0)/measurement/integrated/tth"])
+    np.testing.assert_allclose(exported[:, 1], integrated_dict["(2.0,-2.0)"]["counts"], rtol=1e-9)
+    summed = np.loadtxt(tmp_path / "serial" / "sum.xy")
+    np.testing.assert_allclose(summed[:, 1], sum(value["counts"] for value in integrated_dict.values()), rtol=1e-9)
+
+
+def test_export_manifest(integrated_library_path, tmp_path):
+    xrd_export_dataset(integrated_library_path, "xrd", tmp_path / "export", workers=1)
+
+    manifest_df = pd.read_csv(tmp_path / "export" / XRD_EXPORT_MANIFEST)
+    assert list(manifest_df["position"]) == [f"({i}.0,{-i}.0)" for i in range(NB_IMAGES)]
+    assert list(manifest_df["file"]) == [f"{i}.xy" for i in range(1, NB_IMAGES + 1)]
+    assert manifest_df["image_file"].isna().all()
+    np.testing.assert_array_equal(manifest_df["x_pos (mm)"], np.arange(NB_IMAGES))
+    np.testing.assert_array_equal(manifest_df["y_pos (mm)"], -np.arange(NB_IMAGES))
+    position_dict = dict(zip(manifest_df["file"].str[:-3], manifest_df["position"]))
+    assert xrd_read_export_manifest(tmp_path / "export") == position_dict
+
+
+@pytest.mark.parametrize("archive", list(XRD_EXPORT_ARCHIVES))
+def test_export_archive(integrated_library_path, tmp_path, archive):
+    xrd_export_dataset(integrated_library_path, "xrd", tmp_path / "folder", save_image=True, workers=1)
+    summary = xrd_export_dataset(
+        integrated_library_path, "xrd", tmp_path / "export", archive=archive, save_image=True, workers=2
+    )
+
+    assert summary["path"] == tmp_path / f"export{XRD_EXPORT_ARCHIVES[archive]}"
+    if archive == "zip":
+        with zipfile.ZipFile(summary["path"]) as archive_file:
+            archive_dict = {name: archive_file.read(name) for name in archive_file.namelist()}
+    else:
+        with tarfile.open(summary["path"]) as archive_file:
+            archive_dict = {member.name: archive_file.extractfile(member).read() for member in archive_file}
+    assert archive_dict == read_export_folder(tmp_path / "folder")
+    # Files are moved into the archive, nothing is left next to it
+    assert sorted(path.name for path in tmp_path.iterdir() if path.name.startswith("tmp")) == []
+
+
+def test_export_unknown_archive(integrated_library_path, tmp_path):
+    with pytest.raises(KeyError):
+        xrd_export_dataset(integrated_library_path, "xrd", tmp_path / "export", archive="rar")
+
+
+@pytest.fixture
+def poni(poni_path):
+    functions_xrd.xrd_clear_engine_memory()
+    return pyFAI.load(str(poni_path))
+
+
+def masked_poni(poni):
+    mask = np.zeros(IMAGE_SHAPE, dtype="int8")
+    mask[:, :3] = 1
+    mask[10:14, 20:30] = 1
+    poni.detector.mask = mask
+    return poni
+
+
+@pytest.mark.parametrize("masked", [False, True])
+def test_persisted_engine_matches_pyfai(poni, tmp_path, masked):
+    if masked:
+        poni = masked_poni(poni)
+    for image in make_images():
+        q, intensity = xrd_integrate_with_persisted_engine(poni, image, POINTS, cache_folder=tmp_path)
+        reference = poni.integrate1d(image, POINTS, method="no_csr_cython", unit="q_nm^-1")
+        np.testing.assert_allclose(q, reference[0], rtol=1e-10)
+        # pyFAI accumulates the signal in single precision
+        np.testing.assert_allclose(intensity, reference[1], rtol=1e-6)
+
+
+def test_persisted_engine_is_reused(poni, tmp_path, monkeypatch):
+    image = make_images(1)[0]
+    q, intensity = xrd_integrate_with_persisted_engine(poni, image, POINTS, cache_folder=tmp_path)
+    assert [path.name for path in tmp_path.iterdir()] == [f"{xrd_engine_key(poni, IMAGE_SHAPE, POINTS)}.npz"]
+
+    # A new session loads the engine from the folder without asking pyFAI for it again
+    functions_xrd.xrd_clear_engine_memory()
+    monkeypatch.setattr(type(poni), "setup_sparse_integrator", None)
+    loaded_q, loaded_intensity = xrd_integrate_with_persisted_engine(poni, image, POINTS, cache_folder=tmp_path)
+    np.testing.assert_array_equal(loaded_q, q)
+    np.testing.assert_array_equal(loaded_intensity, intensity)
+
+
+def test_engine_key(poni):
+    key = xrd_engine_key(poni, IMAGE_SHAPE, POINTS)
+    assert xrd_engine_key(poni, IMAGE_SHAPE, POINTS) == key
+    assert xrd_engine_key(poni, IMAGE_SHAPE, POINTS + 1) != key
+    assert xrd_engine_key(poni, IMAGE_SHAPE, POINTS, unit="2th_deg") != key
+    assert xrd_engine_key(masked_poni(poni), IMAGE_SHAPE, POINTS) != key
+
+
+def assert_same_as_pyfai(poni, frames, q, intensity, totals):
+    for frame, frame_intensity, total in zip(frames, intensity, totals):
+        reference = poni.integrate1d(frame, POINTS, method="no_csr_cython", unit="q_nm^-1")
+        np.testing.assert_allclose(q, reference[0], rtol=1e-10)
+        np.testing.assert_allclose(frame_intensity, reference[1], rtol=1e-6)
+        np.testing.assert_allclose(total, np.sum(frame), rtol=1e-12)
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, NB_IMAGES])
+@pytest.mark.parametrize("masked", [False, True])
+def test_integrate_stack_matches_pyfai(poni, tmp_path, batch_size, masked):
+    if masked:
+        poni = masked_poni(poni)
+    frames = make_images()
+    q, intensity, totals = xrd_integrate_stack(poni, frames, POINTS, cache_folder=tmp_path, batch_size=batch_size)
+
+    assert intensity.shape == (NB_IMAGES, POINTS)
+    assert_same_as_pyfai(poni, frames, q, intensity, totals)
+
+
+def test_integrate_stack_left_out_pixels(poni, tmp_path):
+    # NaN pixels and pixels at the dummy value of the detector are left out of their own frame only
+    poni.detector.dummy, poni.detector.delta_dummy = -1.0, 0.5
+    frames = make_images().astype("float64")
+    frames[1, 5:9, 5:9] = np.nan
+    frames[3, 30:, :] = -1.0
+    q, intensity, totals = xrd_integrate_stack(poni, frames, POINTS, cache_folder=tmp_path, batch_size=2)
+
+    for frame, frame_intensity in zip(frames, intensity):
+        reference = poni.integrate1d(frame, POINTS, method="no_csr_cython", unit="q_nm^-1")
+        np.testing.assert_allclose(frame_intensity, reference[1], rtol=1e-6)
+    # Total counts keep every pixel like np.sum, NaN included
+    np.testing.assert_allclose(totals, np.sum(frames, axis=(1, 2)), rtol=1e-12)
+
+
+def test_batched_reintegration(image_library_path, poni_path):
+    poni = pyFAI.load(str(poni_path))
+    summary = xrd_reintegrate_dataset_parallel(
+        image_library_path, "xrd", poni_path, "integrate1d", POINTS, method="batched_csr", workers=2
+    )
+    assert summary["frames"] == NB_IMAGES
+    # The batched engine is persisted in the engine folder of the library fixture
+    assert len(os.listdir(functions_xrd.XRD_ENGINE_CACHE_FOLDER)) == 1
+
+    integrated_dict = read_integrated(image_library_path)
+    for image, integrated in zip(make_images(), integrated_dict.values()):
+        reference = poni.integrate1d(image, POINTS, method="no_csr_cython", unit="q_nm^-1")
+        np.testing.assert_allclose(integrated["q"], reference[0], rtol=1e-10)
+        np.testing.assert_allclose(integrated["counts"], reference[1] / np.sum(reference[1]) * np.sum(image), rtol=1e-6)
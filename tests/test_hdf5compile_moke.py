@@ -0,0 +1,77 @@
+"""
+Tests of the MOKE text files parsed and of the MOKE database built on pools of spawned processes against the same
+work done in the current process.
+"""
+import h5py
+import numpy as np
+import pytest
+
+from benchmarks.benchmark_moke_parsers import make_moke_benchmark_folder
+from modules.functions.functions_moke import MOKE_SHOT_CHANNELS
+from modules.hdf5_compilers import hdf5compile_moke
+from modules.hdf5_compilers.hdf5compile_moke import (
+    moke_build_database,
+    moke_iterate_position_data,
+    moke_scan_source_folder,
+    moke_start_parse_pool,
+)
+from tests.test_functions_moke import assert_same_results, make_synthetic_shot, make_treatment_dict
+
+NB_POSITIONS = 6
+
+
+@pytest.fixture
+def hdf5_path(tmp_path):
+    """Library with a MOKE dataset of a few positions, one mean shot each"""
+    hdf5_path = tmp_path / "library.hdf5"
+    with h5py.File(hdf5_path, "w") as hdf5_file:
+        moke_group = hdf5_file.create_group("moke")
+        moke_group.attrs["HT_type"] = "moke"
+        positions_group = moke_group.create_group("positions")
+        for i in range(NB_POSITIONS):
+            shot = make_synthetic_shot(coercivity=0.1 + 0.05 * i, seed=i)
+            measurement_group = positions_group.create_group(f"({i}.0,0.0)/measurement")
+            measurement_group.attrs["measurement_stamp"] = f"stamp_{i}"
+            mean_shot_group = measurement_group.create_group("shot_mean")
+            for channel in MOKE_SHOT_CHANNELS:
+                mean_shot_group.create_dataset(f"{channel}_mean", data=shot[channel])
+        positions_group.create_group("scan_parameters")
+    return hdf5_path
+
+
+def read_written_positions(hdf5_path):
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        positions_group = hdf5_file["moke/positions"]
+        return [position for position in positions_group if "results" in positions_group[position]]
+
+
+def test_build_database_on_process_pool(hdf5_path):
+    treatment_dict = make_treatment_dict(correct_offset=True, smoothing=True)
+
+    serial_dict, _ = moke_build_database(hdf5_path, "moke", treatment_dict, workers=1)
+    pooled_dict, skipped_list = moke_build_database(hdf5_path, "moke", treatment_dict, workers=2, chunk_size=2)
+
+    assert skipped_list == []
+    assert list(pooled_dict) == list(serial_dict)
+    assert_same_results(serial_dict, pooled_dict)
+    assert len(read_written_positions(hdf5_path)) == NB_POSITIONS
+
+
+
+def test_parse_pool_matches_main_process(tmp_path, monkeypatch):
+    make_moke_benchmark_folder(tmp_path, nb_positions=5, nb_samples=200, nb_shots=3)
+    _, path_dict = moke_scan_source_folder(tmp_path)
+    assert moke_start_parse_pool(path_dict, workers=2) is None
+
+    monkeypatch.setattr(hdf5compile_moke, "MOKE_PARSE_PARALLEL_MIN_POSITIONS", 2)
+    assert moke_start_parse_pool(path_dict, workers=1) is None
+    serial_dict = {scan_number: data for scan_number, _, data in moke_iterate_position_data(path_dict)}
+    with moke_start_parse_pool(path_dict, workers=2) as executor:
+        pooled_dict = {
+            scan_number: data for scan_number, _, data in moke_iterate_position_data(path_dict, executor, batch_size=2)
+        }
+
+    assert list(pooled_dict) == list(serial_dict) == ["1", "2", "3", "4", "5"]
+    for scan_number, serial_data in serial_dict.items():
+        for pooled_array, serial_array in zip(pooled_dict[scan_number], serial_data):
+            np.testing.assert_array_equal(pooled_array, serial_array)
@@ -0,0 +1,103 @@
+"""
+Tests of the settings and dtype resolution of the dataset creation policies.
+"""
+import h5py
+import numpy as np
+import pytest
+
+from modules.hdf5_compilers.hdf5compile_policy import (
+    DATASET_POLICIES,
+    HDF5_DATASET_POLICY,
+    create_policy_dataset,
+    get_dataset_kwargs,
+    get_dataset_settings,
+)
+
+TRACE = np.linspace(0, 1, 100)
+
+
+def test_settings_most_specific_key():
+    policy = DATASET_POLICIES["compact"]
+    assert get_dataset_settings("trace", policy="compact") == policy["trace"]
+    assert get_dataset_settings("trace", instrument="moke", policy="compact") == policy["moke/trace"]
+    assert get_dataset_settings("trace", instrument="moke", name="magnetization", policy="compact") == (
+        policy["moke/trace"]
+    )
+    assert get_dataset_settings("trace", instrument="moke", name="integrated_pulse", policy="compact") == (
+        policy["moke/trace/integrated_pulse"]
+    )
+    assert get_dataset_settings("unknown_role", policy="compact") == {}
+
+
+@pytest.mark.parametrize("policy", list(DATASET_POLICIES))
+def test_writer_dtype_kept_without_policy_dtype(policy):
+    # Only the compact policy changes the precision of the traces, every other role keeps the writer dtype
+    for role in ["detector_image", "spectrum", "axis"]:
+        assert get_dataset_kwargs(TRACE, role, dtype="float64", policy=policy).get("dtype") == "float64"
+    if policy != "compact":
+        kwargs = get_dataset_kwargs(TRACE, "trace", instrument="moke", name="magnetization", policy=policy)
+        assert "dtype" not in kwargs
+
+
+def test_compact_traces_in_single_precision():
+    kwargs = get_dataset_kwargs(TRACE, "trace", instrument="moke", name="magnetization", policy="compact")
+    assert kwargs["dtype"] == "float32"
+    kwargs = get_dataset_kwargs(TRACE, "trace", instrument="moke", name="integrated_pulse", policy="compact")
+    assert kwargs["dtype"] == "float64"
+
+
+def test_integer_data_keeps_its_dtype():
+    counts = np.arange(100, dtype="int32")
+    assert "dtype" not in get_dataset_kwargs(counts, "trace", instrument="moke", policy="compact")
+    kwargs = get_dataset_kwargs(counts, "trace", instrument="moke", dtype="int32", policy="compact")
+    assert kwargs["dtype"] == "int32"
+
+
+def test_scalars_and_strings_are_not_chunked():
+    assert get_dataset_kwargs(1.0, "axis", policy="compact") == {}
+    assert get_dataset_kwargs(np.array(["a", "b"]), "axis", policy="compact") == {}
+
+
+@pytest.mark.parametrize(
+    "policy, dtype", [("legacy", "float64"), ("balanced", "float64"), ("fast", "float64"), ("compact", "float32")]
+)
+def test_shot_statistics_dtype(tmp_path, policy, dtype):
+    # Derived datasets are resolved with the name of their channel
+    with h5py.File(tmp_path / "policy.hdf5", "w") as hdf5_file:
+        mean_node = create_policy_dataset(
+            hdf5_file, "magnetization_mean", TRACE, "trace", instrument="moke", policy=policy,
+            settings_name="magnetization",
+        )
+        pulse_node = create_policy_dataset(
+            hdf5_file, "integrated_pulse_mean", TRACE, "trace", instrument="moke", policy=policy,
+            settings_name="integrated_pulse",
+        )
+        assert mean_node.dtype == np.dtype(dtype)
+        assert pulse_node.dtype == np.dtype("float64")
+
+
+def test_empty_dataset_chunked_by_column(tmp_path):
+    with h5py.File(tmp_path / "policy.hdf5", "w") as hdf5_file:
+        node = create_policy_dataset(
+            hdf5_file, "magnetization", None, "trace", instrument="moke", policy="balanced", shape=(1000, 10)
+        )
+        assert node.shape == (1000, 10)
+        assert node.chunks == (1000, 1)
+        assert node.dtype == np.dtype("float64")
+
+
+def test_default_policy_uses_standard_filters(tmp_path):
+    # LZF ships with h5py only, libraries written with the default policy have to open in any HDF5 reader
+    for settings in DATASET_POLICIES[HDF5_DATASET_POLICY].values():
+        assert settings.get("compression") in [None, "gzip"]
+    with h5py.File(tmp_path / "policy.hdf5", "w") as hdf5_file:
+        image_node = create_policy_dataset(hdf5_file, "2Dimage", np.ones((64, 64)), "detector_image", instrument="xrd")
+        trace_node = create_policy_dataset(hdf5_file, "magnetization", np.ones((100, 4)), "trace", instrument="moke")
+        assert image_node.compression == trace_node.compression == "gzip"
+        assert image_node.shuffle and trace_node.shuffle
+
+
+def test_lzf_is_opt_in(tmp_path):
+    with h5py.File(tmp_path / "policy.hdf5", "w") as hdf5_file:
+        node = create_policy_dataset(hdf5_file, "2Dimage", np.ones((64, 64)), "detector_image", policy="fast")
+        assert node.compression == "lzf"